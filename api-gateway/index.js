@@ -12,6 +12,9 @@ const app = express();
 app.use(cors({
   origin: 'http://localhost:5173',
   credentials: true,
+  // Cursor de la página siguiente en los listados paginados y aviso de
+  // respuesta repetida por Idempotency-Key
+  exposedHeaders: ['X-Siguiente-Cursor', 'Idempotent-Replayed'],
 }));
 
 // Autenticación con JWT
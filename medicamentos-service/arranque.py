@@ -0,0 +1,120 @@
+from typing import Awaitable, Callable, List, Tuple
+from uuid import UUID
+import asyncio
+import logging
+import os
+import time
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import engine, engine_lectura, metricas_pool, AsyncSessionLectura
+
+# ---------------------------------------------------------
+# Arranque del servicio
+#
+# En vez de create_all (que refleja el esquema y compite entre réplicas
+# que arrancan juntas), el arranque solo compara la versión aplicada en
+# version_esquema con la que el servicio necesita; el esquema lo
+# administra migraciones/. Si la versión no alcanza, el proceso termina.
+#
+# Luego, en segundo plano, abre las conexiones del pool y ejecuta una vez
+# las consultas frecuentes del servicio (así quedan compiladas en la
+# caché de SQLAlchemy). Mientras tanto GET /salud/listo responde 503;
+# después responde 200 con los tiempos de cada etapa. GET /salud/pool
+# muestra las métricas del pool de conexiones.
+#
+# Este archivo es igual en todos los servicios Python.
+# ---------------------------------------------------------
+
+INICIO_PROCESO = time.perf_counter()
+
+CONEXIONES_A_CALENTAR = int(os.getenv("ARRANQUE_CONEXIONES", "5"))
+
+# Id que no existe, para ejecutar las consultas de calentamiento
+ID_CALENTAMIENTO = UUID(int=0)
+
+# (nombre, función que ejecuta la consulta con la sesión dada)
+ConsultaCaliente = Tuple[str, Callable[[AsyncSession], Awaitable]]
+
+logger = logging.getLogger(__name__)
+
+estado = {
+    "listo": False,
+    "error": None,
+    "version_esquema": None,
+    "tiempos_ms": {},
+}
+
+def _ms(desde: float) -> float:
+    return round((time.perf_counter() - desde) * 1000, 1)
+
+async def verificar_esquema(version_requerida: int) -> int:
+    try:
+        async with engine.connect() as conn:
+            version = await conn.scalar(text("SELECT max(version) FROM version_esquema"))
+    except ProgrammingError:
+        raise RuntimeError("La base no tiene version_esquema: ejecute migraciones (python migrar.py aplicar)")
+    if version is None or version < version_requerida:
+        raise RuntimeError(
+            f"El esquema está en la versión {version} y el servicio necesita la {version_requerida}: "
+            "ejecute migraciones (python migrar.py aplicar)"
+        )
+    return version
+
+async def _calentar_pool(motor):
+    # Las conexiones se piden a la vez para que el pool abra varias
+    async def usar():
+        async with motor.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    await asyncio.gather(*(usar() for _ in range(CONEXIONES_A_CALENTAR)))
+
+async def _calentar(consultas: List[ConsultaCaliente]):
+    inicio = time.perf_counter()
+    await _calentar_pool(engine)
+    if engine_lectura is not engine:
+        await _calentar_pool(engine_lectura)
+    estado["tiempos_ms"]["pool"] = _ms(inicio)
+
+    for nombre, consulta in consultas:
+        inicio = time.perf_counter()
+        # Cada consulta en su propia sesión, que se descarta sin commit
+        async with AsyncSessionLectura() as session:
+            try:
+                await consulta(session)
+            except HTTPException:
+                # p. ej. 404 por el id inexistente: la consulta ya se ejecutó
+                pass
+        estado["tiempos_ms"][f"consulta {nombre}"] = _ms(inicio)
+
+async def _calentar_en_segundo_plano(consultas: List[ConsultaCaliente]):
+    try:
+        await _calentar(consultas)
+    except Exception as e:
+        # El servicio puede atender igual, solo sin el calentamiento completo
+        estado["error"] = f"Calentamiento fallido: {e}"
+        logger.exception("Error al calentar el servicio")
+    estado["tiempos_ms"]["arranque_a_listo"] = _ms(INICIO_PROCESO)
+    estado["listo"] = True
+    logger.info("Servicio listo: %s", estado["tiempos_ms"])
+
+def registrar(app: FastAPI, version_requerida: int, consultas: List[ConsultaCaliente]):
+    @app.on_event("startup")
+    async def arrancar():
+        inicio = time.perf_counter()
+        estado["version_esquema"] = await verificar_esquema(version_requerida)
+        estado["tiempos_ms"]["esquema"] = _ms(inicio)
+        app.state.calentamiento = asyncio.create_task(_calentar_en_segundo_plano(consultas))
+
+    @app.get("/salud/listo", include_in_schema=False)
+    async def listo():
+        return JSONResponse(estado, status_code=200 if estado["listo"] else 503)
+
+    # Uso del pool de conexiones: si "esperas" y "agotamientos" crecen, el
+    # pool es chico para la concurrencia (ver DB_POOL_SIZE y DB_MAX_OVERFLOW)
+    @app.get("/salud/pool", include_in_schema=False)
+    async def pool():
+        return metricas_pool()
@@ -0,0 +1,42 @@
+import asyncio
+import logging
+import os
+
+from database import AsyncSessionLocal
+from crud import stock
+
+# ---------------------------------------------------------
+# Barrido periódico de reservas vencidas
+#
+# Cada RESERVAS_BARRIDO_SEGUNDOS libera las reservas de lote cuyo
+# expira_en ya pasó, en grupos de RESERVAS_BARRIDO_LOTE con un commit por
+# grupo. Mientras un grupo sale completo se sigue barriendo sin esperar.
+# ---------------------------------------------------------
+
+INTERVALO_SEGUNDOS = float(os.getenv("RESERVAS_BARRIDO_SEGUNDOS", "30"))
+TAMANO_LOTE = int(os.getenv("RESERVAS_BARRIDO_LOTE", "500"))
+
+logger = logging.getLogger(__name__)
+
+async def barrer_reservas_vencidas() -> int:
+    total = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            liberadas = await stock.liberar_reservas_expiradas(session, TAMANO_LOTE)
+            await session.commit()
+        total += liberadas
+        if liberadas < TAMANO_LOTE:
+            return total
+
+async def ciclo_barrido():
+    while True:
+        try:
+            liberadas = await barrer_reservas_vencidas()
+            if liberadas:
+                logger.info("Reservas vencidas liberadas: %d", liberadas)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Un fallo puntual (p. ej. la base no disponible) no detiene el barrido
+            logger.exception("Error al liberar reservas vencidas")
+        await asyncio.sleep(INTERVALO_SEGUNDOS)
@@ -0,0 +1,73 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from time import monotonic
+from uuid import UUID
+import os
+
+# ---------------------------------------------------------
+# Caché en proceso con tamaño acotado (LRU) y expiración (TTL).
+# Pensada para el catálogo, que casi no cambia; no es compartida
+# entre réplicas, por eso cada entrada expira aunque no se invalide.
+# ---------------------------------------------------------
+class CacheTTL:
+    def __init__(self, max_entradas: int, ttl_segundos: float):
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self._entradas = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+
+    def obtener(self, clave):
+        entrada = self._entradas.get(clave)
+        if entrada is None or entrada[0] < monotonic():
+            if entrada is not None:
+                del self._entradas[clave]
+            self.fallos += 1
+            return None
+
+        self._entradas.move_to_end(clave)
+        self.aciertos += 1
+        return entrada[1]
+
+    def guardar(self, clave, valor):
+        self._entradas[clave] = (monotonic() + self.ttl_segundos, valor)
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+
+    def invalidar(self, clave) -> bool:
+        self.invalidaciones += 1
+        return self._entradas.pop(clave, None) is not None
+
+    def limpiar(self):
+        self.invalidaciones += len(self._entradas)
+        self._entradas.clear()
+
+    def estadisticas(self) -> dict:
+        consultas = self.aciertos + self.fallos
+        return {
+            "entradas": len(self._entradas),
+            "max_entradas": self.max_entradas,
+            "ttl_segundos": self.ttl_segundos,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "invalidaciones": self.invalidaciones,
+            "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+        }
+
+
+@dataclass(frozen=True)
+class MedicamentoCacheado:
+    id_medicamento: UUID
+    codigo_barras: UUID
+    nombre: str
+    dosis_concentracion: str
+    via_administracion: str
+
+
+# Código de barras -> MedicamentoCacheado
+cache_codigo_barras = CacheTTL(
+    max_entradas=int(os.getenv("CACHE_CODIGO_BARRAS_MAX", "10000")),
+    ttl_segundos=float(os.getenv("CACHE_CODIGO_BARRAS_TTL", "300")),
+)
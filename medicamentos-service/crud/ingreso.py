@@ -0,0 +1,162 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import ValidationError
+from typing import AsyncIterator, List, Optional, Tuple
+import csv
+import json
+
+from crud import stock
+from crud.medicamento import get_medicamentos_por_codigos_barras
+from schemas.medicamento import LoteIngreso
+
+# ---------------------------------------------------------
+# Ingreso masivo de lotes desde un manifiesto de entrega
+#
+# El manifiesto llega como flujo (CSV con encabezado o NDJSON, una fila
+# por línea) y se procesa en grupos: por grupo se resuelven todos los
+# códigos de barras en una consulta, se insertan los lotes con
+# executemany y se hace commit. La memoria queda acotada por el tamaño
+# del grupo; solo se acumulan las filas rechazadas para el reporte.
+# ---------------------------------------------------------
+
+TAMANO_GRUPO = 1000
+
+FORMATO_CSV = "csv"
+FORMATO_NDJSON = "ndjson"
+
+FORMATOS_POR_CONTENT_TYPE = {
+    "text/csv": FORMATO_CSV,
+    "application/x-ndjson": FORMATO_NDJSON,
+    "application/ndjson": FORMATO_NDJSON,
+    "application/jsonl": FORMATO_NDJSON,
+}
+
+# (número de línea, datos de la fila o None, error o None)
+Fila = Tuple[int, Optional[dict], Optional[str]]
+
+ERROR_CODIFICACION = "La línea no es UTF-8 válido"
+
+def _decodificar(linea: bytes) -> Optional[str]:
+    # None si la línea no es UTF-8; se informa como fila rechazada
+    try:
+        return linea.decode("utf-8").rstrip("\r")
+    except UnicodeDecodeError:
+        return None
+
+async def _lineas(flujo: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Optional[str]]]:
+    pendiente = b""
+    numero = 0
+    async for trozo in flujo:
+        pendiente += trozo
+        *completas, pendiente = pendiente.split(b"\n")
+        for linea in completas:
+            numero += 1
+            yield numero, _decodificar(linea)
+    if pendiente:
+        yield numero + 1, _decodificar(pendiente)
+
+async def _filas_csv(flujo: AsyncIterator[bytes]) -> AsyncIterator[Fila]:
+    encabezado = None
+    async for numero, linea in _lineas(flujo):
+        if linea is None:
+            yield numero, None, ERROR_CODIFICACION
+            continue
+        if not linea.strip():
+            continue
+        valores = next(csv.reader([linea]))
+        if encabezado is None:
+            encabezado = [columna.strip() for columna in valores]
+            continue
+        if len(valores) != len(encabezado):
+            yield numero, None, f"Se esperaban {len(encabezado)} columnas y hay {len(valores)}"
+            continue
+        # Las celdas vacías se tratan como valores ausentes
+        yield numero, {k: v for k, v in zip(encabezado, valores) if v != ""}, None
+
+async def _filas_ndjson(flujo: AsyncIterator[bytes]) -> AsyncIterator[Fila]:
+    async for numero, linea in _lineas(flujo):
+        if linea is None:
+            yield numero, None, ERROR_CODIFICACION
+            continue
+        if not linea.strip():
+            continue
+        try:
+            datos = json.loads(linea)
+        except ValueError:
+            yield numero, None, "JSON inválido"
+            continue
+        if not isinstance(datos, dict):
+            yield numero, None, "Se esperaba un objeto JSON"
+            continue
+        yield numero, datos, None
+
+async def _insertar_grupo(session: AsyncSession, grupo: List[Tuple[int, LoteIngreso]], reporte: dict):
+    medicamentos = await get_medicamentos_por_codigos_barras(
+        session, [lote.codigo_barras for _, lote in grupo]
+    )
+
+    valores = []
+    for numero, lote in grupo:
+        medicamento = medicamentos.get(lote.codigo_barras)
+        if medicamento is None:
+            reporte["codigos_desconocidos"].add(lote.codigo_barras)
+            reporte["rechazadas"].append({
+                "linea": numero,
+                "lote": lote.lote,
+                "codigo_barras": lote.codigo_barras,
+                "motivo": "Código de barras desconocido",
+            })
+            continue
+
+        valores.append({
+            "id_medicamento": medicamento.id_medicamento,
+            "lote": lote.lote,
+            "fecha_vencimiento": lote.fecha_vencimiento,
+            "cantidad": lote.cantidad,
+            "cantidad_reservada": 0,
+            "cantidad_defectuosa": lote.cantidad_defectuosa,
+            "cantidad_en_idea": lote.cantidad_en_idea,
+            "cantidad_en_estado": lote.cantidad_en_estado,
+            "cantidad_envase_roto": lote.cantidad_envase_roto,
+        })
+
+    await stock.registrar_lotes(session, valores)
+    await session.commit()
+    reporte["insertadas"] += len(valores)
+
+async def procesar_manifiesto(session: AsyncSession, flujo: AsyncIterator[bytes], formato: str) -> dict:
+    reporte = {
+        "total_filas": 0,
+        "insertadas": 0,
+        "rechazadas": [],
+        "codigos_desconocidos": set(),
+    }
+    filas = _filas_csv(flujo) if formato == FORMATO_CSV else _filas_ndjson(flujo)
+
+    grupo: List[Tuple[int, LoteIngreso]] = []
+    async for numero, datos, error in filas:
+        reporte["total_filas"] += 1
+        if error is None:
+            try:
+                grupo.append((numero, LoteIngreso.parse_obj(datos)))
+            except ValidationError as e:
+                error = "; ".join(
+                    f"{'.'.join(str(p) for p in detalle['loc'])}: {detalle['msg']}" for detalle in e.errors()
+                )
+        if error is not None:
+            lote = (datos or {}).get("lote")
+            reporte["rechazadas"].append({
+                "linea": numero,
+                "lote": str(lote) if lote is not None else None,
+                "codigo_barras": None,
+                "motivo": error,
+            })
+
+        if len(grupo) >= TAMANO_GRUPO:
+            await _insertar_grupo(session, grupo, reporte)
+            grupo = []
+
+    if grupo:
+        await _insertar_grupo(session, grupo, reporte)
+
+    reporte["codigos_desconocidos"] = sorted(reporte["codigos_desconocidos"], key=str)
+    return reporte
@@ -1,10 +1,11 @@
+from sqlalchemy import and_, bindparam, func, literal_column
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException
 from uuid import UUID
-from typing import List
+from typing import Dict, List, Optional
 from datetime import datetime, timezone
+import os
 
 from models import (
     Medicamento,
@@ -13,32 +14,124 @@ from models import (
     MedicamentoPrincipio,
     Receta,
     PrescripcionPrincipio,
-    Entrega
+    Entrega,
+    StockMedicamento,
+    LoteProximo
 )
-from schemas.medicamento import LoteCreateBase  # si ya lo necesitas abajo
-
-async def get_medicamentos(db: AsyncSession):
-    result = await db.execute(select(Medicamento))
-    return result.scalars().all()
+from schemas.medicamento import LoteCreateBase, ReporteDefectoLote, TipoDefecto
+from crud import stock
+from cache import cache_codigo_barras, MedicamentoCacheado
+from paginacion import paginar
+
+# Duración por defecto de una reserva de stock sobre un lote
+RESERVA_TTL_MINUTOS = int(os.getenv("RESERVA_TTL_MINUTOS", "60"))
+
+# Los listados proyectan solo las columnas de la respuesta y devuelven filas
+# (Row) en vez de objetos ORM, que aquí no se modifican.
+async def get_medicamentos(db: AsyncSession, limite: Optional[int] = None, cursor: Optional[str] = None):
+    stmt = select(
+        Medicamento.id_medicamento,
+        Medicamento.nombre,
+        Medicamento.dosis_concentracion,
+        Medicamento.via_administracion,
+    )
+    return await paginar(db, stmt, (Medicamento.id_medicamento,), limite, cursor)
 
-async def get_lotes_por_medicamento(session: AsyncSession, id_medicamento: UUID):
-    result = await session.execute(
-        select(MedicamentoLote).where(MedicamentoLote.id_medicamento == id_medicamento)
+async def get_lotes_por_medicamento(
+    session: AsyncSession,
+    id_medicamento: UUID,
+    limite: Optional[int] = None,
+    cursor: Optional[str] = None,
+    solo_disponibles: bool = False,
+    vence_antes: Optional[datetime] = None
+):
+    stmt = (
+        select(
+            MedicamentoLote.id_lote,
+            MedicamentoLote.lote,
+            MedicamentoLote.fecha_vencimiento,
+            MedicamentoLote.cantidad,
+            MedicamentoLote.cantidad_reservada,
+            MedicamentoLote.cantidad_defectuosa,
+            MedicamentoLote.cantidad_en_idea,
+            MedicamentoLote.cantidad_en_estado,
+            MedicamentoLote.cantidad_envase_roto,
+            MedicamentoLote.id_medicamento,
+        )
+        .where(MedicamentoLote.id_medicamento == id_medicamento)
     )
-    return result.scalars().all()
+    if solo_disponibles:
+        stmt = stmt.where(stock.DISPONIBLE > 0)
+    if vence_antes is not None:
+        stmt = stmt.where(MedicamentoLote.fecha_vencimiento < vence_antes)
+
+    orden = (MedicamentoLote.fecha_vencimiento, MedicamentoLote.id_lote)
+    return await paginar(session, stmt, orden, limite, cursor)
+
+# Consultas por clave armadas una sola vez: en cada petición solo cambian
+# los parámetros, sin reconstruir la sentencia ni su clave de caché
+_COLUMNAS_CACHEADAS = (
+    Medicamento.id_medicamento,
+    Medicamento.codigo_barras,
+    Medicamento.nombre,
+    Medicamento.dosis_concentracion,
+    Medicamento.via_administracion,
+)
+
+_MEDICAMENTO_POR_CODIGO = select(*_COLUMNAS_CACHEADAS).where(
+    Medicamento.codigo_barras == bindparam("codigo_barras")
+)
+
+_MEDICAMENTOS_POR_CODIGOS = select(*_COLUMNAS_CACHEADAS).where(
+    Medicamento.codigo_barras.in_(bindparam("codigos_barras", expanding=True))
+)
 
 async def get_medicamento_por_codigo_barras(session: AsyncSession, codigo_barras: UUID):
-    result = await session.execute(
-        select(Medicamento).where(Medicamento.codigo_barras == codigo_barras)
-    )
-    return result.scalars().first()
+    medicamento = cache_codigo_barras.obtener(codigo_barras)
+    if medicamento is not None:
+        return medicamento
+
+    result = await session.execute(_MEDICAMENTO_POR_CODIGO, {"codigo_barras": codigo_barras})
+    fila = result.first()
+    if fila is None:
+        return None
+
+    medicamento = MedicamentoCacheado(**fila._mapping)
+    cache_codigo_barras.guardar(codigo_barras, medicamento)
+    return medicamento
+
+async def get_medicamentos_por_codigos_barras(session: AsyncSession, codigos_barras) -> Dict[UUID, MedicamentoCacheado]:
+    # Resuelve varios códigos a la vez: primero la caché, el resto en una sola consulta
+    encontrados: Dict[UUID, MedicamentoCacheado] = {}
+    faltantes = []
+    for codigo_barras in set(codigos_barras):
+        medicamento = cache_codigo_barras.obtener(codigo_barras)
+        if medicamento is None:
+            faltantes.append(codigo_barras)
+        else:
+            encontrados[codigo_barras] = medicamento
+
+    if faltantes:
+        result = await session.execute(_MEDICAMENTOS_POR_CODIGOS, {"codigos_barras": faltantes})
+        for fila in result:
+            medicamento = MedicamentoCacheado(**fila._mapping)
+            cache_codigo_barras.guardar(medicamento.codigo_barras, medicamento)
+            encontrados[medicamento.codigo_barras] = medicamento
+
+    return encontrados
+
+def invalidar_codigo_barras(codigo_barras: Optional[UUID] = None):
+    # Sin código limpia la caché completa
+    if codigo_barras is None:
+        cache_codigo_barras.limpiar()
+    else:
+        cache_codigo_barras.invalidar(codigo_barras)
 
 async def crear_lote_por_codigo(session: AsyncSession, data: LoteCreateBase):
     # Buscar el medicamento por código de barras
-    result = await session.execute(
-        select(Medicamento).where(Medicamento.codigo_barras == data.codigo_barras)
-    )
-    medicamento = result.scalar_one_or_none()
+    medicamento = await get_medicamento_por_codigo_barras(session, data.codigo_barras)
+    if medicamento is None:
+        raise HTTPException(status_code=404, detail="Medicamento no encontrado")
     data.cantidad_reservada = 0
 
     # Si no hay defectuosos, inicializamos todos esos campos en 0
@@ -53,144 +146,272 @@ async def crear_lote_por_codigo(session: AsyncSession, data: LoteCreateBase):
         lote=data.lote,
         fecha_vencimiento=data.fecha_vencimiento,
         cantidad=data.cantidad,
+        cantidad_reservada=data.cantidad_reservada,
         cantidad_defectuosa=data.cantidad_defectuosa,
         cantidad_en_idea=data.cantidad_en_idea,
         cantidad_en_estado=data.cantidad_en_estado,
         cantidad_envase_roto=data.cantidad_envase_roto,
     )
 
-    session.add(lote)
+    await stock.registrar_lote(session, lote)
     await session.commit()
-    await session.refresh(lote)
 
     return lote
 
-async def obtener_todos_los_principios(session: AsyncSession):
-    result = await session.execute(select(PrincipioActivo))
-    return result.scalars().all()
+async def obtener_todos_los_principios(session: AsyncSession, limite: Optional[int] = None, cursor: Optional[str] = None):
+    stmt = select(
+        PrincipioActivo.id_principio,
+        PrincipioActivo.nombre,
+        PrincipioActivo.categoria,
+    )
+    return await paginar(session, stmt, (PrincipioActivo.id_principio,), limite, cursor)
 
 async def obtener_detalle_por_principio(session: AsyncSession, id_principio: UUID):
+    # Lee los totales ya agregados en StockMedicamento en vez de cargar todos los lotes
     result = await session.execute(
-        select(PrincipioActivo)
+        select(
+            PrincipioActivo.id_principio,
+            PrincipioActivo.nombre.label("nombre_principio"),
+            PrincipioActivo.categoria,
+            Medicamento.id_medicamento,
+            Medicamento.nombre,
+            Medicamento.dosis_concentracion,
+            Medicamento.via_administracion,
+            func.coalesce(StockMedicamento.cantidad, 0).label("cantidad_total"),
+            func.coalesce(StockMedicamento.cantidad_disponible, 0).label("cantidad_disponible"),
+            StockMedicamento.proximo_vencimiento,
+        )
+        .select_from(PrincipioActivo)
+        .outerjoin(MedicamentoPrincipio, MedicamentoPrincipio.id_principio == PrincipioActivo.id_principio)
+        .outerjoin(Medicamento, Medicamento.id_medicamento == MedicamentoPrincipio.id_medicamento)
+        .outerjoin(StockMedicamento, StockMedicamento.id_medicamento == Medicamento.id_medicamento)
         .where(PrincipioActivo.id_principio == id_principio)
-        .options(selectinload(PrincipioActivo.medicamentos).selectinload(Medicamento.lotes))
     )
-    principio = result.scalar_one_or_none()
-    if principio is None:
+    filas = result.all()
+    if not filas:
         return None
 
-    medicamentos = []
-    total_cantidad = 0
-
-    for medicamento in principio.medicamentos:
-        cantidad_medicamento = sum(lote.cantidad for lote in medicamento.lotes if lote.cantidad is not None)
-        total_cantidad += cantidad_medicamento
-        medicamentos.append({
-            "id_medicamento": medicamento.id_medicamento,
-            "nombre": medicamento.nombre,
-            "dosis_concentracion": medicamento.dosis_concentracion,
-            "via_administracion": medicamento.via_administracion,
-            "cantidad_total": cantidad_medicamento
-        })
-
+    medicamentos = [
+        {
+            "id_medicamento": fila.id_medicamento,
+            "nombre": fila.nombre,
+            "dosis_concentracion": fila.dosis_concentracion,
+            "via_administracion": fila.via_administracion,
+            "cantidad_total": fila.cantidad_total,
+            "cantidad_disponible": fila.cantidad_disponible,
+            "proximo_vencimiento": fila.proximo_vencimiento,
+        }
+        for fila in filas if fila.id_medicamento is not None
+    ]
+    vencimientos = [m["proximo_vencimiento"] for m in medicamentos if m["proximo_vencimiento"] is not None]
+
+    principio = filas[0]
     return {
         "id_principio": principio.id_principio,
-        "nombre": principio.nombre,
+        "nombre": principio.nombre_principio,
         "categoria": principio.categoria,
-        "cantidad_total_medicamentos": total_cantidad,
-        "medicamentos_diferentes": len(principio.medicamentos),
+        "cantidad_total_medicamentos": sum(m["cantidad_total"] for m in medicamentos),
+        "cantidad_disponible": sum(m["cantidad_disponible"] for m in medicamentos),
+        "proximo_vencimiento": min(vencimientos, default=None),
+        "medicamentos_diferentes": len(medicamentos),
         "medicamentos": medicamentos
     }
 
 async def entregar_medicamento(session: AsyncSession, lote: str, cantidad: int):
-    result = await session.execute(select(MedicamentoLote).where(MedicamentoLote.lote == lote))
-    lote_obj = result.scalar_one_or_none()
+    lote_obj = await stock.descontar_lote(session, lote, cantidad)
+    await session.commit()
+    return lote_obj
 
-    if lote_obj is None:
-        raise HTTPException(status_code=404, detail="Lote no encontrado")
+# Columna de MedicamentoLote que acumula cada tipo de defecto
+COLUMNA_POR_DEFECTO = {
+    TipoDefecto.defectuoso: "cantidad_defectuosa",
+    TipoDefecto.vencido: "cantidad_en_estado",  # si este campo es el correcto para vencido
+    TipoDefecto.mal_estado: "cantidad_en_idea",  # si este campo representa "mal estado"
+    TipoDefecto.envase_roto: "cantidad_envase_roto",
+}
 
-    if lote_obj.cantidad < cantidad:
-        raise HTTPException(status_code=400, detail="Stock insuficiente para realizar la entrega")
+async def reportar_defecto_en_lote(session: AsyncSession, lote: str, tipo: str, cantidad: int):
+    columna = COLUMNA_POR_DEFECTO.get(tipo)
+    if columna is None:
+        raise HTTPException(status_code=400, detail="Tipo de defecto no válido")
 
-    lote_obj.cantidad -= cantidad
+    lote_obj = await stock.reportar_defecto(session, lote, columna, cantidad)
     await session.commit()
-    await session.refresh(lote_obj)
     return lote_obj
 
-async def reportar_defecto_en_lote(session: AsyncSession, lote: str, tipo: str, cantidad: int):
+async def reportar_defectos_en_lotes(session: AsyncSession, reportes: List[ReporteDefectoLote]):
+    # Resuelve todos los códigos de lote en una consulta; las entradas con
+    # lotes inexistentes o ambiguos se informan sin abortar el resto
+    codigos = {reporte.lote for reporte in reportes}
     result = await session.execute(
-        select(MedicamentoLote).where(MedicamentoLote.lote == lote)
+        select(MedicamentoLote.lote, MedicamentoLote.id_lote).where(MedicamentoLote.lote.in_(codigos))
     )
-    lote_obj = result.scalar_one_or_none()
-    
-    if lote_obj is None:
-        raise HTTPException(status_code=404, detail="Lote no encontrado")
-
-    if tipo == "defectuoso":
-        lote_obj.cantidad_defectuosa += cantidad
-    elif tipo == "vencido":
-        lote_obj.cantidad_en_estado += cantidad  # si este campo es el correcto para vencido
-    elif tipo == "mal_estado":
-        lote_obj.cantidad_en_idea += cantidad  # si este campo representa "mal estado"
-    elif tipo == "envase_roto":
-        lote_obj.cantidad_envase_roto += cantidad
-    else:
-        raise HTTPException(status_code=400, detail="Tipo de defecto no válido")
+    ids_por_codigo: Dict[str, List[UUID]] = {}
+    for fila in result.all():
+        ids_por_codigo.setdefault(fila.lote, []).append(fila.id_lote)
+
+    por_columna: Dict[str, Dict[UUID, int]] = {}
+    rechazados = []
+    for indice, reporte in enumerate(reportes):
+        ids = ids_por_codigo.get(reporte.lote, [])
+        if len(ids) != 1:
+            motivo = "Lote no encontrado" if not ids else "El código de lote corresponde a más de un lote"
+            rechazados.append({"indice": indice, "lote": reporte.lote, "motivo": motivo})
+            continue
+        cantidades = por_columna.setdefault(COLUMNA_POR_DEFECTO[reporte.tipo], {})
+        cantidades[ids[0]] = cantidades.get(ids[0], 0) + reporte.cantidad
 
+    lotes = await stock.reportar_defectos(session, por_columna)
     await session.commit()
-    await session.refresh(lote_obj)
-    return lote_obj
-
-async def get_lote_proximo_vencimiento_info(session: AsyncSession, id_principio: UUID):
-    stmt = (
-        select(MedicamentoLote, Medicamento, PrincipioActivo)
-        .join(Medicamento, Medicamento.id_medicamento == MedicamentoLote.id_medicamento)
-        .join(MedicamentoPrincipio, MedicamentoPrincipio.id_medicamento == Medicamento.id_medicamento)
-        .join(PrincipioActivo, PrincipioActivo.id_principio == MedicamentoPrincipio.id_principio)
-        .where(
-            MedicamentoPrincipio.id_principio == id_principio,
-            MedicamentoLote.cantidad > 0
-        )
-        .order_by(MedicamentoLote.fecha_vencimiento.asc())
-        .limit(1)
+    return {"lotes": lotes, "rechazados": rechazados}
+
+# Lectura por clave de LoteProximo, que las mutaciones de stock mantienen
+_LOTE_PROXIMO = (
+    select(
+        PrincipioActivo.nombre.label("nombre_principio"),
+        Medicamento.nombre.label("nombre_medicamento"),
+        Medicamento.via_administracion,
+        Medicamento.dosis_concentracion,
+        MedicamentoLote.lote.label("numero_lote"),
+        (LoteProximo.fecha_vencimiento <= func.localtimestamp()).label("vencido"),
     )
+    .select_from(LoteProximo)
+    .join(PrincipioActivo, PrincipioActivo.id_principio == LoteProximo.id_principio)
+    .join(MedicamentoLote, MedicamentoLote.id_lote == LoteProximo.id_lote)
+    .join(Medicamento, Medicamento.id_medicamento == MedicamentoLote.id_medicamento)
+    .where(LoteProximo.id_principio == bindparam("id_principio"))
+)
 
-    result = await session.execute(stmt)
+async def get_lote_proximo_vencimiento_info(session: AsyncSession, id_principio: UUID):
+    parametros = {"id_principio": id_principio}
+    result = await session.execute(_LOTE_PROXIMO, parametros)
     row = result.first()
 
+    # El lote guardado venció desde la última mutación: se recalcula el principio
+    if row is not None and row.vencido:
+        await stock.actualizar_lote_proximo(session, [id_principio])
+        await session.commit()
+        result = await session.execute(_LOTE_PROXIMO, parametros)
+        row = result.first()
+
     if not row:
         return None
+    return row
 
-    lote, medicamento, principio = row
+async def reservar_medicamento(session, lote: str, cantidad: int, ttl_minutos: Optional[int] = None):
+    ttl_segundos = (ttl_minutos or RESERVA_TTL_MINUTOS) * 60
+    lote_obj, reserva = await stock.reservar_lote(session, lote, cantidad, ttl_segundos)
+    await session.commit()
 
+    # LoteOut más los datos de la reserva creada
     return {
-        "nombre_principio": principio.nombre,
-        "nombre_medicamento": medicamento.nombre,
-        "via_administracion": medicamento.via_administracion,
-        "dosis_concentracion": medicamento.dosis_concentracion,
-        "numero_lote": lote.lote,
+        **{c.key: getattr(lote_obj, c.key) for c in MedicamentoLote.__table__.columns},
+        "id_reserva_lote": reserva.id_reserva_lote,
+        "cantidad_retenida": reserva.cantidad,
+        "expira_en": reserva.expira_en,
     }
 
-async def reservar_medicamento(session, lote: str, cantidad: int):
-    result = await session.execute(
-        select(MedicamentoLote).where(MedicamentoLote.lote == lote)
-    )
-    lote_obj = result.scalar_one_or_none()
-
-    if lote_obj is None:
-        raise HTTPException(status_code=404, detail="Lote no encontrado")
-
-    if lote_obj.cantidad < cantidad:
-        raise HTTPException(status_code=400, detail="Stock insuficiente para realizar la reserva")
+async def liberar_reserva(session: AsyncSession, id_reserva_lote: UUID):
+    lote_obj = await stock.liberar_reserva(session, id_reserva_lote)
+    await session.commit()
+    return lote_obj
 
-    lote_obj.cantidad_reservada += cantidad
+async def entregar_reserva(session: AsyncSession, id_reserva_lote: UUID):
+    lote_obj = await stock.entregar_reserva(session, id_reserva_lote)
     await session.commit()
-    await session.refresh(lote_obj)
     return lote_obj
 
 # ---------------------------------------------------------
 # Nueva lógica de entrega por receta
 # ---------------------------------------------------------
+def _plan_entrega_receta():
+    # Principios de la receta con las unidades a entregar, calculadas al
+    # crear la prescripción. Quedan en NULL si la duración no se pudo interpretar.
+    principios = (
+        select(
+            Receta.id_receta,
+            Entrega.id_receta.label("id_entrega"),
+            PrescripcionPrincipio.id_principio,
+            PrescripcionPrincipio.duracion,
+            PrincipioActivo.nombre.label("nombre_principio"),
+            PrescripcionPrincipio.unidades_por_receta.label("unidades"),
+            func.sum(PrescripcionPrincipio.unidades_por_receta).over().label("unidades_receta"),
+        )
+        .select_from(Receta)
+        .outerjoin(Entrega, Entrega.id_receta == Receta.id_receta)
+        .outerjoin(PrescripcionPrincipio, PrescripcionPrincipio.id_prescripcion == Receta.id_prescripcion)
+        .outerjoin(PrincipioActivo, PrincipioActivo.id_principio == PrescripcionPrincipio.id_principio)
+        .where(Receta.id_receta == bindparam("id_receta"))
+        .cte("principios")
+    )
+
+    # Lotes no vencidos con stock disponible (sin lo reservado) de cada
+    # principio, en orden FEFO, con la cantidad acumulada de los lotes que
+    # vencen antes. cantidad > 0 va como literal para que coincida con el
+    # índice parcial idx_medicamento_lote_con_stock
+    disponibles = (
+        select(
+            principios.c.id_principio,
+            MedicamentoLote.id_lote,
+            MedicamentoLote.lote,
+            stock.DISPONIBLE.label("cantidad"),
+            Medicamento.nombre.label("nombre_medicamento"),
+            (
+                func.sum(stock.DISPONIBLE).over(
+                    partition_by=principios.c.id_principio,
+                    order_by=(MedicamentoLote.fecha_vencimiento, MedicamentoLote.id_lote)
+                ) - stock.DISPONIBLE
+            ).label("acumulado"),
+        )
+        .select_from(principios)
+        .join(MedicamentoPrincipio, MedicamentoPrincipio.id_principio == principios.c.id_principio)
+        .join(Medicamento, Medicamento.id_medicamento == MedicamentoPrincipio.id_medicamento)
+        .join(MedicamentoLote, MedicamentoLote.id_medicamento == Medicamento.id_medicamento)
+        .where(
+            principios.c.unidades > 0,
+            MedicamentoLote.cantidad > literal_column("0"),
+            stock.DISPONIBLE > 0,
+            MedicamentoLote.fecha_vencimiento > func.localtimestamp()
+        )
+        .cte("disponibles")
+    )
+
+    # Lotes candidatos de cada principio en orden FEFO. Un medicamento
+    # combinado tiene los mismos lotes en varios principios de la receta,
+    # así que la asignación se reparte en procesar_entrega_receta. Basta
+    # con los lotes hasta cubrir las unidades de toda la receta: los demás
+    # principios no pueden consumir más que eso de los lotes compartidos.
+    return (
+        select(
+            principios,
+            disponibles.c.id_lote,
+            disponibles.c.lote,
+            disponibles.c.nombre_medicamento,
+            disponibles.c.cantidad.label("disponible"),
+        )
+        .select_from(principios)
+        .outerjoin(
+            disponibles,
+            and_(
+                disponibles.c.id_principio == principios.c.id_principio,
+                disponibles.c.acumulado < principios.c.unidades_receta
+            )
+        )
+        .order_by(principios.c.id_principio, disponibles.c.acumulado)
+    )
+
+# Se arma una sola vez; se ejecuta con {"id_receta": ...}
+_PLAN_ENTREGA_RECETA = _plan_entrega_receta()
+
+# Bloquea la receta antes de planificar: dos entregas de la misma receta se
+# esperan y la segunda ve la Entrega de la primera (409), en vez de
+# descontar stock dos veces y fallar al insertar Entrega
+_BLOQUEAR_RECETA = (
+    select(Receta.id_receta)
+    .where(Receta.id_receta == bindparam("id_receta"))
+    .with_for_update()
+)
+
 async def procesar_entrega_receta(
     session: AsyncSession,
     id_receta: UUID,
@@ -198,79 +419,79 @@ async def procesar_entrega_receta(
     rut_retiro: str,
     nombre_retiro: str
 ) -> List[dict]:
-    # 1. Obtener la receta
-    result = await session.execute(
-        select(Receta).where(Receta.id_receta == id_receta)
-    )
-    receta = result.scalar_one_or_none()
-    if not receta:
+    # 1. Bloquear la receta y resolver receta, principios y lotes candidatos
+    # en una sola consulta
+    result = await session.execute(_BLOQUEAR_RECETA, {"id_receta": id_receta})
+    if result.first() is None:
         raise HTTPException(status_code=404, detail="Receta no encontrada")
+    result = await session.execute(_PLAN_ENTREGA_RECETA, {"id_receta": id_receta})
+    filas = result.all()
+    if filas[0].id_entrega is not None:
+        raise HTTPException(status_code=409, detail="La receta ya fue entregada")
+
+    # 2. Asignar los lotes en orden FEFO y armar la respuesta por principio;
+    # lo que queda de cada lote se descuenta al asignarlo, así un lote
+    # compartido entre principios nunca se asigna por más de lo disponible
+    respuestas: Dict[UUID, dict] = {}
+    asignaciones: Dict[UUID, int] = {}
+    restante: Dict[UUID, int] = {}
+
+    for fila in filas:
+        if fila.id_principio is None:
+            continue
 
-    # 2. Obtener los principios de la prescripción asociada
-    result = await session.execute(
-        select(PrescripcionPrincipio)
-        .where(PrescripcionPrincipio.id_prescripcion == receta.id_prescripcion)
-    )
-    principios = result.scalars().all()
-
-    respuestas: List[dict] = []
-
-    # 3. Para cada principio, calcular unidades y procesar entrega
-    for pp in principios:
-        # Parseo de "X días"
-        try:
-            dias = int(pp.duracion.split()[0])
-        except Exception:
+        if fila.unidades is None:
             raise HTTPException(
                 status_code=400,
-                detail=f"Formato de duración inválido en principio {pp.id_principio}: {pp.duracion}"
+                detail=f"Formato de duración inválido en principio {fila.id_principio}: {fila.duracion}"
             )
-        unidades = dias // 2
 
-        # Obtener nombre de principio para la respuesta
-        res_princ = await session.execute(
-            select(PrincipioActivo).where(PrincipioActivo.id_principio == pp.id_principio)
-        )
-        princ_obj = res_princ.scalar_one_or_none()
-        nombre_princ = princ_obj.nombre if princ_obj else ""
-
-        if unidades <= 0:
-            respuestas.append({
-                "id_principio": pp.id_principio,
-                "nombre_principio": nombre_princ,
-                "cantidad_solicitada": unidades,
+        item = respuestas.get(fila.id_principio)
+        if item is None:
+            item = respuestas[fila.id_principio] = {
+                "id_principio": fila.id_principio,
+                "nombre_principio": fila.nombre_principio or "",
+                "nombre_medicamento": None,
+                "numero_lote": None,
+                "cantidad_solicitada": fila.unidades,
                 "cantidad_entregada": 0,
-                "estado": "sin_stock"
-            })
-            continue
+                "lotes": [],
+            }
 
-        # Buscar lote óptimo
-        info = await get_lote_proximo_vencimiento_info(session, pp.id_principio)
-        if not info:
-            respuestas.append({
-                "id_principio": pp.id_principio,
-                "nombre_principio": nombre_princ,
-                "cantidad_solicitada": unidades,
-                "cantidad_entregada": 0,
-                "estado": "sin_stock"
-            })
+        if fila.id_lote is None:
+            continue
+        asignado = min(
+            restante.get(fila.id_lote, fila.disponible),
+            item["cantidad_solicitada"] - item["cantidad_entregada"]
+        )
+        if asignado <= 0:
             continue
+        if not item["lotes"]:
+            # El primer lote asignado identifica la entrega del principio
+            item["nombre_medicamento"] = fila.nombre_medicamento
+            item["numero_lote"] = fila.lote
+        item["cantidad_entregada"] += asignado
+        item["lotes"].append({"numero_lote": fila.lote, "cantidad": asignado})
+        asignaciones[fila.id_lote] = asignaciones.get(fila.id_lote, 0) + asignado
+        restante[fila.id_lote] = restante.get(fila.id_lote, fila.disponible) - asignado
+
+    for item in respuestas.values():
+        if item["cantidad_entregada"] == 0:
+            item["estado"] = "sin_stock"
+        elif item["cantidad_entregada"] < item["cantidad_solicitada"]:
+            item["estado"] = "parcial"
+        else:
+            item["estado"] = "entregado"
+
+    # 3. Descontar stock de todos los lotes en un solo UPDATE
+    if asignaciones and not await stock.descontar_lotes(session, asignaciones):
+        await session.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail="El stock cambió durante la entrega, intente nuevamente"
+        )
 
-        # Descontar stock
-        lote_num = info["numero_lote"]
-        lote_actualizado = await entregar_medicamento(session, lote_num, unidades)
-
-        respuestas.append({
-            "id_principio": pp.id_principio,
-            "nombre_principio": info["nombre_principio"],
-            "nombre_medicamento": info["nombre_medicamento"],
-            "numero_lote": lote_num,
-            "cantidad_solicitada": unidades,
-            "cantidad_entregada": unidades,
-            "estado": "entregado"
-        })
-
-    # 4. Registrar la entrega en la tabla Entrega
+    # 4. Registrar la entrega en la tabla Entrega, en la misma transacción
     entrega = Entrega(
         id_receta=id_receta,
         id_funcionario=id_funcionario,
@@ -282,4 +503,4 @@ async def procesar_entrega_receta(
     session.add(entrega)
     await session.commit()
 
-    return respuestas
+    return list(respuestas.values())
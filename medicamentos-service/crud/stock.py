@@ -0,0 +1,375 @@
+from functools import reduce
+import operator
+
+from sqlalchemy import bindparam, column, delete, func, insert, or_, text, update, values, Integer, Interval
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID, insert as pg_insert
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import HTTPException
+from datetime import timedelta
+from uuid import UUID
+from typing import Dict, List, Tuple
+
+from models import (
+    Medicamento,
+    MedicamentoLote,
+    ReservaLote,
+    StockMedicamento
+)
+# Parte compartida con reservas-service; DISPONIBLE y
+# actualizar_lote_proximo se usan también como stock.*
+from existencias import (
+    DISPONIBLE,
+    Deltas,
+    actualizar_lote_proximo,
+    actualizar_resumen,
+    bloquear_lotes,
+    sumar_delta,
+    valores_asignacion,
+)
+
+# Columnas de MedicamentoLote que cuentan como unidades defectuosas
+COLUMNAS_DEFECTO = (
+    "cantidad_defectuosa",
+    "cantidad_en_idea",
+    "cantidad_en_estado",
+    "cantidad_envase_roto",
+)
+
+# ---------------------------------------------------------
+# Mutaciones de stock sobre MedicamentoLote
+#
+# Cada mutación es un UPDATE condicional (WHERE disponible >= :n) con
+# RETURNING: la verificación y el cambio ocurren en la misma sentencia,
+# así dos entregas simultáneas sobre un lote no pueden sobrevender.
+# Cada mutación actualiza además el resumen en StockMedicamento dentro de
+# la misma transacción. Estas funciones no hacen commit; eso queda en
+# manos del llamador.
+#
+# El resumen, LoteProximo y la retención de varios lotes están en
+# existencias.py, que comparte reservas-service.
+# ---------------------------------------------------------
+
+# ---------------------------------------------------------
+# Sentencias frecuentes por código de lote
+#
+# Se arman una sola vez con bindparam y se ejecutan con parámetros: así
+# no se reconstruyen ni se recalcula su clave de caché en cada petición,
+# y el texto SQL es siempre el mismo, lo que permite al driver usar
+# sentencias preparadas en el servidor. Los nombres de los parámetros no
+# pueden coincidir con columnas del UPDATE/INSERT.
+# ---------------------------------------------------------
+def _por_lote(stmt):
+    return stmt.returning(MedicamentoLote).execution_options(populate_existing=True)
+
+_DESCONTAR_LOTE = _por_lote(
+    update(MedicamentoLote)
+    .where(MedicamentoLote.lote == bindparam("codigo_lote"), DISPONIBLE >= bindparam("unidades"))
+    .values(cantidad=MedicamentoLote.cantidad - bindparam("unidades"))
+)
+
+_RESERVAR_LOTE = _por_lote(
+    update(MedicamentoLote)
+    .where(MedicamentoLote.lote == bindparam("codigo_lote"), DISPONIBLE >= bindparam("unidades"))
+    .values(cantidad_reservada=MedicamentoLote.cantidad_reservada + bindparam("unidades"))
+)
+
+_REPORTAR_DEFECTO = {
+    columna: _por_lote(
+        update(MedicamentoLote)
+        .where(MedicamentoLote.lote == bindparam("codigo_lote"))
+        .values({columna: func.coalesce(getattr(MedicamentoLote, columna), 0) + bindparam("unidades")})
+    )
+    for columna in COLUMNAS_DEFECTO
+}
+
+_INSERTAR_RESERVA = (
+    insert(ReservaLote)
+    .values(
+        id_lote=bindparam("lote_reservado"),
+        cantidad=bindparam("unidades"),
+        expira_en=func.localtimestamp() + bindparam("ttl", type_=Interval)
+    )
+    .returning(ReservaLote)
+)
+
+_EXISTE_LOTE = select(MedicamentoLote.id_lote).where(MedicamentoLote.lote == bindparam("codigo_lote")).limit(1)
+
+async def _lote_unico(session: AsyncSession, stmt, lote: str, unidades: int, detalle_insuficiente: str) -> MedicamentoLote:
+    result = await session.execute(stmt, {"codigo_lote": lote, "unidades": unidades})
+    lotes = result.scalars().all()
+
+    if len(lotes) == 1:
+        return lotes[0]
+
+    await session.rollback()
+    if len(lotes) > 1:
+        raise HTTPException(status_code=409, detail="El código de lote corresponde a más de un lote")
+
+    # Solo se consulta de nuevo cuando la mutación falló, para distinguir el error
+    existe = await session.execute(_EXISTE_LOTE, {"codigo_lote": lote})
+    if existe.first() is None:
+        raise HTTPException(status_code=404, detail="Lote no encontrado")
+    raise HTTPException(status_code=400, detail=detalle_insuficiente)
+
+async def registrar_lote(session: AsyncSession, lote_obj: MedicamentoLote) -> MedicamentoLote:
+    session.add(lote_obj)
+    await session.flush()
+
+    defectuosa = sum(getattr(lote_obj, c) or 0 for c in COLUMNAS_DEFECTO)
+    await actualizar_resumen(session, {
+        lote_obj.id_medicamento: (lote_obj.cantidad or 0, lote_obj.cantidad_reservada or 0, defectuosa)
+    })
+    return lote_obj
+
+async def registrar_lotes(session: AsyncSession, lotes: List[dict]):
+    # Inserción masiva (executemany) y un solo upsert del resumen para todo el grupo
+    if not lotes:
+        return
+
+    await session.execute(insert(MedicamentoLote), lotes)
+
+    deltas: Deltas = {}
+    for lote in lotes:
+        sumar_delta(
+            deltas,
+            lote["id_medicamento"],
+            cantidad=lote.get("cantidad") or 0,
+            reservada=lote.get("cantidad_reservada") or 0,
+            defectuosa=sum(lote.get(c) or 0 for c in COLUMNAS_DEFECTO)
+        )
+    await actualizar_resumen(session, deltas)
+
+async def descontar_lote(session: AsyncSession, lote: str, cantidad: int) -> MedicamentoLote:
+    lote_obj = await _lote_unico(
+        session, _DESCONTAR_LOTE, lote, cantidad, "Stock insuficiente para realizar la entrega"
+    )
+    await actualizar_resumen(session, {lote_obj.id_medicamento: (-cantidad, 0, 0)})
+    return lote_obj
+
+async def reservar_lote(session: AsyncSession, lote: str, cantidad: int, ttl_segundos: int) -> Tuple[MedicamentoLote, ReservaLote]:
+    lote_obj = await _lote_unico(
+        session, _RESERVAR_LOTE, lote, cantidad, "Stock insuficiente para realizar la reserva"
+    )
+
+    result = await session.execute(_INSERTAR_RESERVA, {
+        "lote_reservado": lote_obj.id_lote,
+        "unidades": cantidad,
+        "ttl": timedelta(seconds=ttl_segundos),
+    })
+    reserva = result.scalar_one()
+
+    await actualizar_resumen(session, {lote_obj.id_medicamento: (0, cantidad, 0)})
+    return lote_obj, reserva
+
+async def _cerrar_reserva(session: AsyncSession, id_reserva_lote: UUID, entregar: bool) -> MedicamentoLote:
+    # Borra la reserva y descuenta lo retenido del lote en una sola sentencia;
+    # si se entrega, las unidades salen además de la cantidad del lote
+    cerrada = (
+        delete(ReservaLote)
+        .where(ReservaLote.id_reserva_lote == id_reserva_lote)
+        .returning(ReservaLote.id_lote, ReservaLote.cantidad)
+    )
+    if entregar:
+        cerrada = cerrada.where(ReservaLote.expira_en > func.localtimestamp())
+    cerrada = cerrada.cte("cerrada")
+
+    cambios = {"cantidad_reservada": MedicamentoLote.cantidad_reservada - cerrada.c.cantidad}
+    if entregar:
+        cambios["cantidad"] = MedicamentoLote.cantidad - cerrada.c.cantidad
+
+    result = await session.execute(
+        update(MedicamentoLote)
+        .where(MedicamentoLote.id_lote == cerrada.c.id_lote)
+        .values(cambios)
+        .returning(MedicamentoLote, cerrada.c.cantidad)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )
+    fila = result.first()
+    if fila is None:
+        await session.rollback()
+        raise HTTPException(status_code=404, detail="Reserva no encontrada o expirada")
+
+    lote_obj, cantidad = fila
+    await actualizar_resumen(session, {
+        lote_obj.id_medicamento: (-cantidad if entregar else 0, -cantidad, 0)
+    })
+    return lote_obj
+
+async def liberar_reserva(session: AsyncSession, id_reserva_lote: UUID) -> MedicamentoLote:
+    return await _cerrar_reserva(session, id_reserva_lote, entregar=False)
+
+async def entregar_reserva(session: AsyncSession, id_reserva_lote: UUID) -> MedicamentoLote:
+    return await _cerrar_reserva(session, id_reserva_lote, entregar=True)
+
+async def liberar_reservas_expiradas(session: AsyncSession, limite: int) -> int:
+    # Libera hasta `limite` reservas vencidas y devuelve cuántas liberó;
+    # SKIP LOCKED evita que dos réplicas barriendo a la vez se bloqueen entre sí
+    vencidas = (
+        select(ReservaLote.id_reserva_lote)
+        .where(ReservaLote.expira_en <= func.localtimestamp())
+        .order_by(ReservaLote.expira_en)
+        .limit(limite)
+        .with_for_update(skip_locked=True)
+    )
+    liberadas = (
+        delete(ReservaLote)
+        .where(ReservaLote.id_reserva_lote.in_(vencidas.scalar_subquery()))
+        .returning(ReservaLote.id_lote, ReservaLote.cantidad)
+        .cte("liberadas")
+    )
+    por_lote = (
+        select(
+            liberadas.c.id_lote,
+            func.sum(liberadas.c.cantidad).label("cantidad"),
+            func.count().label("reservas")
+        )
+        .group_by(liberadas.c.id_lote)
+        .subquery("por_lote")
+    )
+
+    result = await session.execute(
+        update(MedicamentoLote)
+        .where(MedicamentoLote.id_lote == por_lote.c.id_lote)
+        .values(cantidad_reservada=MedicamentoLote.cantidad_reservada - por_lote.c.cantidad)
+        .returning(MedicamentoLote.id_medicamento, por_lote.c.cantidad, por_lote.c.reservas)
+        .execution_options(synchronize_session=False)
+    )
+    filas = result.all()
+
+    deltas: Deltas = {}
+    for fila in filas:
+        sumar_delta(deltas, fila.id_medicamento, reservada=-fila.cantidad)
+    await actualizar_resumen(session, deltas)
+    return sum(fila.reservas for fila in filas)
+
+async def reportar_defecto(session: AsyncSession, lote: str, columna: str, cantidad: int) -> MedicamentoLote:
+    lote_obj = await _lote_unico(session, _REPORTAR_DEFECTO[columna], lote, cantidad, "Lote no encontrado")
+    await actualizar_resumen(session, {lote_obj.id_medicamento: (0, 0, cantidad)})
+    return lote_obj
+
+async def reportar_defectos(session: AsyncSession, por_columna: Dict[str, Dict[UUID, int]]) -> List[MedicamentoLote]:
+    # Suma defectos a varios lotes con un UPDATE por columna de defecto;
+    # por_columna es {columna: {id_lote: cantidad}}. Devuelve los lotes afectados.
+    deltas: Deltas = {}
+    afectados = set()
+    for columna, cantidades in por_columna.items():
+        if not cantidades:
+            continue
+        campo = getattr(MedicamentoLote, columna)
+        reporte = values(
+            column("id_lote", PG_UUID(as_uuid=True)),
+            column("cantidad", Integer),
+            name="reporte"
+        ).data(list(cantidades.items()))
+
+        result = await session.execute(
+            update(MedicamentoLote)
+            .where(MedicamentoLote.id_lote == reporte.c.id_lote)
+            .values({columna: func.coalesce(campo, 0) + reporte.c.cantidad})
+            .returning(MedicamentoLote.id_lote, MedicamentoLote.id_medicamento, reporte.c.cantidad)
+            .execution_options(synchronize_session=False)
+        )
+        for fila in result.all():
+            afectados.add(fila.id_lote)
+            sumar_delta(deltas, fila.id_medicamento, defectuosa=fila.cantidad)
+
+    await actualizar_resumen(session, deltas)
+    if not afectados:
+        return []
+    result = await session.execute(
+        select(MedicamentoLote)
+        .where(MedicamentoLote.id_lote.in_(afectados))
+        .order_by(MedicamentoLote.lote, MedicamentoLote.id_lote)
+        .execution_options(populate_existing=True)
+    )
+    return result.scalars().all()
+
+async def descontar_lotes(session: AsyncSession, asignaciones: Dict[UUID, int]) -> bool:
+    # Descuenta varias cantidades en un solo UPDATE; solo afecta lotes con stock suficiente.
+    # Devuelve False si algún lote no alcanzó, en cuyo caso el llamador debe hacer rollback.
+    await bloquear_lotes(session, list(asignaciones))
+    asignacion = valores_asignacion(asignaciones)
+
+    result = await session.execute(
+        update(MedicamentoLote)
+        .where(
+            MedicamentoLote.id_lote == asignacion.c.id_lote,
+            DISPONIBLE >= asignacion.c.cantidad
+        )
+        .values(cantidad=MedicamentoLote.cantidad - asignacion.c.cantidad)
+        .returning(MedicamentoLote.id_medicamento, asignacion.c.cantidad)
+        .execution_options(synchronize_session=False)
+    )
+    filas = result.all()
+    if len(filas) != len(asignaciones):
+        return False
+
+    deltas: Deltas = {}
+    for fila in filas:
+        sumar_delta(deltas, fila.id_medicamento, cantidad=-fila.cantidad)
+    await actualizar_resumen(session, deltas)
+    return True
+
+# ---------------------------------------------------------
+# Reconstrucción y verificación del resumen
+# ---------------------------------------------------------
+def _resumen_desde_lotes():
+    defectuosa = reduce(operator.add, (func.coalesce(getattr(MedicamentoLote, c), 0) for c in COLUMNAS_DEFECTO))
+    return (
+        select(
+            Medicamento.id_medicamento,
+            func.coalesce(func.sum(MedicamentoLote.cantidad), 0).label("cantidad"),
+            func.coalesce(func.sum(MedicamentoLote.cantidad_reservada), 0).label("cantidad_reservada"),
+            func.coalesce(func.sum(defectuosa), 0).label("cantidad_defectuosa"),
+            func.min(MedicamentoLote.fecha_vencimiento)
+            .filter(MedicamentoLote.cantidad > 0)
+            .label("proximo_vencimiento"),
+        )
+        .select_from(Medicamento)
+        .outerjoin(MedicamentoLote, MedicamentoLote.id_medicamento == Medicamento.id_medicamento)
+        .group_by(Medicamento.id_medicamento)
+    )
+
+async def reconstruir_resumen(session: AsyncSession) -> int:
+    # Bloquea escrituras sobre los lotes mientras se recalcula, para no perder deltas
+    await session.execute(text("LOCK TABLE medicamento_lote IN SHARE MODE"))
+
+    stmt = pg_insert(StockMedicamento).from_select(
+        ["id_medicamento", "cantidad", "cantidad_reservada", "cantidad_defectuosa", "proximo_vencimiento"],
+        _resumen_desde_lotes()
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StockMedicamento.id_medicamento],
+        set_={
+            "cantidad": stmt.excluded.cantidad,
+            "cantidad_reservada": stmt.excluded.cantidad_reservada,
+            "cantidad_defectuosa": stmt.excluded.cantidad_defectuosa,
+            "proximo_vencimiento": stmt.excluded.proximo_vencimiento,
+        }
+    )
+    result = await session.execute(stmt)
+    await actualizar_lote_proximo(session)
+    return result.rowcount
+
+async def diferencias_resumen(session: AsyncSession):
+    esperado = _resumen_desde_lotes().subquery()
+    result = await session.execute(
+        select(
+            esperado,
+            StockMedicamento.cantidad.label("resumen_cantidad"),
+            StockMedicamento.cantidad_reservada.label("resumen_cantidad_reservada"),
+            StockMedicamento.cantidad_defectuosa.label("resumen_cantidad_defectuosa"),
+            StockMedicamento.proximo_vencimiento.label("resumen_proximo_vencimiento"),
+        )
+        .select_from(esperado)
+        .outerjoin(StockMedicamento, StockMedicamento.id_medicamento == esperado.c.id_medicamento)
+        .where(or_(
+            StockMedicamento.id_medicamento.is_(None),
+            esperado.c.cantidad.is_distinct_from(StockMedicamento.cantidad),
+            esperado.c.cantidad_reservada.is_distinct_from(StockMedicamento.cantidad_reservada),
+            esperado.c.cantidad_defectuosa.is_distinct_from(StockMedicamento.cantidad_defectuosa),
+            esperado.c.proximo_vencimiento.is_distinct_from(StockMedicamento.proximo_vencimiento),
+        ))
+    )
+    return result.all()
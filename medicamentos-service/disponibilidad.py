@@ -0,0 +1,96 @@
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import Integer, and_, column, func, literal, literal_column, union_all, values
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from models import MedicamentoLote, MedicamentoPrincipio
+
+# ---------------------------------------------------------
+# Disponibilidad de stock para varias líneas a la vez
+#
+# Recibe pares (medicamento, cantidad) y/o (principio, cantidad) y
+# responde, en una sola consulta agregada sobre MedicamentoLote, cuántas
+# unidades disponibles (sin lo reservado) hay en lotes que no vencen antes
+# de `al` para cada uno. Un principio suma los lotes de todos sus
+# medicamentos. Solo informa: no retiene stock.
+#
+# Este archivo es igual en medicamentos-service, prescripciones-service y
+# reservas-service.
+# ---------------------------------------------------------
+
+def sumar_lineas(lineas: Iterable[Tuple[UUID, int]]) -> Dict[UUID, int]:
+    # Las líneas repetidas de un mismo id se consultan como una sola
+    total: Dict[UUID, int] = {}
+    for id_, cantidad in lineas:
+        total[id_] = total.get(id_, 0) + (cantidad or 0)
+    return total
+
+def _por_id(tipo: str, pedidos: Dict[UUID, int], vigencia):
+    pedido = values(
+        column("id", PG_UUID(as_uuid=True)),
+        column("cantidad", Integer),
+        name=f"pedido_{tipo}"
+    ).data(list(pedidos.items()))
+
+    disponible = MedicamentoLote.cantidad - MedicamentoLote.cantidad_reservada
+    stmt = select(
+        literal(tipo).label("tipo"),
+        pedido.c.id,
+        pedido.c.cantidad,
+        func.coalesce(func.sum(disponible), 0).label("disponible"),
+    ).select_from(pedido)
+
+    if tipo == "principio":
+        stmt = stmt.outerjoin(MedicamentoPrincipio, MedicamentoPrincipio.id_principio == pedido.c.id)
+        id_medicamento = MedicamentoPrincipio.id_medicamento
+    else:
+        id_medicamento = pedido.c.id
+
+    # cantidad > 0 va como literal para que coincida con el índice parcial
+    # idx_medicamento_lote_con_stock
+    stmt = stmt.outerjoin(
+        MedicamentoLote,
+        and_(
+            MedicamentoLote.id_medicamento == id_medicamento,
+            MedicamentoLote.cantidad > literal_column("0"),
+            disponible > 0,
+            MedicamentoLote.fecha_vencimiento > vigencia
+        )
+    )
+    return stmt.group_by(pedido.c.id, pedido.c.cantidad)
+
+async def consultar_disponibilidad(
+    session: AsyncSession,
+    medicamentos: Optional[Dict[UUID, int]] = None,
+    principios: Optional[Dict[UUID, int]] = None,
+    al: Optional[datetime] = None
+) -> dict:
+    # medicamentos y principios son {id: cantidad}; `al` es la fecha hasta
+    # la que los lotes no deben vencer (por defecto, ahora)
+    vigencia = func.localtimestamp() if al is None else func.greatest(al, func.localtimestamp())
+    consultas = []
+    if medicamentos:
+        consultas.append(_por_id("medicamento", medicamentos, vigencia))
+    if principios:
+        consultas.append(_por_id("principio", principios, vigencia))
+
+    resultado = {"medicamentos": [], "principios": [], "suficiente": True}
+    if not consultas:
+        return resultado
+
+    stmt = consultas[0] if len(consultas) == 1 else union_all(*consultas)
+    filas = await session.execute(stmt)
+    for fila in filas.all():
+        suficiente = fila.disponible >= fila.cantidad
+        resultado[f"{fila.tipo}s"].append({
+            f"id_{fila.tipo}": fila.id,
+            "solicitado": fila.cantidad,
+            "disponible": fila.disponible,
+            "suficiente": suficiente,
+        })
+        resultado["suficiente"] = resultado["suficiente"] and suficiente
+    return resultado
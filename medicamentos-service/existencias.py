@@ -0,0 +1,233 @@
+from sqlalchemy import bindparam, column, delete, func, insert, literal_column, update, values, Integer
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID, insert as pg_insert
+from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from uuid import UUID
+from typing import Dict, Optional, Tuple
+
+from models import (
+    MedicamentoLote,
+    MedicamentoPrincipio,
+    LoteProximo,
+    ReservaLote,
+    StockMedicamento
+)
+
+# ---------------------------------------------------------
+# Stock por lote compartido por los servicios que lo modifican: lo
+# disponible de un lote, el resumen en StockMedicamento, el próximo lote
+# por principio (LoteProximo) y la retención de varios lotes a la vez.
+# El resto de las mutaciones (por código de lote, defectos, barrido de
+# reservas) está en medicamentos-service, crud/stock.py.
+#
+# Ninguna función hace commit; eso queda en manos del llamador. Las que
+# tocan varias filas las bloquean en orden de id (lotes, resumen y
+# LoteProximo), así dos transacciones con filas en común se esperan en
+# vez de bloquearse mutuamente (deadlock).
+#
+# Este archivo es igual en medicamentos-service y reservas-service.
+# ---------------------------------------------------------
+
+# Unidades de un lote que se pueden entregar o reservar: cantidad_reservada
+# es la suma de las reservas (ReservaLote) vigentes o aún no barridas
+DISPONIBLE = MedicamentoLote.cantidad - MedicamentoLote.cantidad_reservada
+
+# ---------------------------------------------------------
+# Resumen por medicamento (StockMedicamento)
+#
+# Cada mutación de lotes suma sus cambios por medicamento y los aplica con
+# un solo upsert, dentro de la misma transacción.
+# ---------------------------------------------------------
+
+# Deltas por medicamento: (cantidad, cantidad_reservada, cantidad_defectuosa)
+Deltas = Dict[UUID, Tuple[int, int, int]]
+
+def sumar_delta(deltas: Deltas, id_medicamento: UUID, cantidad=0, reservada=0, defectuosa=0):
+    actual = deltas.get(id_medicamento, (0, 0, 0))
+    deltas[id_medicamento] = (actual[0] + cantidad, actual[1] + reservada, actual[2] + defectuosa)
+
+async def actualizar_resumen(session: AsyncSession, deltas: Deltas):
+    if not deltas:
+        return
+
+    delta = values(
+        column("id_medicamento", PG_UUID(as_uuid=True)),
+        column("cantidad", Integer),
+        column("cantidad_reservada", Integer),
+        column("cantidad_defectuosa", Integer),
+        name="delta"
+    ).data([(id_medicamento, *valores) for id_medicamento, valores in sorted(deltas.items())])
+
+    # El próximo vencimiento se recalcula con el primer lote con stock
+    proximo_vencimiento = (
+        select(func.min(MedicamentoLote.fecha_vencimiento))
+        .where(
+            MedicamentoLote.id_medicamento == delta.c.id_medicamento,
+            MedicamentoLote.cantidad > 0
+        )
+        .scalar_subquery()
+    )
+
+    stmt = pg_insert(StockMedicamento).from_select(
+        ["id_medicamento", "cantidad", "cantidad_reservada", "cantidad_defectuosa", "proximo_vencimiento"],
+        select(
+            delta.c.id_medicamento,
+            delta.c.cantidad,
+            delta.c.cantidad_reservada,
+            delta.c.cantidad_defectuosa,
+            proximo_vencimiento
+        )
+        # Las filas del resumen se insertan o bloquean en este orden
+        .order_by(delta.c.id_medicamento)
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StockMedicamento.id_medicamento],
+        set_={
+            "cantidad": StockMedicamento.cantidad + stmt.excluded.cantidad,
+            "cantidad_reservada": StockMedicamento.cantidad_reservada + stmt.excluded.cantidad_reservada,
+            "cantidad_defectuosa": StockMedicamento.cantidad_defectuosa + stmt.excluded.cantidad_defectuosa,
+            "proximo_vencimiento": stmt.excluded.proximo_vencimiento,
+        }
+    )
+    await session.execute(stmt)
+
+    # Solo los cambios de cantidad o de reservas mueven el próximo lote a dispensar
+    cambiados = [id_medicamento for id_medicamento, (c, r, _) in deltas.items() if c or r]
+    if cambiados:
+        principios = (
+            select(MedicamentoPrincipio.id_principio)
+            .where(MedicamentoPrincipio.id_medicamento.in_(cambiados))
+        )
+        await actualizar_lote_proximo(session, principios)
+
+# ---------------------------------------------------------
+# Retención de varios lotes
+# ---------------------------------------------------------
+async def bloquear_lotes(session: AsyncSession, ids_lote):
+    # SELECT ... FOR UPDATE en orden de id. Un UPDATE con varias filas las
+    # bloquea en el orden que elija el plan; tomarlas antes así lo evita.
+    await session.execute(
+        select(MedicamentoLote.id_lote)
+        .where(MedicamentoLote.id_lote.in_(ids_lote))
+        .order_by(MedicamentoLote.id_lote)
+        .with_for_update()
+    )
+
+def valores_asignacion(asignaciones: Dict[UUID, int]):
+    return values(
+        column("id_lote", PG_UUID(as_uuid=True)),
+        column("cantidad", Integer),
+        name="asignacion"
+    ).data(sorted(asignaciones.items()))
+
+async def reservar_lotes(
+    session: AsyncSession,
+    asignaciones: Dict[UUID, int],
+    expira_en,
+    id_reserva: UUID = None
+) -> Optional[Dict[UUID, UUID]]:
+    # Retiene varias cantidades en un solo UPDATE y crea una ReservaLote por
+    # lote, todas con el mismo vencimiento (valor o expresión SQL).
+    # Devuelve el id_reserva_lote creado por id_lote, el que se usa para
+    # entregar lo retenido, o None si algún lote no alcanzó, en cuyo caso
+    # el llamador debe hacer rollback.
+    # El llamador bloquea antes los lotes con bloquear_lotes (o en orden de
+    # id, como reservas-service al calcular la asignación).
+    asignacion = valores_asignacion(asignaciones)
+
+    result = await session.execute(
+        update(MedicamentoLote)
+        .where(
+            MedicamentoLote.id_lote == asignacion.c.id_lote,
+            DISPONIBLE >= asignacion.c.cantidad
+        )
+        .values(cantidad_reservada=MedicamentoLote.cantidad_reservada + asignacion.c.cantidad)
+        .returning(MedicamentoLote.id_medicamento, asignacion.c.id_lote, asignacion.c.cantidad)
+        .execution_options(synchronize_session=False)
+    )
+    filas = result.all()
+    if len(filas) != len(asignaciones):
+        return None
+
+    result = await session.execute(
+        insert(ReservaLote)
+        .values(
+            id_lote=bindparam("lote_reservado"),
+            cantidad=bindparam("unidades"),
+            expira_en=expira_en,
+            id_reserva=id_reserva
+        )
+        .returning(ReservaLote.id_lote, ReservaLote.id_reserva_lote),
+        [{"lote_reservado": fila.id_lote, "unidades": fila.cantidad} for fila in filas]
+    )
+    retenidas = dict(result.all())
+
+    deltas: Deltas = {}
+    for fila in filas:
+        sumar_delta(deltas, fila.id_medicamento, reservada=fila.cantidad)
+    await actualizar_resumen(session, deltas)
+    return retenidas
+
+# ---------------------------------------------------------
+# Próximo lote a dispensar por principio activo (LoteProximo)
+#
+# Una fila por principio con el lote disponible, no vencido, que vence
+# primero entre todos sus medicamentos. Se recalcula para los principios
+# afectados cada vez que cambia la cantidad o lo reservado de un lote
+# (desde actualizar_resumen), así la consulta es una lectura por clave.
+# Un lote que vence sin cambios de stock sigue en la tabla: la consulta
+# lo detecta y recalcula ese principio.
+# ---------------------------------------------------------
+def _lotes_proximos(filtro_principio=None):
+    # cantidad > 0 va como literal para que coincida con el índice parcial
+    # idx_medicamento_lote_con_stock
+    stmt = (
+        select(
+            MedicamentoPrincipio.id_principio,
+            MedicamentoLote.id_lote,
+            MedicamentoLote.fecha_vencimiento,
+        )
+        .distinct(MedicamentoPrincipio.id_principio)
+        .join(MedicamentoLote, MedicamentoLote.id_medicamento == MedicamentoPrincipio.id_medicamento)
+        .where(
+            MedicamentoLote.cantidad > literal_column("0"),
+            DISPONIBLE > 0,
+            MedicamentoLote.fecha_vencimiento > func.localtimestamp()
+        )
+        .order_by(
+            MedicamentoPrincipio.id_principio,
+            MedicamentoLote.fecha_vencimiento,
+            MedicamentoLote.id_lote
+        )
+    )
+    if filtro_principio is not None:
+        stmt = stmt.where(filtro_principio)
+    return stmt
+
+async def actualizar_lote_proximo(session: AsyncSession, principios=None):
+    # principios: ids o SELECT de ids de principio a recalcular; None recalcula todos
+    borrar = delete(LoteProximo)
+    if principios is not None:
+        # Las filas se bloquean en orden de principio antes de borrarlas
+        bloqueadas = (
+            select(LoteProximo.id_principio)
+            .where(LoteProximo.id_principio.in_(principios))
+            .order_by(LoteProximo.id_principio)
+            .with_for_update()
+        )
+        borrar = borrar.where(LoteProximo.id_principio.in_(bloqueadas.scalar_subquery()))
+    await session.execute(borrar)
+
+    candidatos = _lotes_proximos(
+        MedicamentoPrincipio.id_principio.in_(principios) if principios is not None else None
+    )
+    stmt = pg_insert(LoteProximo).from_select(["id_principio", "id_lote", "fecha_vencimiento"], candidatos)
+    # Otra transacción pudo insertar el mismo principio tras nuestro DELETE
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[LoteProximo.id_principio],
+        set_={
+            "id_lote": stmt.excluded.id_lote,
+            "fecha_vencimiento": stmt.excluded.fecha_vencimiento,
+        }
+    )
+    await session.execute(stmt)
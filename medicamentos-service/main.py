@@ -1,6 +1,36 @@
+# arranque va primero: mide el tiempo desde que parte el proceso
+import arranque
+import asyncio
+
 from fastapi import FastAPI
 from routers import medicamento
+from barrido import ciclo_barrido
+from serializacion import RespuestaJSON
+from database import marcar_escrituras
+from crud import medicamento as crud
+
+# Última migración de migraciones/versiones que este servicio necesita
+VERSION_ESQUEMA = 8
+
+app = FastAPI(default_response_class=RespuestaJSON)
+app.middleware("http")(marcar_escrituras)
+
+app.include_router(medicamento.router)
+
+# Consultas frecuentes que se ejecutan una vez al arrancar
+arranque.registrar(app, VERSION_ESQUEMA, [
+    ("medicamentos", lambda s: crud.get_medicamentos(s, limite=1)),
+    ("principios", lambda s: crud.obtener_todos_los_principios(s, limite=1)),
+    ("lotes por medicamento", lambda s: crud.get_lotes_por_medicamento(s, arranque.ID_CALENTAMIENTO, limite=1)),
+    ("detalle de principio", lambda s: crud.obtener_detalle_por_principio(s, arranque.ID_CALENTAMIENTO)),
+    ("próximo lote", lambda s: crud.get_lote_proximo_vencimiento_info(s, arranque.ID_CALENTAMIENTO)),
+    ("plan de entrega", lambda s: s.execute(crud._PLAN_ENTREGA_RECETA, {"id_receta": arranque.ID_CALENTAMIENTO})),
+])
 
-app = FastAPI()
+@app.on_event("startup")
+async def iniciar_barrido():
+    app.state.barrido = asyncio.create_task(ciclo_barrido())
 
-app.include_router(medicamento.router)
\ No newline at end of file
+@app.on_event("shutdown")
+async def detener_barrido():
+    app.state.barrido.cancel()
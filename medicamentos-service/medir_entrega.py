@@ -0,0 +1,164 @@
+# Mide la entrega por receta (crud.medicamento.procesar_entrega_receta):
+# sentencias SQL y latencia por entrega según la cantidad de principios
+# de la receta. Los datos de prueba se crean en una transacción que se
+# revierte al final, así que puede correrse contra una base real.
+#
+#   python medir_entrega.py                       -> recetas de 1, 3, 6 y 12 principios
+#   python medir_entrega.py --principios 6 20 --repeticiones 50
+#
+# Cada principio tiene un medicamento propio con LOTES_POR_MEDICAMENTO
+# lotes chicos, así la entrega reparte cada principio en varios lotes.
+# Además un medicamento combinado cubre los dos primeros principios.
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import engine
+from models import (
+    Medicamento,
+    MedicamentoPrincipio,
+    Paciente,
+    Prescripcion,
+    PrescripcionPrincipio,
+    PrincipioActivo,
+    Receta,
+    Usuario,
+)
+from crud import stock
+from crud.medicamento import procesar_entrega_receta
+
+LOTES_POR_MEDICAMENTO = 4
+UNIDADES_POR_LOTE = 10
+# Unidades por principio: alcanza para recorrer tres lotes
+UNIDADES_POR_PRINCIPIO = 25
+
+# Sentencias de control de la transacción de prueba, que no cuentan
+_CONTROL = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+
+contador = {"sentencias": 0}
+
+def _contar(conn, cursor, statement, parameters, context, executemany):
+    if not statement.lstrip().upper().startswith(_CONTROL):
+        contador["sentencias"] += 1
+
+async def _crear_datos(session: AsyncSession, principios: int, recetas: int):
+    ids_principio = [uuid.uuid4() for _ in range(principios)]
+    ids_medicamento = [uuid.uuid4() for _ in range(principios)]
+    combinado = uuid.uuid4()
+    vencimiento = datetime.now() + timedelta(days=30)
+
+    await session.execute(insert(PrincipioActivo), [
+        {"id_principio": id_, "nombre": f"Principio {i}", "categoria": "medicion"}
+        for i, id_ in enumerate(ids_principio)
+    ])
+    await session.execute(insert(Medicamento), [
+        {"id_medicamento": id_, "nombre": f"Medicamento {i}", "codigo_barras": uuid.uuid4()}
+        for i, id_ in enumerate(ids_medicamento + [combinado])
+    ])
+    asociaciones = [
+        {"id_medicamento": m, "id_principio": p} for m, p in zip(ids_medicamento, ids_principio)
+    ]
+    asociaciones += [{"id_medicamento": combinado, "id_principio": p} for p in ids_principio[:2]]
+    await session.execute(insert(MedicamentoPrincipio), asociaciones)
+
+    # Lotes para todas las recetas; el combinado vence primero
+    lotes = []
+    for id_medicamento in ids_medicamento + [combinado]:
+        for i in range(LOTES_POR_MEDICAMENTO * recetas):
+            lotes.append({
+                "id_medicamento": id_medicamento,
+                "lote": f"MEDICION-{id_medicamento.hex[:8]}-{i}",
+                "fecha_vencimiento": vencimiento + timedelta(days=i + (0 if id_medicamento == combinado else 1)),
+                "cantidad": UNIDADES_POR_LOTE,
+                "cantidad_reservada": 0,
+                "cantidad_defectuosa": 0,
+                "cantidad_en_idea": 0,
+                "cantidad_en_estado": 0,
+                "cantidad_envase_roto": 0,
+            })
+    await stock.registrar_lotes(session, lotes)
+
+    id_usuario, id_paciente = uuid.uuid4(), uuid.uuid4()
+    await session.execute(insert(Usuario).values(id=id_usuario, rut="MEDICION", nombre="Medición", rol="funcionario"))
+    await session.execute(insert(Paciente).values(id_paciente=id_paciente, rut="MEDICION", nombre="Medición"))
+
+    ids_receta = []
+    for _ in range(recetas):
+        id_prescripcion, id_receta = uuid.uuid4(), uuid.uuid4()
+        await session.execute(insert(Prescripcion).values(
+            id_prescripcion=id_prescripcion, id_medico=id_usuario, id_paciente=id_paciente
+        ))
+        await session.execute(insert(PrescripcionPrincipio), [
+            {
+                "id_prescripcion": id_prescripcion,
+                "id_principio": p,
+                "duracion": "50 días",
+                "frecuencia": "1 vez al día",
+                "unidades_por_receta": UNIDADES_POR_PRINCIPIO,
+            }
+            for p in ids_principio
+        ])
+        await session.execute(insert(Receta).values(
+            id_receta=id_receta, id_prescripcion=id_prescripcion, id_paciente=id_paciente,
+            id_medico=id_usuario, fecha_emision=datetime.now(), estado="pendiente"
+        ))
+        ids_receta.append(id_receta)
+    await session.flush()
+    return id_usuario, ids_receta
+
+async def medir(principios: int, repeticiones: int) -> dict:
+    async with engine.connect() as conn:
+        transaccion = await conn.begin()
+        # commit() de la entrega libera un savepoint; todo se revierte al final
+        session = AsyncSession(bind=conn, join_transaction_mode="create_savepoint", expire_on_commit=False)
+        try:
+            id_usuario, ids_receta = await _crear_datos(session, principios, repeticiones + 1)
+
+            # La primera entrega calienta la caché de sentencias y no se mide
+            await procesar_entrega_receta(session, ids_receta[0], id_usuario, "MEDICION", "Medición")
+
+            tiempos, sentencias = [], []
+            for id_receta in ids_receta[1:]:
+                contador["sentencias"] = 0
+                inicio = time.perf_counter()
+                items = await procesar_entrega_receta(session, id_receta, id_usuario, "MEDICION", "Medición")
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+                sentencias.append(contador["sentencias"])
+                if any(item["estado"] != "entregado" for item in items):
+                    raise RuntimeError(f"Entrega incompleta con {principios} principios: {items}")
+        finally:
+            await session.close()
+            await transaccion.rollback()
+
+    tiempos.sort()
+    return {
+        "principios": principios,
+        "sentencias": max(sentencias),
+        "p50_ms": statistics.median(tiempos),
+        "p95_ms": tiempos[max(int(len(tiempos) * 0.95) - 1, 0)],
+    }
+
+async def main(tamanos, repeticiones: int) -> int:
+    event.listen(engine.sync_engine, "before_cursor_execute", _contar)
+    try:
+        print(f"{'principios':>10} {'sentencias':>10} {'p50 ms':>8} {'p95 ms':>8}")
+        for principios in tamanos:
+            r = await medir(principios, repeticiones)
+            print(f"{r['principios']:>10} {r['sentencias']:>10} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f}")
+    finally:
+        await engine.dispose()
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Medición de la entrega por receta")
+    parser.add_argument("--principios", type=int, nargs="+", default=[1, 3, 6, 12])
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.principios, args.repeticiones)))
@@ -0,0 +1,149 @@
+# Compara la consulta del próximo lote a vencer por principio activo
+# (GET /principios/{id}/proximo_vencimiento): la anterior, que unía lotes,
+# medicamentos, asociaciones y principios y ordenaba por vencimiento en
+# cada llamada, contra la lectura por clave de LoteProximo que hace hoy
+# crud.medicamento.get_lote_proximo_vencimiento_info. Los datos de prueba
+# se crean en una transacción que se revierte al final, así que puede
+# correrse contra una base real.
+#
+#   python medir_lote_proximo.py                 -> 100k lotes, 200 consultas
+#   python medir_lote_proximo.py --lotes 500000 --consultas 1000
+#
+# Proporciones como migraciones/verificacion.py: 50 lotes por medicamento,
+# 4 medicamentos por principio, un tercio de los lotes sin stock.
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from database import engine
+from models import Medicamento, MedicamentoLote, MedicamentoPrincipio, PrincipioActivo
+from crud import stock
+from crud.medicamento import get_lote_proximo_vencimiento_info
+
+# Inserción de lotes por partes, para no armar un solo executemany enorme
+LOTES_POR_PARTE = 10000
+
+async def _consulta_anterior(session: AsyncSession, id_principio: uuid.UUID):
+    # get_lote_proximo_vencimiento_info antes de LoteProximo
+    stmt = (
+        select(MedicamentoLote, Medicamento, PrincipioActivo)
+        .join(Medicamento, Medicamento.id_medicamento == MedicamentoLote.id_medicamento)
+        .join(MedicamentoPrincipio, MedicamentoPrincipio.id_medicamento == Medicamento.id_medicamento)
+        .join(PrincipioActivo, PrincipioActivo.id_principio == MedicamentoPrincipio.id_principio)
+        .where(
+            MedicamentoPrincipio.id_principio == id_principio,
+            stock.DISPONIBLE > 0
+        )
+        .order_by(MedicamentoLote.fecha_vencimiento.asc())
+        .limit(1)
+    )
+    row = (await session.execute(stmt)).first()
+    if not row:
+        return None
+    lote, medicamento, principio = row
+    return {
+        "nombre_principio": principio.nombre,
+        "nombre_medicamento": medicamento.nombre,
+        "via_administracion": medicamento.via_administracion,
+        "dosis_concentracion": medicamento.dosis_concentracion,
+        "numero_lote": lote.lote,
+    }
+
+async def _crear_datos(session: AsyncSession, lotes: int) -> list:
+    ids_principio = [uuid.uuid4() for _ in range(max(lotes // 200, 1))]
+    ids_medicamento = [uuid.uuid4() for _ in range(max(lotes // 50, 1))]
+    hoy = datetime.now()
+
+    await session.execute(insert(PrincipioActivo), [
+        {"id_principio": id_, "nombre": f"Principio {i}", "categoria": "medicion"}
+        for i, id_ in enumerate(ids_principio)
+    ])
+    await session.execute(insert(Medicamento), [
+        {"id_medicamento": id_, "nombre": f"Medicamento {i}", "codigo_barras": uuid.uuid4()}
+        for i, id_ in enumerate(ids_medicamento)
+    ])
+    await session.execute(insert(MedicamentoPrincipio), [
+        {"id_medicamento": id_, "id_principio": ids_principio[i % len(ids_principio)]}
+        for i, id_ in enumerate(ids_medicamento)
+    ])
+
+    # registrar_lotes mantiene el resumen y LoteProximo como en producción
+    for inicio in range(0, lotes, LOTES_POR_PARTE):
+        await stock.registrar_lotes(session, [
+            {
+                "id_medicamento": ids_medicamento[g % len(ids_medicamento)],
+                "lote": f"MEDICION-{g}",
+                "fecha_vencimiento": hoy + timedelta(days=1 + g % 720),
+                "cantidad": 0 if g % 3 == 0 else 50,
+                "cantidad_reservada": 0,
+                "cantidad_defectuosa": 0,
+                "cantidad_en_idea": 0,
+                "cantidad_en_estado": 0,
+                "cantidad_envase_roto": 0,
+            }
+            for g in range(inicio, min(inicio + LOTES_POR_PARTE, lotes))
+        ])
+    await session.flush()
+    await session.execute(text(
+        "ANALYZE principio_activo, medicamento, medicamento_principio, medicamento_lote, lote_proximo"
+    ))
+    return ids_principio
+
+async def _tiempos(session: AsyncSession, consulta, principios: list) -> list:
+    # La primera llamada calienta la caché de sentencias y no se mide
+    await consulta(session, principios[0])
+    tiempos = []
+    for id_principio in principios:
+        inicio = time.perf_counter()
+        if await consulta(session, id_principio) is None:
+            raise RuntimeError(f"Sin lote próximo para el principio {id_principio}")
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    return tiempos
+
+async def medir(lotes: int, consultas: int):
+    async with engine.connect() as conn:
+        transaccion = await conn.begin()
+        session = AsyncSession(bind=conn, join_transaction_mode="create_savepoint", expire_on_commit=False)
+        try:
+            print(f"Generando {lotes} lotes de prueba...")
+            ids_principio = await _crear_datos(session, lotes)
+            principios = [random.choice(ids_principio) for _ in range(consultas)]
+
+            print(f"{'consulta':>22} {'p50 ms':>8} {'p95 ms':>8}")
+            medianas = []
+            for nombre, consulta in (
+                ("join anterior", _consulta_anterior),
+                ("LoteProximo", get_lote_proximo_vencimiento_info),
+            ):
+                tiempos = await _tiempos(session, consulta, principios)
+                p95 = tiempos[max(int(len(tiempos) * 0.95) - 1, 0)]
+                medianas.append(statistics.median(tiempos))
+                print(f"{nombre:>22} {medianas[-1]:>8.3f} {p95:>8.3f}")
+            print(f"Mediana {medianas[0] / medianas[1]:.1f} veces menor con LoteProximo")
+        finally:
+            await session.close()
+            await transaccion.rollback()
+
+async def main(lotes: int, consultas: int) -> int:
+    try:
+        await medir(lotes, consultas)
+    finally:
+        await engine.dispose()
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consulta anterior vs LoteProximo")
+    parser.add_argument("--lotes", type=int, default=100000)
+    parser.add_argument("--consultas", type=int, default=200)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.lotes, args.consultas)))
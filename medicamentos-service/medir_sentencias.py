@@ -0,0 +1,86 @@
+# Mide el CPU por petición de las consultas por clave de crud/medicamento.py:
+# la sentencia armada una sola vez con bindparam (como hoy) contra la misma
+# sentencia reconstruida en cada llamada, que además obliga a SQLAlchemy a
+# recalcular su clave de caché. Se cuenta el CPU del proceso
+# (time.process_time), no la espera a la base, así que la diferencia es
+# lo que cuesta armar la sentencia. Se consulta por ids inexistentes: no
+# hace falta tener datos.
+#
+#   python medir_sentencias.py
+#   python medir_sentencias.py --ejecuciones 5000
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+
+from sqlalchemy import bindparam, func
+from sqlalchemy.future import select
+
+from database import AsyncSessionLocal, engine
+from models import LoteProximo, Medicamento, MedicamentoLote, PrincipioActivo
+from crud.medicamento import (
+    _COLUMNAS_CACHEADAS,
+    _LOTE_PROXIMO,
+    _MEDICAMENTO_POR_CODIGO,
+    _PLAN_ENTREGA_RECETA,
+    _plan_entrega_receta,
+)
+
+def _medicamento_por_codigo():
+    return select(*_COLUMNAS_CACHEADAS).where(Medicamento.codigo_barras == bindparam("codigo_barras"))
+
+def _lote_proximo():
+    return (
+        select(
+            PrincipioActivo.nombre.label("nombre_principio"),
+            Medicamento.nombre.label("nombre_medicamento"),
+            Medicamento.via_administracion,
+            Medicamento.dosis_concentracion,
+            MedicamentoLote.lote.label("numero_lote"),
+            (LoteProximo.fecha_vencimiento <= func.localtimestamp()).label("vencido"),
+        )
+        .select_from(LoteProximo)
+        .join(PrincipioActivo, PrincipioActivo.id_principio == LoteProximo.id_principio)
+        .join(MedicamentoLote, MedicamentoLote.id_lote == LoteProximo.id_lote)
+        .join(Medicamento, Medicamento.id_medicamento == MedicamentoLote.id_medicamento)
+        .where(LoteProximo.id_principio == bindparam("id_principio"))
+    )
+
+# (nombre, sentencia armada una vez, función que la reconstruye, parámetro)
+SENTENCIAS = [
+    ("medicamento por código", _MEDICAMENTO_POR_CODIGO, _medicamento_por_codigo, "codigo_barras"),
+    ("lote próximo", _LOTE_PROXIMO, _lote_proximo, "id_principio"),
+    ("plan de entrega", _PLAN_ENTREGA_RECETA, _plan_entrega_receta, "id_receta"),
+]
+
+async def _cpu_por_ejecucion(session, obtener_sentencia, parametro: str, ejecuciones: int) -> float:
+    # Microsegundos de CPU por ejecución; la primera calienta cachés y no se mide
+    await session.execute(obtener_sentencia(), {parametro: uuid.uuid4()})
+    inicio = time.process_time()
+    for _ in range(ejecuciones):
+        result = await session.execute(obtener_sentencia(), {parametro: uuid.uuid4()})
+        result.all()
+    return (time.process_time() - inicio) / ejecuciones * 1e6
+
+async def medir(ejecuciones: int):
+    print(f"{'sentencia':>24} {'reconstruida µs':>16} {'armada una vez µs':>18} {'diferencia µs':>14}")
+    async with AsyncSessionLocal() as session:
+        for nombre, armada, reconstruir, parametro in SENTENCIAS:
+            antes = await _cpu_por_ejecucion(session, reconstruir, parametro, ejecuciones)
+            despues = await _cpu_por_ejecucion(session, lambda: armada, parametro, ejecuciones)
+            print(f"{nombre:>24} {antes:>16.1f} {despues:>18.1f} {antes - despues:>14.1f}")
+        await session.rollback()
+
+async def main(ejecuciones: int) -> int:
+    try:
+        await medir(ejecuciones)
+    finally:
+        await engine.dispose()
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPU por petición: sentencias armadas una vez vs reconstruidas")
+    parser.add_argument("--ejecuciones", type=int, default=2000, help="ejecuciones por sentencia y variante")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.ejecuciones)))
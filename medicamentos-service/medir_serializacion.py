@@ -0,0 +1,94 @@
+# Microbenchmark de la serialización de listados (serializacion.py): costo
+# por fila de la respuesta de FastAPI por defecto (validación contra
+# response_model, jsonable_encoder y json.dumps en JSONResponse) contra
+# respuesta_json (proyección a los campos del modelo y orjson). No usa la
+# base: las filas se arman en memoria con los campos de LoteOut, como las
+# Row de GET /medicamentos/{id}/lotes.
+#
+#   python medir_serializacion.py                    -> 10k filas, 20 repeticiones
+#   python medir_serializacion.py --filas 1000 --repeticiones 100
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import List
+
+import orjson
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from schemas.medicamento import LoteOut
+from serializacion import respuesta_json
+
+Fila = namedtuple("Fila", list(LoteOut.__fields__))
+
+def _filas(cantidad: int) -> list:
+    id_medicamento = uuid.uuid4()
+    hoy = datetime.now()
+    return [
+        Fila(
+            id_lote=uuid.uuid4(),
+            lote=f"MEDICION-{i}",
+            fecha_vencimiento=hoy + timedelta(days=i % 720),
+            cantidad=50,
+            cantidad_reservada=i % 7,
+            cantidad_defectuosa=0,
+            cantidad_en_idea=0,
+            cantidad_en_estado=0,
+            cantidad_envase_roto=0,
+            id_medicamento=id_medicamento,
+        )
+        for i in range(cantidad)
+    ]
+
+async def _por_defecto(campo, filas) -> bytes:
+    # Lo que hace FastAPI con el valor devuelto por un endpoint con response_model
+    contenido = await serialize_response(field=campo, response_content=filas)
+    return JSONResponse(contenido).body
+
+async def _orjson(filas) -> bytes:
+    return respuesta_json(filas, LoteOut).body
+
+async def _medir(serializar, repeticiones: int) -> list:
+    # La primera pasada calienta cachés (p. ej. el plan de campos del modelo)
+    await serializar()
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        await serializar()
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos
+
+async def main(filas: int, repeticiones: int) -> int:
+    datos = _filas(filas)
+    campo = create_model_field(name="Response", type_=List[LoteOut], mode="serialization")
+
+    antes = await _por_defecto(campo, datos)
+    despues = await _orjson(datos)
+    if orjson.loads(antes) != orjson.loads(despues):
+        raise RuntimeError("Las dos serializaciones no entregan el mismo JSON")
+
+    print(f"{filas} filas de LoteOut, {repeticiones} repeticiones")
+    print(f"{'serialización':>22} {'ms total':>9} {'µs/fila':>8} {'bytes':>9}")
+    medianas = []
+    for nombre, serializar, cuerpo in (
+        ("FastAPI por defecto", lambda: _por_defecto(campo, datos), antes),
+        ("respuesta_json", lambda: _orjson(datos), despues),
+    ):
+        mediana = statistics.median(await _medir(serializar, repeticiones))
+        medianas.append(mediana)
+        print(f"{nombre:>22} {mediana * 1000:>9.2f} {mediana / filas * 1e6:>8.2f} {len(cuerpo):>9}")
+    print(f"{medianas[0] / medianas[1]:.1f} veces menos por fila con respuesta_json")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Costo por fila de la serialización de listados")
+    parser.add_argument("--filas", type=int, default=10000)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.filas, args.repeticiones)))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, ForeignKey, text, Integer, TIMESTAMP
+from sqlalchemy import Column, String, ForeignKey, text, Integer, TIMESTAMP, Computed, Numeric
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship, declarative_base
 import uuid
@@ -92,7 +92,7 @@ class MedicamentoLote(Base):
     lote = Column(String(50))
     fecha_vencimiento = Column(TIMESTAMP)
     cantidad = Column(Integer)
-    cantidad_reservada = Column(Integer)
+    cantidad_reservada = Column(Integer, nullable=False, server_default=text("0"))
     cantidad_defectuosa = Column(Integer)
     cantidad_en_idea = Column(Integer)
     cantidad_en_estado = Column(Integer)
@@ -100,6 +100,36 @@ class MedicamentoLote(Base):
 
     medicamento = relationship("Medicamento", back_populates="lotes")
 
+
+class ReservaLote(Base):
+    __tablename__ = "reserva_lote"
+
+    id_reserva_lote = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
+    id_lote = Column(UUID(as_uuid=True), ForeignKey("medicamento_lote.id_lote"), nullable=False)
+    cantidad = Column(Integer, nullable=False)
+    creada_en = Column(TIMESTAMP, nullable=False, server_default=text("localtimestamp"))
+    expira_en = Column(TIMESTAMP, nullable=False)
+    # Reserva de retiro (reservas-service) a la que pertenece, si la hay
+    id_reserva = Column(UUID(as_uuid=True), ForeignKey("reserva.id_reserva"))
+
+
+class StockMedicamento(Base):
+    __tablename__ = "stock_medicamento"
+
+    id_medicamento = Column(UUID(as_uuid=True), ForeignKey("medicamento.id_medicamento"), primary_key=True)
+    cantidad = Column(Integer, nullable=False, server_default=text("0"))
+    cantidad_reservada = Column(Integer, nullable=False, server_default=text("0"))
+    cantidad_defectuosa = Column(Integer, nullable=False, server_default=text("0"))
+    cantidad_disponible = Column(Integer, Computed("cantidad - cantidad_reservada"))
+    proximo_vencimiento = Column(TIMESTAMP)
+
+class LoteProximo(Base):
+    __tablename__ = "lote_proximo"
+
+    id_principio = Column(UUID(as_uuid=True), ForeignKey("principio_activo.id_principio"), primary_key=True)
+    id_lote = Column(UUID(as_uuid=True), ForeignKey("medicamento_lote.id_lote"), nullable=False)
+    fecha_vencimiento = Column(TIMESTAMP, nullable=False)
+
 class Prescripcion(Base):
     __tablename__ = "prescripcion"
 
@@ -120,6 +150,10 @@ class PrescripcionPrincipio(Base):
     id_principio = Column(UUID(as_uuid=True), ForeignKey("principio_activo.id_principio"), primary_key=True)
     duracion = Column(String(100))
     frecuencia = Column(String(100))
+    # Interpretados al crear la prescripción (prescripciones-service/dosificacion.py)
+    duracion_dias = Column(Integer)
+    tomas_por_dia = Column(Numeric(7, 3))
+    unidades_por_receta = Column(Integer)
 
     prescripcion = relationship("Prescripcion", back_populates="principios")
 
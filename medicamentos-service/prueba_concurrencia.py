@@ -0,0 +1,118 @@
+# Prueba de concurrencia de las mutaciones de stock (crud/stock.py).
+#
+# Crea un medicamento con un solo lote, lanza muchas entregas simultáneas
+# sobre ese lote, cada una en su propia sesión y transacción, y verifica
+# el saldo final exacto del lote y del resumen en stock_medicamento. Se
+# piden más unidades de las que hay, así que parte de las entregas debe
+# rechazarse sin sobrevender. Al terminar borra los datos creados.
+#
+#   python prueba_concurrencia.py
+#   python prueba_concurrencia.py --entregas 500 --cantidad 1000 --unidades 3
+#
+# Termina con código 1 si algún saldo no cuadra.
+import argparse
+import asyncio
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import delete
+from sqlalchemy.future import select
+
+from database import AsyncSessionLocal, engine
+from models import Medicamento, MedicamentoLote, StockMedicamento
+from crud import stock
+
+async def _crear_lote(cantidad: int):
+    id_medicamento = uuid.uuid4()
+    codigo_lote = f"CONCURRENCIA-{id_medicamento.hex[:12]}"
+    async with AsyncSessionLocal() as session:
+        session.add(Medicamento(id_medicamento=id_medicamento, nombre="Prueba de concurrencia", codigo_barras=uuid.uuid4()))
+        await session.flush()
+        await stock.registrar_lote(session, MedicamentoLote(
+            id_medicamento=id_medicamento,
+            lote=codigo_lote,
+            fecha_vencimiento=datetime.now() + timedelta(days=365),
+            cantidad=cantidad,
+            cantidad_reservada=0,
+            cantidad_defectuosa=0,
+            cantidad_en_idea=0,
+            cantidad_en_estado=0,
+            cantidad_envase_roto=0,
+        ))
+        await session.commit()
+    return id_medicamento, codigo_lote
+
+async def _entregar(codigo_lote: str, unidades: int, largada: asyncio.Event) -> str:
+    await largada.wait()
+    async with AsyncSessionLocal() as session:
+        try:
+            await stock.descontar_lote(session, codigo_lote, unidades)
+            await session.commit()
+            return "entregada"
+        except HTTPException as e:
+            if e.status_code != 400:
+                raise
+            return "rechazada"
+
+async def _borrar(id_medicamento: uuid.UUID):
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(StockMedicamento).where(StockMedicamento.id_medicamento == id_medicamento))
+        await session.execute(delete(MedicamentoLote).where(MedicamentoLote.id_medicamento == id_medicamento))
+        await session.execute(delete(Medicamento).where(Medicamento.id_medicamento == id_medicamento))
+        await session.commit()
+
+async def probar(entregas: int, cantidad: int, unidades: int) -> int:
+    id_medicamento, codigo_lote = await _crear_lote(cantidad)
+    try:
+        largada = asyncio.Event()
+        tareas = [asyncio.create_task(_entregar(codigo_lote, unidades, largada)) for _ in range(entregas)]
+        largada.set()
+        resultados = await asyncio.gather(*tareas)
+
+        async with AsyncSessionLocal() as session:
+            lote = (await session.execute(
+                select(MedicamentoLote.cantidad).where(MedicamentoLote.lote == codigo_lote)
+            )).scalar_one()
+            resumen = (await session.execute(
+                select(StockMedicamento.cantidad, StockMedicamento.cantidad_disponible)
+                .where(StockMedicamento.id_medicamento == id_medicamento)
+            )).one()
+    finally:
+        await _borrar(id_medicamento)
+
+    entregadas = resultados.count("entregada")
+    esperadas = min(entregas, cantidad // unidades)
+    saldo_esperado = cantidad - esperadas * unidades
+    print(f"{entregas} entregas de {unidades} sobre un lote de {cantidad}: "
+          f"{entregadas} entregadas, {resultados.count('rechazada')} rechazadas")
+    print(f"Saldo del lote {lote}, resumen {resumen.cantidad} (disponible {resumen.cantidad_disponible}); "
+          f"esperado {saldo_esperado}")
+
+    errores = []
+    if entregadas != esperadas:
+        errores.append(f"se esperaban {esperadas} entregas y hubo {entregadas}")
+    if lote != saldo_esperado:
+        errores.append(f"el lote quedó en {lote}")
+    if resumen.cantidad != saldo_esperado or resumen.cantidad_disponible != saldo_esperado:
+        errores.append(f"el resumen quedó en {resumen.cantidad} (disponible {resumen.cantidad_disponible})")
+    for error in errores:
+        print(f"FALLA  {error}")
+    if not errores:
+        print("OK     saldo exacto")
+    return 1 if errores else 0
+
+async def main(entregas: int, cantidad: int, unidades: int) -> int:
+    try:
+        return await probar(entregas, cantidad, unidades)
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Entregas simultáneas sobre un mismo lote")
+    parser.add_argument("--entregas", type=int, default=300)
+    parser.add_argument("--cantidad", type=int, default=500, help="unidades iniciales del lote")
+    parser.add_argument("--unidades", type=int, default=3, help="unidades por entrega")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.entregas, args.cantidad, args.unidades)))
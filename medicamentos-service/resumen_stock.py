@@ -0,0 +1,44 @@
+# Reconstruye o verifica el resumen de stock (tabla stock_medicamento).
+#
+#   python resumen_stock.py verificar     -> lista medicamentos cuyo resumen no cuadra con los lotes
+#   python resumen_stock.py reconstruir   -> recalcula el resumen completo (y lote_proximo) desde medicamento_lote
+import argparse
+import asyncio
+import sys
+
+from database import AsyncSessionLocal, engine
+from crud import stock
+
+async def verificar() -> int:
+    async with AsyncSessionLocal() as session:
+        diferencias = await stock.diferencias_resumen(session)
+
+    for fila in diferencias:
+        print(
+            f"{fila.id_medicamento}: "
+            f"cantidad {fila.resumen_cantidad} -> {fila.cantidad}, "
+            f"reservada {fila.resumen_cantidad_reservada} -> {fila.cantidad_reservada}, "
+            f"defectuosa {fila.resumen_cantidad_defectuosa} -> {fila.cantidad_defectuosa}, "
+            f"vencimiento {fila.resumen_proximo_vencimiento} -> {fila.proximo_vencimiento}"
+        )
+    print(f"{len(diferencias)} medicamentos con diferencias")
+    return 1 if diferencias else 0
+
+async def reconstruir() -> int:
+    async with AsyncSessionLocal() as session:
+        filas = await stock.reconstruir_resumen(session)
+        await session.commit()
+    print(f"Resumen reconstruido para {filas} medicamentos")
+    return 0
+
+async def main(accion: str) -> int:
+    try:
+        return await (verificar() if accion == "verificar" else reconstruir())
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resumen de stock por medicamento")
+    parser.add_argument("accion", choices=["verificar", "reconstruir"])
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.accion)))
@@ -1,48 +1,89 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
 from uuid import UUID
-from typing import List
+from typing import List, Optional
 
-from database import get_session
+from database import get_session, get_read_session
+from disponibilidad import consultar_disponibilidad, sumar_lineas
 import crud.medicamento as crud
+import crud.ingreso as ingreso
 from schemas.medicamento import (
     ReservarCantidad,
     LoteProximoVencimientoOut,
     ReporteDefecto,
+    ReporteDefectoLote,
+    ResultadoReporteDefectos,
     MedicamentoInfo,
     LoteCreateBase,
     LoteOut,
+    ReservaLoteOut,
     MedicamentoOut,
     PrincipioActivoOut,
     PrincipioActivoDetalleOut,
     EntregaMedicamento,
     EntregaRecetaRequest,
-    EntregaRecetaItem
+    EntregaRecetaItem,
+    EstadisticasCache,
+    ResultadoIngreso,
+    ConsultaDisponibilidad,
+    DisponibilidadOut
 )
+from cache import cache_codigo_barras
+from paginacion import LIMITE_MAXIMO, encabezados_cursor
+from serializacion import respuesta_json
 
 router = APIRouter(prefix="/medicamentos", tags=["Medicamentos"])
 
+# Los listados aceptan ?limite=&cursor=; sin ellos devuelven todo, como antes.
+# El cursor de la página siguiente viene en el header X-Siguiente-Cursor.
+# Las consultas frecuentes responden con respuesta_json (orjson, sin la
+# validación ni el jsonable_encoder de FastAPI).
 @router.get("", response_model=List[MedicamentoOut])
-async def read_medicamentos(session: AsyncSession = Depends(get_session)):
-    medicamentos = await crud.get_medicamentos(session)
-    return medicamentos
+async def read_medicamentos(
+    limite: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_read_session)
+):
+    medicamentos, siguiente = await crud.get_medicamentos(session, limite, cursor)
+    return respuesta_json(medicamentos, MedicamentoOut, headers=encabezados_cursor(siguiente))
 
 @router.get("/{id_medicamento}/lotes", response_model=List[LoteOut])
 async def obtener_lotes_por_medicamento(
     id_medicamento: UUID,
-    session: AsyncSession = Depends(get_session)
+    limite: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    solo_disponibles: bool = False,
+    vence_antes: Optional[datetime] = None,
+    session: AsyncSession = Depends(get_read_session)
 ):
-    lotes = await crud.get_lotes_por_medicamento(session, id_medicamento)
-    if not lotes:
+    lotes, siguiente = await crud.get_lotes_por_medicamento(
+        session, id_medicamento, limite, cursor, solo_disponibles, vence_antes
+    )
+    if not lotes and cursor is None:
         raise HTTPException(status_code=404, detail="No se encontraron lotes para este medicamento")
-    return lotes
+    return respuesta_json(lotes, LoteOut, headers=encabezados_cursor(siguiente))
 
 @router.get("/codigo_barras/{codigo_barras}", response_model=MedicamentoInfo)
-async def obtener_info_medicamento(codigo_barras: UUID, session: AsyncSession = Depends(get_session)):
+async def obtener_info_medicamento(codigo_barras: UUID, session: AsyncSession = Depends(get_read_session)):
     medicamento = await crud.get_medicamento_por_codigo_barras(session, codigo_barras)
     if not medicamento:
         raise HTTPException(status_code=404, detail="Medicamento no encontrado")
-    return medicamento
+    return respuesta_json(medicamento, MedicamentoInfo)
+
+@router.get("/cache/codigo_barras", response_model=EstadisticasCache)
+async def estadisticas_cache_codigo_barras():
+    return cache_codigo_barras.estadisticas()
+
+@router.delete("/cache/codigo_barras", response_model=EstadisticasCache)
+async def limpiar_cache_codigo_barras():
+    crud.invalidar_codigo_barras()
+    return cache_codigo_barras.estadisticas()
+
+@router.delete("/cache/codigo_barras/{codigo_barras}", response_model=EstadisticasCache)
+async def invalidar_cache_codigo_barras(codigo_barras: UUID):
+    crud.invalidar_codigo_barras(codigo_barras)
+    return cache_codigo_barras.estadisticas()
 
 @router.post("", response_model=LoteOut)
 async def crear_lote(
@@ -51,19 +92,42 @@ async def crear_lote(
 ):
     return await crud.crear_lote_por_codigo(session, lote_data)
 
+@router.post(
+    "/lotes/ingreso",
+    response_model=ResultadoIngreso,
+    summary="Ingreso masivo de lotes desde un manifiesto CSV o NDJSON"
+)
+async def ingreso_masivo_lotes(
+    request: Request,
+    session: AsyncSession = Depends(get_session)
+):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    formato = ingreso.FORMATOS_POR_CONTENT_TYPE.get(content_type)
+    if formato is None:
+        raise HTTPException(
+            status_code=415,
+            detail="El manifiesto debe enviarse como text/csv o application/x-ndjson"
+        )
+    return await ingreso.procesar_manifiesto(session, request.stream(), formato)
+
 @router.get("/principios", response_model=List[PrincipioActivoOut])
-async def listar_principios(session: AsyncSession = Depends(get_session)):
-    return await crud.obtener_todos_los_principios(session)
+async def listar_principios(
+    limite: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_read_session)
+):
+    principios, siguiente = await crud.obtener_todos_los_principios(session, limite, cursor)
+    return respuesta_json(principios, PrincipioActivoOut, headers=encabezados_cursor(siguiente))
 
 @router.get("/principios/{id_principio}", response_model=PrincipioActivoDetalleOut)
 async def detalle_principio(
     id_principio: UUID,
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(get_read_session)
 ):
     detalle = await crud.obtener_detalle_por_principio(session, id_principio)
     if detalle is None:
         raise HTTPException(status_code=404, detail="Principio activo no encontrado")
-    return detalle
+    return respuesta_json(detalle, PrincipioActivoDetalleOut)
 
 @router.post("/lotes/{lote}/entrega", response_model=LoteOut)
 async def registrar_entrega(
@@ -81,6 +145,16 @@ async def reportar_defecto_lote(
 ):
     return await crud.reportar_defecto_en_lote(session, lote, data.tipo, data.cantidad)
 
+# Reporte de defectos de una inspección: varias entradas (lote, tipo,
+# cantidad) en una transacción. Los lotes inexistentes se informan en
+# "rechazados" sin abortar el resto.
+@router.post("/lotes/reportar_defectos", response_model=ResultadoReporteDefectos)
+async def reportar_defectos_lotes(
+    reportes: List[ReporteDefectoLote],
+    session: AsyncSession = Depends(get_session)
+):
+    return await crud.reportar_defectos_en_lotes(session, reportes)
+
 @router.get("/principios/{id_principio}/proximo_vencimiento", response_model=LoteProximoVencimientoOut)
 async def obtener_lote_proximo_vencimiento_con_info(
     id_principio: UUID,
@@ -89,15 +163,46 @@ async def obtener_lote_proximo_vencimiento_con_info(
     info = await crud.get_lote_proximo_vencimiento_info(session, id_principio)
     if info is None:
         raise HTTPException(status_code=404, detail="No hay lotes disponibles para este principio activo")
-    return info
+    return respuesta_json(info, LoteProximoVencimientoOut)
+
+# Disponibilidad de varias líneas (medicamento o principio, cantidad) en una
+# sola consulta agregada; no retiene stock
+@router.post("/disponibilidad", response_model=DisponibilidadOut)
+async def consultar_disponibilidad_lineas(
+    consulta: ConsultaDisponibilidad,
+    session: AsyncSession = Depends(get_read_session)
+):
+    resultado = await consultar_disponibilidad(
+        session,
+        sumar_lineas((l.id_medicamento, l.cantidad) for l in consulta.medicamentos),
+        sumar_lineas((l.id_principio, l.cantidad) for l in consulta.principios),
+        consulta.al
+    )
+    return respuesta_json(resultado)
 
-@router.post("/lotes/{lote}/reservar", response_model=LoteOut)
+# Una reserva retiene stock del lote hasta expira_en; si no se entrega ni
+# se libera antes, el barrido periódico (barrido.py) la libera.
+@router.post("/lotes/{lote}/reservar", response_model=ReservaLoteOut)
 async def reservar_cantidad_lote(
     lote: str,
     entrada: ReservarCantidad,
     session: AsyncSession = Depends(get_session)
 ):
-    return await crud.reservar_medicamento(session, lote, entrada.cantidad)
+    return await crud.reservar_medicamento(session, lote, entrada.cantidad, entrada.ttl_minutos)
+
+@router.delete("/reservas/{id_reserva_lote}", response_model=LoteOut)
+async def liberar_reserva_lote(
+    id_reserva_lote: UUID,
+    session: AsyncSession = Depends(get_session)
+):
+    return await crud.liberar_reserva(session, id_reserva_lote)
+
+@router.post("/reservas/{id_reserva_lote}/entrega", response_model=LoteOut)
+async def entregar_reserva_lote(
+    id_reserva_lote: UUID,
+    session: AsyncSession = Depends(get_session)
+):
+    return await crud.entregar_reserva(session, id_reserva_lote)
 
 # ---------------------------------------------------------
 # Nuevo endpoint: entrega completa basada en receta
@@ -118,4 +223,4 @@ async def entregar_receta(
         datos.rut_retiro,
         datos.nombre_retiro
     )
-    return resultados
\ No newline at end of file
+    return respuesta_json(resultados, EntregaRecetaItem)
\ No newline at end of file
@@ -25,11 +25,41 @@ class LoteCreateBase(BaseModel):
     cantidad_en_estado: Optional[int] = None
     cantidad_envase_roto: Optional[int] = None
 
+# Límites de las columnas de Medicamento_lote (lote VARCHAR(50), cantidades INT)
+LARGO_MAXIMO_LOTE = 50
+MAXIMO_INT = 2**31 - 1
+
+class LoteIngreso(BaseModel):
+    # Fila de un manifiesto de ingreso masivo. Se valida contra los límites
+    # de las columnas: una fila fuera de rango se rechaza sola en vez de
+    # hacer fallar el INSERT de todo su grupo.
+    codigo_barras: UUID
+    lote: str = Field(..., min_length=1, max_length=LARGO_MAXIMO_LOTE)
+    fecha_vencimiento: datetime
+    cantidad: int = Field(..., ge=0, le=MAXIMO_INT)
+    cantidad_defectuosa: int = Field(0, ge=0, le=MAXIMO_INT)
+    cantidad_en_idea: int = Field(0, ge=0, le=MAXIMO_INT)
+    cantidad_en_estado: int = Field(0, ge=0, le=MAXIMO_INT)
+    cantidad_envase_roto: int = Field(0, ge=0, le=MAXIMO_INT)
+
+class FilaRechazada(BaseModel):
+    linea: int
+    lote: Optional[str] = None
+    codigo_barras: Optional[UUID] = None
+    motivo: str
+
+class ResultadoIngreso(BaseModel):
+    total_filas: int
+    insertadas: int
+    rechazadas: List[FilaRechazada]
+    codigos_desconocidos: List[UUID]
+
 class LoteOut(BaseModel):
     id_lote: UUID
     lote: str
     fecha_vencimiento: datetime
     cantidad: int
+    cantidad_reservada: int
     cantidad_defectuosa: int
     cantidad_en_idea: int
     cantidad_en_estado: int
@@ -39,6 +69,11 @@ class LoteOut(BaseModel):
     class Config:
         orm_mode = True
 
+class ReservaLoteOut(LoteOut):
+    id_reserva_lote: UUID
+    cantidad_retenida: int
+    expira_en: datetime
+
 class MedicamentoOut(BaseModel):
     id_medicamento: UUID
     nombre: str
@@ -62,6 +97,8 @@ class MedicamentoCantidadOut(BaseModel):
     dosis_concentracion: str
     via_administracion: str
     cantidad_total: int
+    cantidad_disponible: int = 0
+    proximo_vencimiento: Optional[datetime] = None
 
     class Config:
         orm_mode = True
@@ -71,6 +108,8 @@ class PrincipioActivoDetalleOut(BaseModel):
     nombre: str
     categoria: str
     cantidad_total_medicamentos: int
+    cantidad_disponible: int = 0
+    proximo_vencimiento: Optional[datetime] = None
     medicamentos_diferentes: int
     medicamentos: List[MedicamentoCantidadOut]
 
@@ -88,7 +127,19 @@ class TipoDefecto(str, Enum):
 
 class ReporteDefecto(BaseModel):
     tipo: TipoDefecto
-    cantidad: int
+    cantidad: int = Field(..., gt=0)
+
+class ReporteDefectoLote(ReporteDefecto):
+    lote: str
+
+class DefectoRechazado(BaseModel):
+    indice: int  # posición de la entrada en la lista enviada
+    lote: str
+    motivo: str
+
+class ResultadoReporteDefectos(BaseModel):
+    lotes: List[LoteOut]
+    rechazados: List[DefectoRechazado]
 
 class LoteProximoVencimientoOut(BaseModel):
     nombre_principio: str
@@ -101,16 +152,23 @@ class LoteProximoVencimientoOut(BaseModel):
         orm_mode = True
 
 class ReservarCantidad(BaseModel):
+    cantidad: int = Field(..., gt=0)
+    # Si no se indica, se usa RESERVA_TTL_MINUTOS
+    ttl_minutos: Optional[int] = Field(None, gt=0)
+
+class LoteEntregado(BaseModel):
+    numero_lote: str
     cantidad: int
 
 class EntregaRecetaItem(BaseModel):
     id_principio: UUID
     nombre_principio: str
     nombre_medicamento: Optional[str] = None
-    numero_lote: Optional[str] = None
+    numero_lote: Optional[str] = None  # primer lote usado
     cantidad_solicitada: int
     cantidad_entregada: int
-    estado: str  # "entregado" o "sin_stock"
+    lotes: List[LoteEntregado] = []
+    estado: str  # "entregado", "parcial" o "sin_stock"
 
     class Config:
         orm_mode = True
@@ -123,3 +181,44 @@ class EntregaRecetaRequest(BaseModel):
 
     class Config:
         orm_mode = True
+
+class EstadisticasCache(BaseModel):
+    entradas: int
+    max_entradas: int
+    ttl_segundos: float
+    aciertos: int
+    fallos: int
+    invalidaciones: int
+    tasa_aciertos: float
+
+# Consulta de disponibilidad: pares (medicamento o principio, cantidad)
+class LineaMedicamento(BaseModel):
+    id_medicamento: UUID
+    cantidad: int = Field(..., gt=0)
+
+class LineaPrincipio(BaseModel):
+    id_principio: UUID
+    cantidad: int = Field(..., gt=0)
+
+class ConsultaDisponibilidad(BaseModel):
+    medicamentos: List[LineaMedicamento] = []
+    principios: List[LineaPrincipio] = []
+    # Los lotes no deben vencer antes de esta fecha (por defecto, ahora)
+    al: Optional[datetime] = None
+
+class DisponibilidadMedicamento(BaseModel):
+    id_medicamento: UUID
+    solicitado: int
+    disponible: int
+    suficiente: bool
+
+class DisponibilidadPrincipio(BaseModel):
+    id_principio: UUID
+    solicitado: int
+    disponible: int
+    suficiente: bool
+
+class DisponibilidadOut(BaseModel):
+    medicamentos: List[DisponibilidadMedicamento]
+    principios: List[DisponibilidadPrincipio]
+    suficiente: bool
@@ -0,0 +1,80 @@
+from functools import lru_cache
+from typing import Any, Mapping, Optional, Type
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON
+
+# ---------------------------------------------------------
+# Serialización de respuestas con orjson
+#
+# FastAPI valida lo que devuelve el endpoint contra response_model y lo
+# pasa por jsonable_encoder antes de serializar, lo que en listados
+# largos cuesta más que la consulta. respuesta_json() arma directamente
+# los dicts con los campos del modelo, tomados de filas (Row), objetos
+# ORM o dicts, sin validar (los datos vienen de la base), y orjson los
+# codifica a bytes; UUID, datetime y Enum los maneja orjson de forma
+# nativa. Al devolver una Response, FastAPI se salta ambas pasadas; el
+# response_model del decorador se mantiene para la documentación.
+#
+# Este archivo es igual en todos los servicios Python.
+# ---------------------------------------------------------
+
+def _por_defecto(valor):
+    # Tipos que orjson no conoce
+    if isinstance(valor, BaseModel):
+        return valor.dict()
+    if hasattr(valor, "_asdict"):
+        return valor._asdict()
+    raise TypeError
+
+
+class RespuestaJSON(JSONResponse):
+    # Clase de respuesta por defecto de las apps: también lo que no pasa por
+    # respuesta_json() se codifica con orjson
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_por_defecto, option=orjson.OPT_NON_STR_KEYS)
+
+
+@lru_cache(maxsize=None)
+def _plan(modelo: Type[BaseModel]):
+    # (campo, submodelo o None, es_lista, valor por defecto) por cada campo del modelo
+    plan = []
+    for nombre, campo in modelo.__fields__.items():
+        submodelo = campo.type_ if isinstance(campo.type_, type) and issubclass(campo.type_, BaseModel) else None
+        plan.append((nombre, submodelo, campo.shape != SHAPE_SINGLETON, campo.default))
+    return tuple(plan)
+
+
+def _extraer(modelo: Type[BaseModel], fuente):
+    if isinstance(fuente, Mapping):
+        obtener = fuente.get
+    else:
+        obtener = lambda nombre, defecto: getattr(fuente, nombre, defecto)
+
+    datos = {}
+    for nombre, submodelo, es_lista, defecto in _plan(modelo):
+        valor = obtener(nombre, defecto)
+        if submodelo is not None and valor is not None:
+            valor = [_extraer(submodelo, v) for v in valor] if es_lista else _extraer(submodelo, valor)
+        datos[nombre] = valor
+    return datos
+
+
+def serializar(contenido, modelo: Optional[Type[BaseModel]] = None):
+    # Con modelo, proyecta cada elemento (o el único objeto) a sus campos
+    if modelo is None or contenido is None:
+        return contenido
+    if isinstance(contenido, (list, tuple)):
+        return [_extraer(modelo, elemento) for elemento in contenido]
+    return _extraer(modelo, contenido)
+
+
+def respuesta_json(
+    contenido,
+    modelo: Optional[Type[BaseModel]] = None,
+    status_code: int = 200,
+    headers: Optional[Mapping[str, str]] = None
+) -> RespuestaJSON:
+    return RespuestaJSON(serializar(contenido, modelo), status_code=status_code, headers=headers)
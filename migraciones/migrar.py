@@ -0,0 +1,116 @@
+# Migraciones versionadas del esquema compartido por los servicios Python.
+#
+# Cada archivo versiones/NNNN_nombre.sql es una migración; se aplican en
+# orden, cada una en su propia transacción, y se registran en la tabla
+# version_esquema. init/init.sql es la versión 0.
+#
+#   python migrar.py estado              -> versiones aplicadas y pendientes
+#   python migrar.py aplicar             -> aplica las pendientes
+#   python migrar.py verificar-indices   -> EXPLAIN de las consultas frecuentes sobre datos de prueba
+#
+# Para medir la búsqueda de pacientes a escala de producción:
+#   python migrar.py verificar-indices --pacientes 500000 --medir
+import argparse
+import os
+import re
+import sys
+from pathlib import Path
+
+import psycopg
+
+DIRECTORIO_VERSIONES = Path(__file__).parent / "versiones"
+PATRON_VERSION = re.compile(r"^(\d{4})_(\w+)\.sql$")
+
+# Clave del advisory lock que evita que dos procesos migren a la vez
+LOCK_MIGRACIONES = 727001
+
+
+def url_conexion() -> str:
+    # Acepta la misma DATABASE_URL de los servicios (postgresql+psycopg://...)
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        sys.exit("Falta la variable de entorno DATABASE_URL")
+    return url.replace("postgresql+psycopg://", "postgresql://", 1)
+
+
+def versiones_disponibles():
+    versiones = []
+    for archivo in sorted(DIRECTORIO_VERSIONES.iterdir()):
+        coincidencia = PATRON_VERSION.match(archivo.name)
+        if coincidencia:
+            versiones.append((int(coincidencia.group(1)), coincidencia.group(2), archivo))
+    return versiones
+
+
+def versiones_aplicadas(conn) -> set:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS version_esquema (
+            version INT PRIMARY KEY,
+            nombre VARCHAR(200) NOT NULL,
+            aplicada_en TIMESTAMP NOT NULL DEFAULT now()
+        )
+        """
+    )
+    return {fila[0] for fila in conn.execute("SELECT version FROM version_esquema")}
+
+
+def estado(conn) -> int:
+    aplicadas = versiones_aplicadas(conn)
+    for version, nombre, _ in versiones_disponibles():
+        marca = "aplicada " if version in aplicadas else "pendiente"
+        print(f"{version:04d} {marca} {nombre}")
+    return 0
+
+
+def aplicar(conn) -> int:
+    conn.execute("SELECT pg_advisory_lock(%s)", (LOCK_MIGRACIONES,))
+    try:
+        aplicadas = versiones_aplicadas(conn)
+        for version, nombre, archivo in versiones_disponibles():
+            if version in aplicadas:
+                continue
+            print(f"Aplicando {version:04d} {nombre}")
+            with conn.transaction():
+                conn.execute(archivo.read_text(encoding="utf-8"))
+                conn.execute(
+                    "INSERT INTO version_esquema (version, nombre) VALUES (%s, %s)",
+                    (version, nombre)
+                )
+        print("Esquema al día")
+    finally:
+        conn.execute("SELECT pg_advisory_unlock(%s)", (LOCK_MIGRACIONES,))
+    return 0
+
+
+def verificar_indices(conn, escala: int, pacientes, medir: bool) -> int:
+    from verificacion import verificar
+    return verificar(conn, escala, pacientes, medir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migraciones del esquema")
+    parser.add_argument("accion", choices=["estado", "aplicar", "verificar-indices"])
+    parser.add_argument(
+        "--escala", type=int, default=100_000,
+        help="lotes de prueba a generar para verificar-indices (el resto se escala en proporción)"
+    )
+    parser.add_argument(
+        "--pacientes", type=int,
+        help="pacientes de prueba para verificar-indices (por defecto, escala / 5)"
+    )
+    parser.add_argument(
+        "--medir", action="store_true",
+        help="ejecuta las consultas con EXPLAIN ANALYZE y muestra su tiempo"
+    )
+    args = parser.parse_args()
+
+    # autocommit: cada migración abre su propia transacción explícita
+    with psycopg.connect(url_conexion(), autocommit=True) as conn:
+        if args.accion == "estado":
+            codigo = estado(conn)
+        elif args.accion == "aplicar":
+            codigo = aplicar(conn)
+        else:
+            codigo = verificar_indices(conn, args.escala, args.pacientes, args.medir)
+    sys.exit(codigo)
@@ -0,0 +1,526 @@
+# Verifica con EXPLAIN que las consultas frecuentes de los servicios usan
+# índices. Genera un volumen de datos de prueba dentro de una transacción
+# que siempre se revierte, así que puede correrse contra una base real.
+from pathlib import Path
+from typing import Optional
+import json
+import subprocess
+import sys
+
+import psycopg
+from psycopg.rows import dict_row
+
+# Tablas grandes en producción: un Seq Scan sobre ellas es un error
+TABLAS_GRANDES = {
+    "medicamento_lote",
+    "medicamento_principio",
+    "paciente",
+    "prescripcion",
+    "prescripcion_principio",
+    "receta",
+    "reserva",
+}
+
+DATOS_PRUEBA = """
+CREATE TEMP TABLE prueba_principio ON COMMIT DROP AS
+    SELECT gen_random_uuid() AS id, i FROM generate_series(1, {principios}) i;
+CREATE TEMP TABLE prueba_medicamento ON COMMIT DROP AS
+    SELECT gen_random_uuid() AS id, i FROM generate_series(1, {medicamentos}) i;
+CREATE TEMP TABLE prueba_usuario ON COMMIT DROP AS
+    SELECT gen_random_uuid() AS id, i FROM generate_series(1, 50) i;
+CREATE TEMP TABLE prueba_paciente ON COMMIT DROP AS
+    SELECT gen_random_uuid() AS id, i FROM generate_series(1, {pacientes}) i;
+CREATE TEMP TABLE prueba_prescripcion ON COMMIT DROP AS
+    SELECT gen_random_uuid() AS id, i FROM generate_series(1, {prescripciones}) i;
+
+INSERT INTO principio_activo (id_principio, nombre, categoria)
+SELECT id, 'Principio ' || i, 'prueba' FROM prueba_principio;
+
+INSERT INTO medicamento (id_medicamento, nombre, codigo_barras, dosis_concentracion, via_administracion)
+SELECT id, 'Medicamento ' || i, gen_random_uuid(), '500mg', 'Oral' FROM prueba_medicamento;
+
+INSERT INTO medicamento_principio (id_medicamento, id_principio)
+SELECT m.id, p.id
+FROM prueba_medicamento m
+JOIN prueba_principio p ON p.i = (m.i % {principios}) + 1;
+
+INSERT INTO medicamento_lote (
+    id_medicamento, lote, fecha_vencimiento, cantidad, cantidad_reservada,
+    cantidad_defectuosa, cantidad_en_idea, cantidad_en_estado, cantidad_envase_roto
+)
+SELECT m.id, 'PRUEBA-' || g, now() + (g % 720) * interval '1 day',
+       CASE WHEN g % 3 = 0 THEN 0 ELSE 50 END, 0, 0, 0, 0, 0
+FROM generate_series(1, {lotes}) g
+JOIN prueba_medicamento m ON m.i = (g % {medicamentos}) + 1;
+
+INSERT INTO usuario (id, rut, nombre, contrasena, rol)
+SELECT id, 'PRUEBA-' || i, 'Médico ' || i, '', 'medico' FROM prueba_usuario;
+
+-- Nombres con nombre y dos apellidos, para que la búsqueda por nombre
+-- encuentre muchas coincidencias como en producción
+INSERT INTO paciente (id_paciente, rut, nombre, numero, correo)
+SELECT id, 'PRUEBA-' || i,
+       (ARRAY['María', 'José', 'Juan', 'Ana', 'Luis', 'Carmen', 'Pedro', 'Francisca',
+              'Diego', 'Camila', 'Jorge', 'Valentina', 'Carlos', 'Javiera', 'Felipe',
+              'Catalina', 'Matías', 'Fernanda', 'Sebastián', 'Constanza'])[i % 20 + 1]
+       || ' ' ||
+       (ARRAY['González', 'Muñoz', 'Rojas', 'Díaz', 'Pérez', 'Soto', 'Contreras', 'Silva',
+              'Martínez', 'Sepúlveda', 'Morales', 'Rodríguez', 'López', 'Fuentes', 'Hernández',
+              'Torres', 'Araya', 'Flores', 'Espinoza', 'Valenzuela', 'Castillo', 'Tapia',
+              'Reyes', 'Gutiérrez', 'Castro', 'Pizarro', 'Álvarez', 'Vásquez', 'Sánchez',
+              'Fernández'])[(i / 20) % 30 + 1]
+       || ' ' ||
+       (ARRAY['Vargas', 'Cortés', 'Ramírez', 'Núñez', 'Jara', 'Vergara', 'Rivera', 'Figueroa',
+              'Riquelme', 'García', 'Miranda', 'Bravo', 'Vera', 'Molina', 'Vega', 'Campos',
+              'Sandoval', 'Orellana', 'Zúñiga', 'Olivares', 'Alarcón', 'Gallardo', 'Ortiz',
+              'Garrido', 'Salazar', 'Guzmán', 'Henríquez', 'Saavedra', 'Navarro', 'Aguilera'])[(i / 600) % 30 + 1],
+       i, NULL
+FROM prueba_paciente;
+
+INSERT INTO prescripcion (id_prescripcion, id_medico, id_paciente)
+SELECT pr.id, u.id, pa.id
+FROM prueba_prescripcion pr
+JOIN prueba_usuario u ON u.i = (pr.i % 50) + 1
+JOIN prueba_paciente pa ON pa.i = (pr.i % {pacientes}) + 1;
+
+INSERT INTO prescripcion_principio (id_prescripcion, id_principio, duracion, frecuencia)
+SELECT pr.id, p.id, '30 días', 'cada 8 horas'
+FROM prueba_prescripcion pr
+JOIN prueba_principio p ON p.i = (pr.i % {principios}) + 1;
+
+INSERT INTO receta (id_prescripcion, id_paciente, id_medico, fecha_emision, estado)
+SELECT p.id_prescripcion, p.id_paciente, p.id_medico,
+       now() - (row_number() OVER () % 1000) * interval '1 day', 'pendiente'
+FROM prescripcion p
+JOIN prueba_prescripcion pr ON pr.id = p.id_prescripcion;
+
+INSERT INTO reserva (id_paciente, fecha, estado)
+SELECT pa.id, now() - (g % 1000) * interval '1 day' + (g % 48) * interval '15 minutes',
+       CASE WHEN g % 4 = 0 THEN 'No confirmado' ELSE 'Confirmado' END
+FROM generate_series(1, {reservas}) g
+JOIN prueba_paciente pa ON pa.i = (g % {pacientes}) + 1;
+
+ANALYZE principio_activo, medicamento, medicamento_principio, medicamento_lote,
+        usuario, paciente, prescripcion, prescripcion_principio, receta, reserva;
+"""
+
+# (nombre, consulta, consulta que entrega los parámetros de ejemplo)
+CONSULTAS = [
+    (
+        "lote por código (crud/medicamento.py)",
+        "SELECT * FROM medicamento_lote WHERE lote = %s",
+        "SELECT lote FROM medicamento_lote WHERE lote LIKE 'PRUEBA-%' LIMIT 1",
+    ),
+    (
+        "lotes por medicamento (crud/medicamento.py)",
+        "SELECT * FROM medicamento_lote WHERE id_medicamento = %s",
+        "SELECT id_medicamento FROM medicamento WHERE nombre LIKE 'Medicamento %' LIMIT 1",
+    ),
+    (
+        "recálculo del próximo lote por principio (existencias.py)",
+        """
+        SELECT DISTINCT ON (mp.id_principio) mp.id_principio, l.id_lote, l.fecha_vencimiento
+        FROM medicamento_principio mp
+        JOIN medicamento_lote l ON l.id_medicamento = mp.id_medicamento
+        WHERE mp.id_principio = %s
+          AND l.cantidad > 0
+          AND l.cantidad - l.cantidad_reservada > 0
+          AND l.fecha_vencimiento > localtimestamp
+        ORDER BY mp.id_principio, l.fecha_vencimiento, l.id_lote
+        """,
+        "SELECT id_principio FROM principio_activo WHERE categoria = 'prueba' LIMIT 1",
+    ),
+    (
+        "prescripciones por paciente (prescripciones-service/main.py)",
+        "SELECT * FROM prescripcion WHERE id_paciente = %s",
+        "SELECT id_paciente FROM paciente WHERE rut LIKE 'PRUEBA-%' LIMIT 1",
+    ),
+    (
+        "prescripciones por principio (prescripciones-service/main.py)",
+        "SELECT * FROM prescripcion_principio WHERE id_principio = %s",
+        "SELECT id_principio FROM principio_activo WHERE categoria = 'prueba' LIMIT 1",
+    ),
+    (
+        "recetas por paciente, paginadas (prescripciones-service/main.py)",
+        "SELECT * FROM receta WHERE id_paciente = %s ORDER BY fecha_emision, id_receta LIMIT 101",
+        "SELECT id_paciente FROM paciente WHERE rut LIKE 'PRUEBA-%' LIMIT 1",
+    ),
+    (
+        "recetas por estado y emisión, paginadas (prescripciones-service/main.py)",
+        """
+        SELECT * FROM receta
+        WHERE estado = %s AND fecha_emision >= %s
+        ORDER BY fecha_emision, id_receta
+        LIMIT 101
+        """,
+        "SELECT 'pendiente', now() - interval '7 days'",
+    ),
+    (
+        "prescripciones por médico, paginadas (prescripciones-service/main.py)",
+        "SELECT * FROM prescripcion WHERE id_medico = %s ORDER BY id_prescripcion LIMIT 101",
+        "SELECT id FROM usuario WHERE rut LIKE 'PRUEBA-%' LIMIT 1",
+    ),
+    (
+        "recetas por prescripción (prescripciones-service/main.py)",
+        "SELECT * FROM receta WHERE id_prescripcion = %s",
+        "SELECT id_prescripcion FROM receta LIMIT 1",
+    ),
+    (
+        "reservas del día, paginadas (reservas-service/main.py)",
+        """
+        SELECT * FROM reserva
+        WHERE fecha >= %s AND fecha < %s + interval '1 day'
+        ORDER BY fecha, id_reserva
+        LIMIT 101
+        """,
+        "SELECT date_trunc('day', now()), date_trunc('day', now())",
+    ),
+    (
+        "reservas por estado de la semana, paginadas (reservas-service/main.py)",
+        """
+        SELECT * FROM reserva
+        WHERE estado = %s AND fecha >= %s AND fecha < %s
+        ORDER BY fecha, id_reserva
+        LIMIT 101
+        """,
+        "SELECT 'No confirmado', date_trunc('week', now()), date_trunc('week', now()) + interval '7 days'",
+    ),
+    (
+        "reservas por paciente, paginadas (reservas-service/main.py)",
+        "SELECT * FROM reserva WHERE id_paciente = %s ORDER BY fecha, id_reserva LIMIT 101",
+        "SELECT id_paciente FROM paciente WHERE rut LIKE 'PRUEBA-%' LIMIT 1",
+    ),
+    (
+        "pacientes por RUT (pacientes-service/crud/paciente.py)",
+        "SELECT * FROM paciente WHERE upper(regexp_replace(rut, '[^0-9kK]', '', 'g')) = %s LIMIT 20",
+        "SELECT upper(regexp_replace(rut, '[^0-9kK]', '', 'g')) FROM paciente WHERE rut LIKE 'PRUEBA-%' LIMIT 1",
+    ),
+    (
+        "pacientes por prefijo del nombre (pacientes-service/crud/paciente.py)",
+        """
+        SELECT * FROM paciente
+        WHERE (lower(nombre) COLLATE "C") LIKE %s
+        ORDER BY lower(nombre) COLLATE "C", id_paciente
+        LIMIT 20
+        """,
+        "SELECT 'ma%'",
+    ),
+    (
+        "pacientes por nombre parecido (pacientes-service/crud/paciente.py)",
+        """
+        SELECT * FROM paciente
+        WHERE lower(nombre) LIKE '%%' || %s || '%%' OR %s <%% lower(nombre)
+        ORDER BY (lower(nombre) COLLATE "C") LIKE %s || '%%' DESC,
+                 word_similarity(%s, lower(nombre)) DESC,
+                 lower(nombre) COLLATE "C", id_paciente
+        LIMIT 20
+        """,
+        "SELECT 'sepulveda', 'sepulveda', 'sepulveda', 'sepulveda'",
+    ),
+]
+
+
+# Páginas después de un cursor, con la forma que genera paginacion.py en
+# los servicios: comparación de filas para las columnas de orden y la cola
+# de NULL de la primera en su propia consulta. Además de no recorrer la
+# tabla entera, deben poder leerse como un rango del índice en el orden de
+# la página, cortando en el LIMIT. Con pocas filas después del cursor el
+# planificador puede preferir ordenarlas, así que esto se comprueba en un
+# segundo EXPLAIN con enable_sort desactivado: si aun así hay un Sort, o
+# el cursor queda como Filter del recorrido en vez de condición del
+# índice, cada página lee y ordena todo lo que sigue. Mismo formato que
+# CONSULTAS.
+CONSULTAS_PAGINA_SIGUIENTE = [
+    (
+        "lotes por medicamento, página siguiente (crud/medicamento.py)",
+        """
+        SELECT * FROM medicamento_lote
+        WHERE id_medicamento = %s AND (fecha_vencimiento, id_lote) > (%s, %s)
+        ORDER BY fecha_vencimiento, id_lote
+        LIMIT 101
+        """,
+        "SELECT id_medicamento, fecha_vencimiento, id_lote FROM medicamento_lote WHERE lote LIKE 'PRUEBA-%' LIMIT 1",
+    ),
+    (
+        "lotes por medicamento sin vencimiento, página siguiente (crud/medicamento.py)",
+        """
+        SELECT * FROM medicamento_lote
+        WHERE id_medicamento = %s AND fecha_vencimiento IS NULL
+        ORDER BY fecha_vencimiento, id_lote
+        LIMIT 101
+        """,
+        "SELECT id_medicamento FROM medicamento WHERE nombre LIKE 'Medicamento %' LIMIT 1",
+    ),
+    (
+        "recetas, página siguiente (prescripciones-service/main.py)",
+        """
+        SELECT r.*, p.nombre AS nombre_paciente, u.nombre AS nombre_medico
+        FROM receta r
+        LEFT JOIN paciente p ON p.id_paciente = r.id_paciente
+        LEFT JOIN usuario u ON u.id = r.id_medico
+        WHERE (r.fecha_emision, r.id_receta) > (%s, %s)
+        ORDER BY r.fecha_emision, r.id_receta
+        LIMIT 101
+        """,
+        "SELECT fecha_emision, id_receta FROM receta ORDER BY fecha_emision, id_receta LIMIT 1",
+    ),
+    (
+        "recetas por paciente, página siguiente (prescripciones-service/main.py)",
+        """
+        SELECT r.*, p.nombre AS nombre_paciente, u.nombre AS nombre_medico
+        FROM receta r
+        LEFT JOIN paciente p ON p.id_paciente = r.id_paciente
+        LEFT JOIN usuario u ON u.id = r.id_medico
+        WHERE r.id_paciente = %s AND (r.fecha_emision, r.id_receta) > (%s, %s)
+        ORDER BY r.fecha_emision, r.id_receta
+        LIMIT 101
+        """,
+        "SELECT id_paciente, fecha_emision, id_receta FROM receta ORDER BY fecha_emision, id_receta LIMIT 1",
+    ),
+    (
+        "recetas sin emisión, página siguiente (prescripciones-service/main.py)",
+        """
+        SELECT r.*, p.nombre AS nombre_paciente, u.nombre AS nombre_medico
+        FROM receta r
+        LEFT JOIN paciente p ON p.id_paciente = r.id_paciente
+        LEFT JOIN usuario u ON u.id = r.id_medico
+        WHERE r.fecha_emision IS NULL AND r.id_receta > %s
+        ORDER BY r.fecha_emision, r.id_receta
+        LIMIT 101
+        """,
+        "SELECT id_receta FROM receta ORDER BY id_receta LIMIT 1",
+    ),
+    (
+        "reservas, página siguiente (reservas-service/main.py)",
+        """
+        SELECT id_reserva, id_paciente, fecha, estado FROM reserva
+        WHERE (fecha, id_reserva) > (%s, %s)
+        ORDER BY fecha, id_reserva
+        LIMIT 101
+        """,
+        "SELECT fecha, id_reserva FROM reserva ORDER BY fecha, id_reserva LIMIT 1",
+    ),
+    (
+        "reservas por estado, página siguiente (reservas-service/main.py)",
+        """
+        SELECT id_reserva, id_paciente, fecha, estado FROM reserva
+        WHERE estado = %s AND fecha < %s AND (fecha, id_reserva) > (%s, %s)
+        ORDER BY fecha, id_reserva
+        LIMIT 101
+        """,
+        "SELECT estado, localtimestamp, fecha, id_reserva FROM reserva WHERE estado = 'No confirmado' "
+        "ORDER BY fecha, id_reserva LIMIT 1",
+    ),
+    (
+        "reservas por paciente, página siguiente (reservas-service/main.py)",
+        """
+        SELECT id_reserva, id_paciente, fecha, estado FROM reserva
+        WHERE id_paciente = %s AND (fecha, id_reserva) > (%s, %s)
+        ORDER BY fecha, id_reserva
+        LIMIT 101
+        """,
+        "SELECT id_paciente, fecha, id_reserva FROM reserva ORDER BY fecha, id_reserva LIMIT 1",
+    ),
+    (
+        "reservas sin fecha, página siguiente (reservas-service/main.py)",
+        """
+        SELECT id_reserva, id_paciente, fecha, estado FROM reserva
+        WHERE fecha IS NULL AND id_reserva > %s
+        ORDER BY fecha, id_reserva
+        LIMIT 101
+        """,
+        "SELECT id_reserva FROM reserva ORDER BY id_reserva LIMIT 1",
+    ),
+]
+
+
+# Sentencias que se compilan desde el código de los servicios en vez de
+# copiarse aquí a mano, para verificar exactamente lo que ejecutan:
+# (nombre, servicio, módulo.atributo, consulta que entrega los parámetros
+# de ejemplo por nombre, índice que la sentencia debe poder usar, índices
+# que compiten con él). Se compilan en un proceso aparte con el
+# directorio del servicio como raíz, así que necesitan las dependencias
+# del servicio; sin ellas (p. ej. en el contenedor de migraciones) se
+# omiten.
+#
+# Con pocos datos el planificador puede preferir otro índice, así que el
+# índice esperado se comprueba en un segundo EXPLAIN sin los que
+# compiten: si aun así no lo usa, la sentencia no puede usarlo (p. ej.
+# no implica el predicado de un índice parcial).
+DIRECTORIO_SERVICIOS = Path(__file__).resolve().parent.parent
+
+SENTENCIAS_SERVICIOS = [
+    (
+        "plan de entrega por receta (medicamentos-service/crud/medicamento.py)",
+        "medicamentos-service",
+        "crud.medicamento._PLAN_ENTREGA_RECETA",
+        "SELECT id_receta FROM receta LIMIT 1",
+        "idx_medicamento_lote_con_stock",
+        ("idx_medicamento_lote_medicamento_vencimiento",),
+    ),
+]
+
+_COMPILAR = """
+import importlib, json, sys
+from sqlalchemy.dialects.postgresql import psycopg
+modulo, atributo = sys.argv[1].rsplit(".", 1)
+compilada = getattr(importlib.import_module(modulo), atributo).compile(dialect=psycopg.dialect())
+print(json.dumps({"sql": str(compilada), "parametros": compilada.params}, default=str))
+"""
+
+
+def compilar_sentencia(servicio: str, ruta: str) -> dict:
+    # Devuelve {"sql", "parametros"}; lanza RuntimeError si no se pudo compilar
+    directorio = DIRECTORIO_SERVICIOS / servicio
+    if not directorio.is_dir():
+        raise RuntimeError(f"no se encontró {servicio}")
+    proceso = subprocess.run(
+        [sys.executable, "-c", _COMPILAR, ruta],
+        cwd=directorio, capture_output=True, text=True
+    )
+    if proceso.returncode != 0:
+        ultima = (proceso.stderr.strip().splitlines() or ["error desconocido"])[-1]
+        raise RuntimeError(ultima)
+    return json.loads(proceso.stdout)
+
+
+def _recorrer_plan(nodo):
+    yield nodo
+    for hijo in nodo.get("Plans", []):
+        yield from _recorrer_plan(hijo)
+
+
+def escaneos_secuenciales(plan: dict) -> list:
+    return sorted({
+        nodo["Relation Name"]
+        for nodo in _recorrer_plan(plan)
+        if nodo["Node Type"] == "Seq Scan" and nodo.get("Relation Name") in TABLAS_GRANDES
+    })
+
+
+def recorrido_en_orden(plan: dict) -> bool:
+    # Sin Sort y sin filas de tablas grandes descartadas por un Filter
+    for nodo in _recorrer_plan(plan):
+        if nodo["Node Type"] in ("Sort", "Incremental Sort"):
+            return False
+        if nodo.get("Relation Name") in TABLAS_GRANDES and "Filter" in nodo:
+            return False
+    return True
+
+
+def indices_usados(plan: dict) -> set:
+    return {nodo["Index Name"] for nodo in _recorrer_plan(plan) if "Index Name" in nodo}
+
+
+def _explicar(conn, consulta: str, parametros, medir: bool):
+    # Con medir, ANALYZE ejecuta la consulta (solo lecturas) y entrega su tiempo
+    explain = "EXPLAIN (ANALYZE, FORMAT JSON) " if medir else "EXPLAIN (FORMAT JSON) "
+    fila = conn.execute(explain + consulta, parametros).fetchone()
+    plan = fila[0] if isinstance(fila[0], list) else json.loads(fila[0])
+    tiempo = f" ({plan[0]['Execution Time']:.2f} ms)" if medir else ""
+    return plan[0]["Plan"], tiempo
+
+
+def _indices_sin_competencia(conn, consulta: str, parametros, ocultos) -> set:
+    # DROP INDEX dentro de un savepoint que se revierte: el bloqueo de la
+    # tabla dura solo este EXPLAIN y lock_timeout evita quedar en cola
+    # detrás de transacciones largas
+    with conn.transaction(force_rollback=True):
+        conn.execute("SET LOCAL lock_timeout = '2s'")
+        for indice in ocultos:
+            conn.execute(f"DROP INDEX IF EXISTS {indice}")
+        plan, _ = _explicar(conn, consulta, parametros, False)
+    return indices_usados(plan)
+
+
+def _plan_sin_ordenar(conn, consulta: str, parametros) -> dict:
+    with conn.transaction(force_rollback=True):
+        conn.execute("SET LOCAL enable_sort = off")
+        plan, _ = _explicar(conn, consulta, parametros, False)
+    return plan
+
+
+def verificar(conn, escala: int, pacientes: Optional[int] = None, medir: bool = False) -> int:
+    proporciones = {
+        "lotes": escala,
+        "principios": max(escala // 200, 1),
+        "medicamentos": max(escala // 50, 1),
+        "pacientes": pacientes or max(escala // 5, 1),
+        "prescripciones": max(escala // 2, 1),
+        "reservas": max(escala // 2, 1),
+    }
+    fallas = omitidas = 0
+    total = len(CONSULTAS) + len(CONSULTAS_PAGINA_SIGUIENTE) + len(SENTENCIAS_SERVICIOS)
+
+    # Se compilan antes de abrir la transacción de prueba
+    compiladas = {}
+    for nombre, servicio, ruta, _, _, _ in SENTENCIAS_SERVICIOS:
+        try:
+            compiladas[nombre] = compilar_sentencia(servicio, ruta)
+        except RuntimeError as e:
+            compiladas[nombre] = e
+
+    with conn.transaction(force_rollback=True):
+        print(f"Generando datos de prueba ({escala} lotes, {proporciones['pacientes']} pacientes)...")
+        # Sin parámetros para poder enviar varias sentencias; los valores son enteros
+        conn.execute(DATOS_PRUEBA.format(**proporciones))
+
+        for nombre, consulta, muestra in CONSULTAS:
+            parametros = conn.execute(muestra).fetchone()
+            plan, tiempo = _explicar(conn, consulta, parametros, medir)
+            secuenciales = escaneos_secuenciales(plan)
+
+            if secuenciales:
+                fallas += 1
+                print(f"FALLA  {nombre}: Seq Scan sobre {', '.join(secuenciales)}{tiempo}")
+            else:
+                print(f"OK     {nombre}{tiempo}")
+
+        for nombre, consulta, muestra in CONSULTAS_PAGINA_SIGUIENTE:
+            parametros = conn.execute(muestra).fetchone()
+            plan, tiempo = _explicar(conn, consulta, parametros, medir)
+            secuenciales = escaneos_secuenciales(plan)
+
+            if secuenciales:
+                fallas += 1
+                print(f"FALLA  {nombre}: Seq Scan sobre {', '.join(secuenciales)}{tiempo}")
+            elif not recorrido_en_orden(_plan_sin_ordenar(conn, consulta, parametros)):
+                fallas += 1
+                print(f"FALLA  {nombre}: el cursor no es un rango del índice en el orden de la página{tiempo}")
+            else:
+                print(f"OK     {nombre}{tiempo}")
+
+        for nombre, _, _, muestra, indice, ocultos in SENTENCIAS_SERVICIOS:
+            compilada = compiladas[nombre]
+            if isinstance(compilada, RuntimeError):
+                omitidas += 1
+                print(f"OMITIDA {nombre}: {compilada}")
+                continue
+
+            with conn.cursor(row_factory=dict_row) as cur:
+                ejemplo = cur.execute(muestra).fetchone() or {}
+            parametros = {**compilada["parametros"], **ejemplo}
+            plan, tiempo = _explicar(conn, compilada["sql"], parametros, medir)
+            secuenciales = escaneos_secuenciales(plan)
+
+            if secuenciales:
+                fallas += 1
+                print(f"FALLA  {nombre}: Seq Scan sobre {', '.join(secuenciales)}{tiempo}")
+                continue
+            try:
+                utilizable = indice in indices_usados(plan) or indice in _indices_sin_competencia(
+                    conn, compilada["sql"], parametros, ocultos
+                )
+            except psycopg.errors.LockNotAvailable:
+                omitidas += 1
+                print(f"OMITIDA {nombre}: tabla ocupada, no se pudo comprobar {indice}")
+                continue
+            if not utilizable:
+                fallas += 1
+                print(f"FALLA  {nombre}: no puede usar {indice}{tiempo}")
+            else:
+                print(f"OK     {nombre}{tiempo}")
+
+    print(f"{total - fallas - omitidas}/{total} consultas usan índices"
+          + (f" ({omitidas} omitidas)" if omitidas else ""))
+    return 1 if fallas else 0
@@ -0,0 +1,22 @@
+-- Resumen de stock por medicamento, mantenido por medicamentos-service
+CREATE TABLE IF NOT EXISTS Stock_medicamento (
+    ID_medicamento UUID PRIMARY KEY REFERENCES Medicamento(ID_medicamento),
+    cantidad INT NOT NULL DEFAULT 0,
+    cantidad_reservada INT NOT NULL DEFAULT 0,
+    cantidad_defectuosa INT NOT NULL DEFAULT 0,
+    cantidad_disponible INT GENERATED ALWAYS AS (cantidad - cantidad_reservada) STORED,
+    proximo_vencimiento TIMESTAMP
+);
+
+-- Construir el resumen a partir de los lotes existentes
+INSERT INTO Stock_medicamento (ID_medicamento, cantidad, cantidad_reservada, cantidad_defectuosa, proximo_vencimiento)
+SELECT m.ID_medicamento,
+       COALESCE(SUM(l.cantidad), 0),
+       COALESCE(SUM(l.cantidad_reservada), 0),
+       COALESCE(SUM(COALESCE(l.cantidad_defectuosa, 0) + COALESCE(l.cantidad_en_idea, 0)
+                    + COALESCE(l.cantidad_en_estado, 0) + COALESCE(l.cantidad_envase_roto, 0)), 0),
+       MIN(l.fecha_vencimiento) FILTER (WHERE l.cantidad > 0)
+FROM Medicamento m
+LEFT JOIN Medicamento_lote l ON l.ID_medicamento = m.ID_medicamento
+GROUP BY m.ID_medicamento
+ON CONFLICT (ID_medicamento) DO NOTHING;
@@ -0,0 +1,28 @@
+-- Índices secundarios para las consultas frecuentes de los servicios.
+-- Se crean dentro de la transacción de la migración (sin CONCURRENTLY);
+-- en una base con mucho volumen conviene aplicarla fuera de horario.
+
+-- medicamentos-service: lote por código, lotes por medicamento y FEFO
+CREATE INDEX IF NOT EXISTS idx_medicamento_lote_lote
+    ON Medicamento_lote (lote);
+CREATE INDEX IF NOT EXISTS idx_medicamento_lote_medicamento
+    ON Medicamento_lote (ID_medicamento);
+CREATE INDEX IF NOT EXISTS idx_medicamento_lote_vencimiento
+    ON Medicamento_lote (fecha_vencimiento);
+CREATE INDEX IF NOT EXISTS idx_medicamento_lote_con_stock
+    ON Medicamento_lote (ID_medicamento, fecha_vencimiento, id_lote)
+    WHERE cantidad > 0;
+CREATE INDEX IF NOT EXISTS idx_medicamento_principio_principio
+    ON Medicamento_principio (ID_principio);
+
+-- prescripciones-service
+CREATE INDEX IF NOT EXISTS idx_prescripcion_paciente
+    ON Prescripcion (ID_paciente);
+CREATE INDEX IF NOT EXISTS idx_prescripcion_principio_principio
+    ON Prescripcion_principio (ID_principio);
+CREATE INDEX IF NOT EXISTS idx_receta_prescripcion
+    ON Receta (ID_prescripcion);
+
+-- reservas-service
+CREATE INDEX IF NOT EXISTS idx_reserva_fecha
+    ON Reserva (fecha);
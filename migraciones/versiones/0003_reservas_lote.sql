@@ -0,0 +1,24 @@
+-- Reservas de stock con vencimiento sobre un lote.
+-- Medicamento_lote.cantidad_reservada pasa a ser la suma de las reservas
+-- vigentes (aún no barridas) del lote.
+CREATE TABLE IF NOT EXISTS Reserva_lote (
+    ID_reserva_lote UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    ID_lote UUID NOT NULL REFERENCES Medicamento_lote(ID_lote),
+    cantidad INT NOT NULL CHECK (cantidad > 0),
+    creada_en TIMESTAMP NOT NULL DEFAULT localtimestamp,
+    expira_en TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_reserva_lote_expira ON Reserva_lote (expira_en);
+CREATE INDEX IF NOT EXISTS idx_reserva_lote_lote ON Reserva_lote (ID_lote);
+
+UPDATE Medicamento_lote SET cantidad_reservada = 0 WHERE cantidad_reservada IS NULL;
+ALTER TABLE Medicamento_lote
+    ALTER COLUMN cantidad_reservada SET DEFAULT 0,
+    ALTER COLUMN cantidad_reservada SET NOT NULL;
+
+-- Las reservas previas no tenían vencimiento: se les da un día de plazo
+INSERT INTO Reserva_lote (ID_lote, cantidad, expira_en)
+SELECT ID_lote, cantidad_reservada, localtimestamp + interval '1 day'
+FROM Medicamento_lote
+WHERE cantidad_reservada > 0;
@@ -0,0 +1,17 @@
+-- Próximo lote a dispensar por principio activo, mantenido por
+-- medicamentos-service en cada cambio de stock o de reservas.
+CREATE TABLE IF NOT EXISTS Lote_proximo (
+    ID_principio UUID PRIMARY KEY REFERENCES Principio_activo(ID_principio),
+    ID_lote UUID NOT NULL REFERENCES Medicamento_lote(ID_lote),
+    fecha_vencimiento TIMESTAMP NOT NULL
+);
+
+INSERT INTO Lote_proximo (ID_principio, ID_lote, fecha_vencimiento)
+SELECT DISTINCT ON (mp.ID_principio) mp.ID_principio, l.ID_lote, l.fecha_vencimiento
+FROM Medicamento_principio mp
+JOIN Medicamento_lote l ON l.ID_medicamento = mp.ID_medicamento
+WHERE l.cantidad > 0
+  AND l.cantidad > l.cantidad_reservada
+  AND l.fecha_vencimiento > localtimestamp
+ORDER BY mp.ID_principio, l.fecha_vencimiento, l.ID_lote
+ON CONFLICT (ID_principio) DO NOTHING;
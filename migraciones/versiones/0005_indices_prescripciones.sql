@@ -0,0 +1,21 @@
+-- Índices para los listados paginados de prescripciones-service.
+-- Cada filtro lleva al final las columnas de orden del listado, así la
+-- página siguiente es un recorrido de rango sobre el índice.
+
+-- Prescripciones: orden por id_prescripcion, filtro por paciente o médico
+CREATE INDEX IF NOT EXISTS idx_prescripcion_paciente_id
+    ON Prescripcion (ID_paciente, ID_prescripcion);
+CREATE INDEX IF NOT EXISTS idx_prescripcion_medico_id
+    ON Prescripcion (ID_medico, ID_prescripcion);
+-- Reemplazado por idx_prescripcion_paciente_id
+DROP INDEX IF EXISTS idx_prescripcion_paciente;
+
+-- Recetas: orden por (fecha_emision, id_receta)
+CREATE INDEX IF NOT EXISTS idx_receta_emision
+    ON Receta (fecha_emision, ID_receta);
+CREATE INDEX IF NOT EXISTS idx_receta_paciente_emision
+    ON Receta (ID_paciente, fecha_emision, ID_receta);
+CREATE INDEX IF NOT EXISTS idx_receta_medico_emision
+    ON Receta (ID_medico, fecha_emision, ID_receta);
+CREATE INDEX IF NOT EXISTS idx_receta_estado_emision
+    ON Receta (estado, fecha_emision, ID_receta);
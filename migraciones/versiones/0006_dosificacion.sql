@@ -0,0 +1,46 @@
+-- Dosificación estructurada en Prescripcion_principio. prescripciones-service
+-- la calcula al crear la prescripción (dosificacion.py); aquí se completa
+-- para las filas existentes con las mismas reglas.
+ALTER TABLE Prescripcion_principio
+    ADD COLUMN IF NOT EXISTS duracion_dias INT CHECK (duracion_dias > 0),
+    ADD COLUMN IF NOT EXISTS tomas_por_dia NUMERIC(7, 3) CHECK (tomas_por_dia > 0),
+    ADD COLUMN IF NOT EXISTS unidades_por_receta INT CHECK (unidades_por_receta >= 0);
+
+WITH normalizado AS (
+    SELECT ID_prescripcion, ID_principio,
+           regexp_replace(lower(btrim(duracion)), '\s+', ' ', 'g') AS duracion,
+           regexp_replace(lower(btrim(frecuencia)), '\s+', ' ', 'g') AS frecuencia
+    FROM Prescripcion_principio
+),
+interpretado AS (
+    SELECT ID_prescripcion, ID_principio,
+           regexp_match(duracion, '^([0-9]{1,4}) ?(d[ií]as?|semanas?|mes(es)?)?$') AS d,
+           -- Filas antiguas: la entrega tomaba la primera palabra como días
+           substring(duracion FROM '^([0-9]{1,4})( |$)') AS d_antigua,
+           regexp_match(frecuencia, '^cada ([0-9]{1,3}) ?(horas?|hrs?|h)$') AS f_horas,
+           regexp_match(frecuencia, '^([0-9]{1,2}) ?(vez|veces) al d[ií]a$') AS f_veces,
+           regexp_match(frecuencia, '^cada ([0-9]{1,3}) ?d[ií]as?$') AS f_dias
+    FROM normalizado
+),
+calculado AS (
+    SELECT ID_prescripcion, ID_principio,
+           NULLIF(CASE
+               WHEN d IS NOT NULL THEN d[1]::int * CASE left(coalesce(d[2], 'd'), 1)
+                                                     WHEN 's' THEN 7 WHEN 'm' THEN 30 ELSE 1 END
+               ELSE d_antigua::int
+           END, 0) AS dias,
+           round(CASE
+               WHEN f_horas IS NOT NULL THEN 24.0 / NULLIF(f_horas[1]::int, 0)
+               WHEN f_veces IS NOT NULL THEN NULLIF(f_veces[1]::int, 0)
+               WHEN f_dias IS NOT NULL THEN 1.0 / NULLIF(f_dias[1]::int, 0)
+           END, 3) AS tomas
+    FROM interpretado
+)
+UPDATE Prescripcion_principio pp
+SET duracion_dias = c.dias,
+    tomas_por_dia = c.tomas,
+    unidades_por_receta = c.dias / 2
+FROM calculado c
+WHERE pp.ID_prescripcion = c.ID_prescripcion
+  AND pp.ID_principio = c.ID_principio
+  AND pp.duracion_dias IS NULL;
@@ -0,0 +1,14 @@
+-- Índices para el listado paginado de reservas-service (GET /reservas).
+-- Orden por (fecha, id_reserva); cada filtro lleva al final las columnas
+-- de orden, así la página siguiente es un recorrido de rango sobre el
+-- índice sin importar cuánto historial haya.
+
+CREATE INDEX IF NOT EXISTS idx_reserva_fecha_id
+    ON Reserva (fecha, ID_reserva);
+-- Reservas de un estado en un rango de fechas (p. ej. las no confirmadas de hoy)
+CREATE INDEX IF NOT EXISTS idx_reserva_estado_fecha
+    ON Reserva (estado, fecha, ID_reserva);
+CREATE INDEX IF NOT EXISTS idx_reserva_paciente_fecha
+    ON Reserva (ID_paciente, fecha, ID_reserva);
+-- Reemplazado por idx_reserva_fecha_id
+DROP INDEX IF EXISTS idx_reserva_fecha;
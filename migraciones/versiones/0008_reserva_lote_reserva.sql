@@ -0,0 +1,9 @@
+-- Las reservas de retiro confirmadas (reservas-service) retienen stock con
+-- filas de Reserva_lote; ID_reserva indica a qué reserva pertenece cada
+-- retención. Las retenciones hechas directamente sobre un lote quedan en NULL.
+ALTER TABLE Reserva_lote
+    ADD COLUMN IF NOT EXISTS ID_reserva UUID REFERENCES Reserva(ID_reserva);
+
+CREATE INDEX IF NOT EXISTS idx_reserva_lote_reserva
+    ON Reserva_lote (ID_reserva) WHERE ID_reserva IS NOT NULL;
+
@@ -0,0 +1,13 @@
+-- Respuestas guardadas por Idempotency-Key (idempotencia.py en
+-- prescripciones-service y reservas-service). respuesta es el cuerpo JSON
+-- ya codificado; las filas vencidas las borra la purga periódica.
+CREATE TABLE IF NOT EXISTS Clave_idempotencia (
+    clave VARCHAR(255) PRIMARY KEY,
+    huella CHAR(64) NOT NULL,
+    estado_http SMALLINT NOT NULL,
+    respuesta BYTEA NOT NULL,
+    expira_en TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_clave_idempotencia_expira
+    ON Clave_idempotencia (expira_en);
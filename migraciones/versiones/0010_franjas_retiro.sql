@@ -0,0 +1,21 @@
+-- Franjas de retiro en farmacia (reservas-service/franjas.py): una fila
+-- por franja con reservas, con sus contadores de ocupación.
+CREATE TABLE IF NOT EXISTS Franja_retiro (
+    inicio TIMESTAMP PRIMARY KEY,
+    ocupadas INT NOT NULL DEFAULT 0 CHECK (ocupadas >= 0),
+    confirmadas INT NOT NULL DEFAULT 0 CHECK (confirmadas >= 0)
+);
+
+-- Contadores de las reservas ya tomadas desde hoy, con franjas de 15
+-- minutos (FRANJA_MINUTOS por defecto). Si el servicio usa otra duración,
+-- recalcular con la misma consulta y ese intervalo.
+INSERT INTO Franja_retiro (inicio, ocupadas, confirmadas)
+SELECT date_bin(interval '15 minutes', fecha, timestamp '2000-01-01'),
+       count(*),
+       count(*) FILTER (WHERE estado = 'Confirmado')
+FROM Reserva
+WHERE fecha >= date_trunc('day', localtimestamp)
+GROUP BY 1
+ON CONFLICT (inicio) DO UPDATE
+    SET ocupadas = excluded.ocupadas,
+        confirmadas = excluded.confirmadas;
@@ -0,0 +1,14 @@
+-- Búsqueda de pacientes (pacientes-service, GET /pacientes/buscar). Las
+-- expresiones de los índices deben coincidir exactamente con las de
+-- crud/paciente.py.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- RUT sin puntos ni guion y con K mayúscula: igualdad
+CREATE INDEX IF NOT EXISTS idx_paciente_rut_normalizado
+    ON Paciente ((upper(regexp_replace(RUT, '[^0-9kK]', '', 'g'))));
+-- Nombre por prefijo, ya ordenado (collation "C" para que sirva a LIKE)
+CREATE INDEX IF NOT EXISTS idx_paciente_nombre_prefijo
+    ON Paciente ((lower(nombre) COLLATE "C"), ID_paciente);
+-- Nombre que contiene el texto o se le parece (LIKE '%texto%' y <%)
+CREATE INDEX IF NOT EXISTS idx_paciente_nombre_trgm
+    ON Paciente USING gin (lower(nombre) gin_trgm_ops);
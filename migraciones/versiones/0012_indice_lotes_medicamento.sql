@@ -0,0 +1,8 @@
+-- Lotes de un medicamento ordenados por (fecha_vencimiento, id_lote), el
+-- orden del listado paginado de medicamentos-service: la página después
+-- de un cursor es un recorrido de rango sobre este índice. El índice
+-- parcial idx_medicamento_lote_con_stock solo sirve a los lotes con stock.
+CREATE INDEX IF NOT EXISTS idx_medicamento_lote_medicamento_vencimiento
+    ON Medicamento_lote (ID_medicamento, fecha_vencimiento, ID_lote);
+-- Reemplazado por idx_medicamento_lote_medicamento_vencimiento
+DROP INDEX IF EXISTS idx_medicamento_lote_medicamento;
@@ -1,15 +1,20 @@
+from sqlalchemy import bindparam, func, literal, literal_column, or_
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
 from models import Paciente
 from schemas import PacienteCreate, PacienteUpdate
+import re
 
 async def get_pacientes(db: AsyncSession):
     result = await db.execute(select(Paciente))
     return result.scalars().all()
 
+# Armada una sola vez; en cada llamada solo cambia el parámetro
+PACIENTE_POR_ID = select(Paciente).where(Paciente.id_paciente == bindparam("paciente_id"))
+
 async def get_paciente(db: AsyncSession, paciente_id: UUID):
-    result = await db.execute(select(Paciente).where(Paciente.id_paciente == paciente_id))
+    result = await db.execute(PACIENTE_POR_ID, {"paciente_id": paciente_id})
     return result.scalars().first()
 
 async def create_paciente(db: AsyncSession, paciente: PacienteCreate):
@@ -27,3 +32,64 @@ async def update_paciente(db: AsyncSession, paciente_id: UUID, paciente: Pacient
         await db.commit()
         await db.refresh(db_paciente)
     return db_paciente
+
+# ---------------------------------------------------------
+# Búsqueda de pacientes por RUT o nombre
+#
+# Un texto con forma de RUT (dígitos y dígito verificador, con o sin
+# puntos y guion) se busca por igualdad sobre el RUT normalizado; lo
+# demás, por nombre: primero los que empiezan con el texto y luego los
+# que lo contienen o se le parecen (pg_trgm), ordenados por similitud.
+# Los índices están en la migración 0011; las expresiones de aquí deben
+# ser idénticas a las de esos índices (por eso van como literales y no
+# como parámetros).
+# ---------------------------------------------------------
+
+RUT_NORMALIZADO = func.upper(
+    func.regexp_replace(Paciente.rut, literal_column("'[^0-9kK]'"), literal_column("''"), literal_column("'g'"))
+)
+NOMBRE_MINUSCULAS = func.lower(Paciente.nombre)
+# Con collation "C" el índice sirve a la vez para LIKE 'texto%' y para
+# entregar los nombres ya ordenados
+NOMBRE_ORDEN = NOMBRE_MINUSCULAS.collate("C")
+
+# 12.345.678-9, 12345678-9, 123456789, 1.234.567-K
+PATRON_RUT = re.compile(r"^\d{1,2}\.?\d{3}\.?\d{3}-?[\dkK]$")
+
+# Con menos caracteres los trigramas no sirven: solo se busca por prefijo
+LARGO_MINIMO_SIMILITUD = 3
+
+def normalizar_rut(rut: str) -> str:
+    return re.sub(r"[^0-9kK]", "", rut).upper()
+
+def _escapar_like(texto: str) -> str:
+    return texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+async def buscar_pacientes(db: AsyncSession, texto: str, limite: int):
+    texto = " ".join(texto.split())
+    columnas = select(Paciente.id_paciente, Paciente.rut, Paciente.nombre, Paciente.numero, Paciente.correo)
+
+    if PATRON_RUT.match(texto):
+        result = await db.execute(
+            columnas.where(RUT_NORMALIZADO == normalizar_rut(texto)).limit(limite)
+        )
+        return result.all()
+
+    buscado = texto.lower()
+    prefijo = NOMBRE_ORDEN.like(_escapar_like(buscado) + "%")
+    if len(buscado) < LARGO_MINIMO_SIMILITUD:
+        stmt = columnas.where(prefijo).order_by(NOMBRE_ORDEN, Paciente.id_paciente)
+    else:
+        # <% es "word similarity" de pg_trgm: tolera errores de tipeo y
+        # encuentra el texto como palabra dentro del nombre
+        similitud = func.word_similarity(buscado, NOMBRE_MINUSCULAS)
+        stmt = (
+            columnas
+            .where(or_(
+                NOMBRE_MINUSCULAS.like("%" + _escapar_like(buscado) + "%"),
+                literal(buscado).op("<%")(NOMBRE_MINUSCULAS)
+            ))
+            .order_by(prefijo.desc(), similitud.desc(), NOMBRE_ORDEN, Paciente.id_paciente)
+        )
+    result = await db.execute(stmt.limit(limite))
+    return result.all()
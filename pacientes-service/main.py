@@ -1,6 +1,22 @@
+# arranque va primero: mide el tiempo desde que parte el proceso
+import arranque
+
 from fastapi import FastAPI
 from routers import paciente
+from serializacion import RespuestaJSON
+from database import marcar_escrituras
+import crud.paciente as crud
+
+# Última migración de migraciones/versiones que este servicio necesita
+VERSION_ESQUEMA = 11
+
+app = FastAPI(default_response_class=RespuestaJSON)
+app.middleware("http")(marcar_escrituras)
 
-app = FastAPI()
+app.include_router(paciente.router)
 
-app.include_router(paciente.router)
\ No newline at end of file
+# Consultas frecuentes que se ejecutan una vez al arrancar
+arranque.registrar(app, VERSION_ESQUEMA, [
+    ("paciente", lambda db: crud.get_paciente(db, arranque.ID_CALENTAMIENTO)),
+    ("búsqueda por nombre", lambda db: crud.buscar_pacientes(db, "calentamiento", 1)),
+])
\ No newline at end of file
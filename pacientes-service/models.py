@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, ForeignKey, text, Integer, TIMESTAMP
+from sqlalchemy import Column, String, ForeignKey, text, Integer, TIMESTAMP, Numeric
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship, declarative_base
 import uuid
@@ -120,6 +120,10 @@ class PrescripcionPrincipio(Base):
     id_principio = Column(UUID(as_uuid=True), ForeignKey("principio_activo.id_principio"), primary_key=True)
     duracion = Column(String(100))
     frecuencia = Column(String(100))
+    # Interpretados al crear la prescripción (prescripciones-service/dosificacion.py)
+    duracion_dias = Column(Integer)
+    tomas_por_dia = Column(Numeric(7, 3))
+    unidades_por_receta = Column(Integer)
 
     #prescripciones-service
     prescripcion = relationship("Prescripcion", back_populates="principios")
@@ -1,22 +1,35 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
-from database import get_session
+from database import get_session, get_read_session
 from schemas import PacienteCreate, PacienteUpdate, PacienteOut
 import crud.paciente as crud
+from serializacion import respuesta_json
 
 router = APIRouter(prefix="/pacientes", tags=["Pacientes"])
 
 @router.get("/", response_model=list[PacienteOut])
-async def read_pacientes(session: AsyncSession = Depends(get_session)):
-    return await crud.get_pacientes(session)
+async def read_pacientes(session: AsyncSession = Depends(get_read_session)):
+    # Sin response_model en tiempo de ejecución: orjson directo desde las filas
+    return respuesta_json(await crud.get_pacientes(session), PacienteOut)
+
+# Búsqueda por RUT (con o sin puntos y guion) o por parte del nombre; los
+# mejores `limite` resultados, primero los nombres que empiezan con q.
+# Va antes de /{paciente_id} para que "buscar" no se tome como id.
+@router.get("/buscar", response_model=list[PacienteOut])
+async def buscar_pacientes(
+    q: str = Query(..., min_length=1, max_length=100),
+    limite: int = Query(20, ge=1, le=50),
+    session: AsyncSession = Depends(get_read_session)
+):
+    return respuesta_json(await crud.buscar_pacientes(session, q, limite), PacienteOut)
 
 @router.get("/{paciente_id}", response_model=PacienteOut)
-async def read_paciente(paciente_id: UUID, session: AsyncSession = Depends(get_session)):
+async def read_paciente(paciente_id: UUID, session: AsyncSession = Depends(get_read_session)):
     db_paciente = await crud.get_paciente(session, paciente_id)
     if db_paciente is None:
         raise HTTPException(status_code=404, detail="Paciente no encontrado")
-    return db_paciente
+    return respuesta_json(db_paciente, PacienteOut)
 
 @router.post("/", response_model=PacienteOut)
 async def create_paciente(paciente: PacienteCreate, session: AsyncSession = Depends(get_session)):
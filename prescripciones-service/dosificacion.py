@@ -0,0 +1,62 @@
+from decimal import Decimal
+import re
+
+# ---------------------------------------------------------
+# Dosificación estructurada de un principio prescrito
+#
+# duracion y frecuencia siguen guardándose como texto, pero al crear la
+# prescripción se interpretan una sola vez y se guardan en columnas
+# (duracion_dias, tomas_por_dia, unidades_por_receta) que la entrega en
+# farmacia usa directamente. La migración 0006 aplica las mismas reglas
+# a las filas existentes; si se cambian aquí, hay que mantenerlas
+# alineadas con esa migración.
+# ---------------------------------------------------------
+
+# "30", "30 días", "2 semanas", "1 mes"
+PATRON_DURACION = re.compile(r"^(\d{1,4})\s*(d[ií]as?|semanas?|mes(?:es)?)?$")
+DIAS_POR_UNIDAD = {"d": 1, "s": 7, "m": 30}
+
+# "cada 8 horas", "3 veces al día", "1 vez al dia", "cada 2 días"
+PATRON_CADA_HORAS = re.compile(r"^cada\s+(\d{1,3})\s*(?:horas?|hrs?|h)$")
+PATRON_VECES_AL_DIA = re.compile(r"^(\d{1,2})\s*(?:vez|veces)\s+al\s+d[ií]a$")
+PATRON_CADA_DIAS = re.compile(r"^cada\s+(\d{1,3})\s*d[ií]as?$")
+
+def _normalizar(texto: str) -> str:
+    return " ".join(texto.lower().split())
+
+def duracion_en_dias(duracion: str) -> int:
+    coincidencia = PATRON_DURACION.match(_normalizar(duracion))
+    if coincidencia is None:
+        raise ValueError("duración inválida, se espera p. ej. '30 días', '2 semanas' o '1 mes'")
+    dias = int(coincidencia.group(1)) * DIAS_POR_UNIDAD[(coincidencia.group(2) or "d")[0]]
+    if dias <= 0:
+        raise ValueError("la duración debe ser mayor que cero")
+    return dias
+
+def tomas_por_dia(frecuencia: str) -> Decimal:
+    texto = _normalizar(frecuencia)
+    if (coincidencia := PATRON_CADA_HORAS.match(texto)) is not None:
+        horas = int(coincidencia.group(1))
+        tomas = Decimal(24) / horas if horas else None
+    elif (coincidencia := PATRON_VECES_AL_DIA.match(texto)) is not None:
+        tomas = Decimal(int(coincidencia.group(1)))
+    elif (coincidencia := PATRON_CADA_DIAS.match(texto)) is not None:
+        dias = int(coincidencia.group(1))
+        tomas = Decimal(1) / dias if dias else None
+    else:
+        raise ValueError("frecuencia inválida, se espera p. ej. 'cada 8 horas' o '3 veces al día'")
+    if not tomas:
+        raise ValueError("la frecuencia debe ser mayor que cero")
+    return tomas.quantize(Decimal("0.001"))
+
+def unidades_por_receta(dias: int) -> int:
+    # Regla vigente de la farmacia: una unidad cada dos días de tratamiento
+    return dias // 2
+
+def dosificacion(duracion: str, frecuencia: str) -> dict:
+    dias = duracion_en_dias(duracion)
+    return {
+        "duracion_dias": dias,
+        "tomas_por_dia": tomas_por_dia(frecuencia),
+        "unidades_por_receta": unidades_por_receta(dias),
+    }
@@ -0,0 +1,235 @@
+from collections import OrderedDict
+from datetime import timedelta
+from time import monotonic
+from typing import Optional
+import asyncio
+import hashlib
+import logging
+import os
+import weakref
+
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import Response
+from sqlalchemy import Column, Integer, LargeBinary, MetaData, String, Table, TIMESTAMP, delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_session, AsyncSessionLocal
+from serializacion import RespuestaJSON
+
+# ---------------------------------------------------------
+# Claves de idempotencia para endpoints de escritura
+#
+# Si la petición trae el header Idempotency-Key, el endpoint guarda su
+# respuesta (código y cuerpo JSON ya codificado) en clave_idempotencia
+# dentro de la misma transacción que la escritura, justo antes del
+# commit. Un reintento con la misma clave recibe esa respuesta sin volver
+# a ejecutar el endpoint. Delante de la tabla hay una LRU en proceso.
+#
+# Duplicados simultáneos: dentro del proceso esperan un asyncio.Lock por
+# clave; entre réplicas, pg_advisory_xact_lock sobre la clave, que se
+# libera con el commit (o rollback) del primero. Así el segundo encuentra
+# la respuesta guardada en vez de ejecutar la escritura otra vez. Las
+# respuestas de error no se guardan: nada se escribió y el reintento
+# vuelve a ejecutarse.
+#
+# Las claves expiran tras IDEMPOTENCIA_TTL_HORAS; una tarea periódica
+# borra las vencidas de la tabla.
+#
+# Este archivo es igual en prescripciones-service y reservas-service.
+# ---------------------------------------------------------
+
+HEADER_CLAVE = "Idempotency-Key"
+HEADER_REPETIDA = "Idempotent-Replayed"
+LARGO_MAXIMO_CLAVE = 255
+
+# Espacio propio de pg_advisory_xact_lock(int, int) para las claves
+LOCK_IDEMPOTENCIA = 727003
+
+TTL_HORAS = float(os.getenv("IDEMPOTENCIA_TTL_HORAS", "24"))
+MAX_ENTRADAS_CACHE = int(os.getenv("IDEMPOTENCIA_CACHE_MAX", "10000"))
+INTERVALO_PURGA_SEGUNDOS = float(os.getenv("IDEMPOTENCIA_PURGA_SEGUNDOS", "3600"))
+TAMANO_LOTE_PURGA = int(os.getenv("IDEMPOTENCIA_PURGA_LOTE", "1000"))
+
+logger = logging.getLogger(__name__)
+
+clave_idempotencia_tabla = Table(
+    "clave_idempotencia",
+    MetaData(),
+    Column("clave", String(LARGO_MAXIMO_CLAVE), primary_key=True),
+    Column("huella", String(64), nullable=False),
+    Column("estado_http", Integer, nullable=False),
+    Column("respuesta", LargeBinary, nullable=False),
+    Column("expira_en", TIMESTAMP, nullable=False),
+)
+
+# clave -> (vence en monotonic(), huella, estado_http, cuerpo)
+_cache = OrderedDict()
+
+# Un lock por clave en uso; se descarta solo cuando nadie lo referencia
+_bloqueos = weakref.WeakValueDictionary()
+
+
+def _desde_cache(clave: str):
+    entrada = _cache.get(clave)
+    if entrada is None:
+        return None
+    if entrada[0] < monotonic():
+        del _cache[clave]
+        return None
+    _cache.move_to_end(clave)
+    return entrada[1:]
+
+def _a_cache(clave: str, huella: str, estado_http: int, cuerpo: bytes):
+    _cache[clave] = (monotonic() + TTL_HORAS * 3600, huella, estado_http, cuerpo)
+    _cache.move_to_end(clave)
+    while len(_cache) > MAX_ENTRADAS_CACHE:
+        _cache.popitem(last=False)
+
+
+class ClaveIdempotencia:
+    def __init__(self, clave: str, huella: str):
+        self.clave = clave
+        self.huella = huella
+        # (estado_http, cuerpo) guardados por guardar_respuesta, pendientes del commit
+        self.guardada = None
+
+
+class RespuestaRepetida(Exception):
+    def __init__(self, estado_http: int, cuerpo: bytes):
+        self.estado_http = estado_http
+        self.cuerpo = cuerpo
+
+
+def _repetir(huella: str, guardada) -> None:
+    huella_guardada, estado_http, cuerpo = guardada
+    if huella_guardada != huella:
+        raise HTTPException(status_code=422, detail="La clave de idempotencia ya se usó con otra solicitud")
+    raise RespuestaRepetida(estado_http, cuerpo)
+
+async def clave_idempotencia(request: Request, db: AsyncSession = Depends(get_session)):
+    # Dependencia de los endpoints de escritura; db es la misma sesión que
+    # recibe el endpoint (FastAPI reutiliza la dependencia en la petición)
+    clave = request.headers.get(HEADER_CLAVE)
+    if clave is None:
+        yield None
+        return
+    if not clave or len(clave) > LARGO_MAXIMO_CLAVE:
+        raise HTTPException(status_code=400, detail=f"{HEADER_CLAVE} debe tener entre 1 y {LARGO_MAXIMO_CLAVE} caracteres")
+
+    # La misma clave con otro endpoint o con otro cuerpo es un error del cliente
+    huella = hashlib.sha256(
+        request.method.encode() + b" " + request.url.path.encode() + b"\n" + await request.body()
+    ).hexdigest()
+
+    guardada = _desde_cache(clave)
+    if guardada is not None:
+        _repetir(huella, guardada)
+
+    bloqueo = _bloqueos.get(clave)
+    if bloqueo is None:
+        bloqueo = _bloqueos[clave] = asyncio.Lock()
+
+    async with bloqueo:
+        guardada = _desde_cache(clave)
+        if guardada is not None:
+            _repetir(huella, guardada)
+
+        # Queda tomado hasta que el endpoint haga commit o rollback
+        await db.execute(select(func.pg_advisory_xact_lock(LOCK_IDEMPOTENCIA, func.hashtext(clave))))
+        result = await db.execute(
+            select(
+                clave_idempotencia_tabla.c.huella,
+                clave_idempotencia_tabla.c.estado_http,
+                clave_idempotencia_tabla.c.respuesta,
+            )
+            .where(
+                clave_idempotencia_tabla.c.clave == clave,
+                clave_idempotencia_tabla.c.expira_en > func.localtimestamp()
+            )
+        )
+        fila = result.first()
+        if fila is not None:
+            await db.rollback()
+            _a_cache(clave, *fila)
+            _repetir(huella, fila)
+
+        idempotencia = ClaveIdempotencia(clave, huella)
+        yield idempotencia
+
+        # El endpoint terminó sin error, así que su commit ya ocurrió
+        if idempotencia.guardada is not None:
+            _a_cache(clave, huella, *idempotencia.guardada)
+
+async def guardar_respuesta(db: AsyncSession, idempotencia: Optional[ClaveIdempotencia], contenido, status_code: int = 200):
+    # Llamar antes del commit de la escritura; sin clave no hace nada
+    if idempotencia is None:
+        return
+    cuerpo = RespuestaJSON(contenido, status_code=status_code).body
+    stmt = pg_insert(clave_idempotencia_tabla).values(
+        clave=idempotencia.clave,
+        huella=idempotencia.huella,
+        estado_http=status_code,
+        respuesta=cuerpo,
+        expira_en=func.localtimestamp() + timedelta(hours=TTL_HORAS),
+    )
+    # Una fila vencida que la purga aún no borró se reemplaza
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[clave_idempotencia_tabla.c.clave],
+        set_={
+            "huella": stmt.excluded.huella,
+            "estado_http": stmt.excluded.estado_http,
+            "respuesta": stmt.excluded.respuesta,
+            "expira_en": stmt.excluded.expira_en,
+        }
+    )
+    await db.execute(stmt)
+    idempotencia.guardada = (status_code, cuerpo)
+
+async def purgar_vencidas() -> int:
+    total = 0
+    while True:
+        async with AsyncSessionLocal() as session:
+            vencidas = (
+                select(clave_idempotencia_tabla.c.clave)
+                .where(clave_idempotencia_tabla.c.expira_en <= func.localtimestamp())
+                .limit(TAMANO_LOTE_PURGA)
+                .with_for_update(skip_locked=True)
+            )
+            result = await session.execute(
+                delete(clave_idempotencia_tabla).where(clave_idempotencia_tabla.c.clave.in_(vencidas.scalar_subquery()))
+            )
+            await session.commit()
+        total += result.rowcount
+        if result.rowcount < TAMANO_LOTE_PURGA:
+            return total
+
+async def ciclo_purga():
+    while True:
+        try:
+            borradas = await purgar_vencidas()
+            if borradas:
+                logger.info("Claves de idempotencia vencidas borradas: %d", borradas)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Error al purgar claves de idempotencia")
+        await asyncio.sleep(INTERVALO_PURGA_SEGUNDOS)
+
+def registrar(app: FastAPI):
+    @app.exception_handler(RespuestaRepetida)
+    async def repetir(request: Request, exc: RespuestaRepetida):
+        return Response(
+            exc.cuerpo,
+            status_code=exc.estado_http,
+            media_type="application/json",
+            headers={HEADER_REPETIDA: "true"}
+        )
+
+    @app.on_event("startup")
+    async def iniciar_purga():
+        app.state.purga_idempotencia = asyncio.create_task(ciclo_purga())
+
+    @app.on_event("shutdown")
+    async def detener_purga():
+        app.state.purga_idempotencia.cancel()
@@ -1,20 +1,47 @@
-from fastapi import FastAPI, Depends, HTTPException
+# arranque va primero: mide el tiempo desde que parte el proceso
+import arranque
+import idempotencia
+from fastapi import FastAPI, Depends, HTTPException, Query
+from sqlalchemy import bindparam, exists, func, insert, literal
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
-from models import Base, Prescripcion, PrescripcionPrincipio, Receta
-from database import engine, get_session
-from pydantic import BaseModel
-from typing import List
+from models import Prescripcion, PrescripcionPrincipio, Receta, Usuario, Paciente
+from database import get_session, get_read_session, marcar_escrituras, AsyncSessionLocal
+from paginacion import paginar, encabezados_cursor, LIMITE_MAXIMO
+from serializacion import RespuestaJSON, respuesta_json
+from dosificacion import dosificacion, duracion_en_dias, tomas_por_dia, unidades_por_receta
+from disponibilidad import consultar_disponibilidad, sumar_lineas
+from pydantic import BaseModel, validator
+from typing import List, Optional
+import asyncio
 import datetime as dt
+import logging
+import os
 import uuid
 
-app = FastAPI()
+app = FastAPI(default_response_class=RespuestaJSON)
+# Lecturas a la réplica (DATABASE_URL_LECTURA) salvo tras escrituras propias
+app.middleware("http")(marcar_escrituras)
+# Header Idempotency-Key en los POST de creación
+idempotencia.registrar(app)
+
+logger = logging.getLogger(__name__)
+
+# Última migración de migraciones/versiones que este servicio necesita
+VERSION_ESQUEMA = 9
 
 @app.on_event("startup")
 async def startup():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    if EMISION_AUTOMATICA:
+        app.state.emision = asyncio.create_task(emision_periodica())
+
+@app.on_event("shutdown")
+async def shutdown():
+    tarea = getattr(app.state, "emision", None)
+    if tarea is not None:
+        tarea.cancel()
 
 # ----------------------
 # Pydantic Schemas
@@ -25,44 +52,159 @@ class PrescripcionPrincipioCreate(BaseModel):
     duracion: str
     frecuencia: str
 
+    # Se rechaza aquí lo que la farmacia no podría interpretar al entregar
+    @validator("duracion")
+    def validar_duracion(cls, valor):
+        duracion_en_dias(valor)
+        return valor
+
+    @validator("frecuencia")
+    def validar_frecuencia(cls, valor):
+        tomas_por_dia(valor)
+        return valor
+
 class PrescripcionCreate(BaseModel):
     id_medico: uuid.UUID
     id_paciente: uuid.UUID
     principios: List[PrescripcionPrincipioCreate]
 
+# Prescripciones a las que emitir receta: una lista de ids y/o filtros.
+# recurrentes=True toma las que tuvieron receta en el período anterior.
+class EmisionRecetas(BaseModel):
+    ids_prescripcion: Optional[List[uuid.UUID]] = None
+    id_paciente: Optional[uuid.UUID] = None
+    id_medico: Optional[uuid.UUID] = None
+    recurrentes: bool = False
+
+# ----------------------
+# Consultas por id
+# ----------------------
+
+# Armadas una sola vez con bindparam: en cada petición solo cambian los
+# parámetros, sin reconstruir la sentencia ni recalcular su clave de caché
+
+PRESCRIPCION_POR_ID = select(Prescripcion).where(Prescripcion.id_prescripcion == bindparam("id_prescripcion"))
+
+PRESCRIPCION_DETALLE = (
+    select(Prescripcion)
+    .options(
+        selectinload(Prescripcion.principios),
+        selectinload(Prescripcion.medico),
+        selectinload(Prescripcion.paciente)
+    )
+    .where(Prescripcion.id_prescripcion == bindparam("id_prescripcion"))
+)
+
+RECETA_DETALLE = (
+    select(Receta)
+    .where(Receta.id_receta == bindparam("id_receta"))
+    .options(
+      selectinload(Receta.medico),
+      selectinload(Receta.paciente)
+    )
+)
+
 # ----------------------
 # Endpoints
 # ----------------------
 
 
+# Prescripciones por transacción en la creación masiva
+TAMANO_GRUPO_MASIVO = 500
+
+async def _insertar_filas(db: AsyncSession, tabla, columna, filas: List[dict]):
+    # Con RETURNING, SQLAlchemy agrupa las filas en INSERT ... VALUES de
+    # hasta 1000 filas (insertmanyvalues); sin él, psycopg ejecuta la
+    # sentencia una vez por fila. Lo devuelto no se usa
+    await db.execute(insert(tabla).returning(columna), filas)
+
+async def insertar_prescripciones(db: AsyncSession, grupo: List[PrescripcionCreate]) -> List[uuid.UUID]:
+    # Un INSERT multi-fila para las prescripciones y otro para todos sus
+    # principios; no hace commit. Los ids se generan aquí: con el
+    # gen_random_uuid() de la base, un RETURNING en el orden de entrada no
+    # tiene con qué emparejar filas y SQLAlchemy cae a un INSERT por fila
+    ids = [uuid.uuid4() for _ in grupo]
+    await _insertar_filas(db, Prescripcion, Prescripcion.id_prescripcion, [
+        {"id_prescripcion": id_prescripcion, "id_medico": p.id_medico, "id_paciente": p.id_paciente}
+        for id_prescripcion, p in zip(ids, grupo)
+    ])
+
+    principios = [
+        {
+            "id_prescripcion": id_prescripcion,
+            "id_principio": principio.id_principio,
+            "duracion": principio.duracion,
+            "frecuencia": principio.frecuencia,
+            **dosificacion(principio.duracion, principio.frecuencia)
+        }
+        for id_prescripcion, prescripcion in zip(ids, grupo)
+        for principio in prescripcion.principios
+    ]
+    if principios:
+        await _insertar_filas(db, PrescripcionPrincipio, PrescripcionPrincipio.id_prescripcion, principios)
+    return ids
+
 # Crear prescripcion
 @app.post("/prescripcion")
 async def crear_prescripcion(
-    data: PrescripcionCreate, db: AsyncSession = Depends(get_session)
+    data: PrescripcionCreate,
+    verificar_stock: bool = False,
+    db: AsyncSession = Depends(get_session),
+    clave: Optional[idempotencia.ClaveIdempotencia] = Depends(idempotencia.clave_idempotencia)
 ):
-    prescripcion = Prescripcion(
-        id_medico=data.id_medico,
-        id_paciente=data.id_paciente
-    )
-    db.add(prescripcion)
-    await db.flush()
-
-    for principio in data.principios:
-        item = PrescripcionPrincipio(
-            id_prescripcion=prescripcion.id_prescripcion,
-            id_principio=principio.id_principio,
-            duracion=principio.duracion,
-            frecuencia=principio.frecuencia
+    # Con ?verificar_stock=true se comprueba, en una sola consulta, que haya
+    # stock para la primera receta (unidades_por_receta de cada principio);
+    # si falta, responde 409 con el detalle y no crea la prescripción
+    if verificar_stock:
+        disponibilidad = await consultar_disponibilidad(
+            db,
+            principios=sumar_lineas(
+                (p.id_principio, unidades_por_receta(duracion_en_dias(p.duracion)))
+                for p in data.principios
+            )
         )
-        db.add(item)
+        if not disponibilidad["suficiente"]:
+            await db.rollback()
+            return respuesta_json({
+                "detail": {
+                    "mensaje": "Stock insuficiente para la prescripción",
+                    "principios": disponibilidad["principios"]
+                }
+            }, status_code=409)
 
+    ids = await insertar_prescripciones(db, [data])
+    respuesta = {"id_prescripcion": ids[0]}
+    await idempotencia.guardar_respuesta(db, clave, respuesta)
     await db.commit()
-    return {"id_prescripcion": prescripcion.id_prescripcion}
+    return respuesta
+
+# Crear muchas prescripciones (p. ej. renovación de un programa crónico).
+# Se insertan en grupos de TAMANO_GRUPO_MASIVO, cada grupo en su propia
+# transacción; los ids se devuelven en el orden de entrada. Si un grupo
+# falla (médico, paciente o principio inexistente, principio repetido),
+# los grupos anteriores quedan creados y se informan en el error.
+@app.post("/prescripcion/masivo")
+async def crear_prescripciones_masivo(
+    data: List[PrescripcionCreate], db: AsyncSession = Depends(get_session)
+):
+    creadas: List[uuid.UUID] = []
+    for inicio in range(0, len(data), TAMANO_GRUPO_MASIVO):
+        try:
+            creadas += await insertar_prescripciones(db, data[inicio:inicio + TAMANO_GRUPO_MASIVO])
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(status_code=409, detail={
+                "mensaje": f"No se pudo crear el grupo que empieza en la posición {inicio}",
+                "indice_fallido": inicio,
+                "ids_prescripcion": [str(id_prescripcion) for id_prescripcion in creadas]
+            })
+    return respuesta_json({"ids_prescripcion": creadas})
 
 # Obtener prescripciones de 1 paciente
 @app.get("/prescripcion/paciente/{id_paciente}")
 async def obtener_prescripciones(
-    id_paciente: uuid.UUID, db: AsyncSession = Depends(get_session)
+    id_paciente: uuid.UUID, db: AsyncSession = Depends(get_read_session)
 ):
     result = await db.execute(
         select(Prescripcion)
@@ -94,22 +236,14 @@ async def obtener_prescripciones(
             "principios": principios
         })
 
-    return response
+    return respuesta_json(response)
 
 # Obtener 1 prescripcion
 @app.get("/prescripcion/{id_prescripcion}")
 async def obtener_prescripcion(
-    id_prescripcion: uuid.UUID, db: AsyncSession = Depends(get_session)
+    id_prescripcion: uuid.UUID, db: AsyncSession = Depends(get_read_session)
 ):
-    result = await db.execute(
-        select(Prescripcion)
-        .options(
-            selectinload(Prescripcion.principios),
-            selectinload(Prescripcion.medico),
-            selectinload(Prescripcion.paciente)
-        )
-        .where(Prescripcion.id_prescripcion == id_prescripcion)
-    )
+    result = await db.execute(PRESCRIPCION_DETALLE, {"id_prescripcion": id_prescripcion})
     p = result.scalars().first()
 
     if not p:
@@ -134,46 +268,76 @@ async def obtener_prescripcion(
     }
 
 #Obtener todas las prescripciones
+# Acepta ?limite=&cursor= y filtros por paciente y médico; sin límite ni
+# cursor devuelve todo. El cursor siguiente va en el header X-Siguiente-Cursor.
 @app.get("/prescripcion")
-async def obtener_todas_prescripciones(db: AsyncSession = Depends(get_session)):
-    result = await db.execute(
-        select(Prescripcion)
-        .options(
-            selectinload(Prescripcion.principios),
-            selectinload(Prescripcion.medico),
-            selectinload(Prescripcion.paciente)
+async def obtener_todas_prescripciones(
+    id_paciente: Optional[uuid.UUID] = None,
+    id_medico: Optional[uuid.UUID] = None,
+    limite: Optional[int] = Query(None, gt=0, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_session)
+):
+    stmt = (
+        select(
+            Prescripcion.id_prescripcion,
+            Prescripcion.id_medico,
+            Usuario.nombre.label("medico_nombre"),
+            Prescripcion.id_paciente,
+            Paciente.nombre.label("paciente_nombre")
         )
+        .outerjoin(Usuario, Usuario.id == Prescripcion.id_medico)
+        .outerjoin(Paciente, Paciente.id_paciente == Prescripcion.id_paciente)
     )
-    prescripciones = result.scalars().all()
+    if id_paciente is not None:
+        stmt = stmt.where(Prescripcion.id_paciente == id_paciente)
+    if id_medico is not None:
+        stmt = stmt.where(Prescripcion.id_medico == id_medico)
 
-    response = []
-    for p in prescripciones:
-        principios = [
-            {
+    filas, siguiente = await paginar(db, stmt, (Prescripcion.id_prescripcion,), limite, cursor)
+
+    # Principios solo de las prescripciones de la página, en una consulta
+    principios = {fila.id_prescripcion: [] for fila in filas}
+    if principios:
+        result = await db.execute(
+            select(
+                PrescripcionPrincipio.id_prescripcion,
+                PrescripcionPrincipio.id_principio,
+                PrescripcionPrincipio.duracion,
+                PrescripcionPrincipio.frecuencia
+            )
+            .where(PrescripcionPrincipio.id_prescripcion.in_(list(principios)))
+        )
+        for pp in result.all():
+            principios[pp.id_prescripcion].append({
                 "id_principio": pp.id_principio,
                 "duracion": pp.duracion,
                 "frecuencia": pp.frecuencia
-            }
-            for pp in p.principios
-        ]
-        response.append({
-            "id_prescripcion": p.id_prescripcion,
-            "id_medico": p.id_medico,
-            "medico_nombre": p.medico.nombre if p.medico else None,
-            "id_paciente": p.id_paciente,
-            "paciente_nombre": p.paciente.nombre if p.paciente else None,
-            "principios": principios
-        })
+            })
 
-    return response
+    return respuesta_json(
+        [
+            {
+                "id_prescripcion": p.id_prescripcion,
+                "id_medico": p.id_medico,
+                "medico_nombre": p.medico_nombre,
+                "id_paciente": p.id_paciente,
+                "paciente_nombre": p.paciente_nombre,
+                "principios": principios[p.id_prescripcion]
+            } for p in filas
+        ],
+        headers=encabezados_cursor(siguiente)
+    )
 
 # Agregar 1 receta de la prescripcion
 @app.post("/prescripcion/agregar-receta/{id_prescripcion}")
-async def agregar_receta(id_prescripcion: uuid.UUID, db: AsyncSession = Depends(get_session)):
+async def agregar_receta(
+    id_prescripcion: uuid.UUID,
+    db: AsyncSession = Depends(get_session),
+    clave: Optional[idempotencia.ClaveIdempotencia] = Depends(idempotencia.clave_idempotencia)
+):
     # Buscar prescripción
-    result = await db.execute(
-        select(Prescripcion).where(Prescripcion.id_prescripcion == id_prescripcion)
-    )
+    result = await db.execute(PRESCRIPCION_POR_ID, {"id_prescripcion": id_prescripcion})
     prescripcion = result.scalar_one_or_none()
 
     if not prescripcion:
@@ -187,46 +351,164 @@ async def agregar_receta(id_prescripcion: uuid.UUID, db: AsyncSession = Depends(
         estado="pendiente"
     )
     db.add(receta)
+    await db.flush()
+    respuesta = {"mensaje": "Receta creada correctamente", "id_receta": receta.id_receta}
+    await idempotencia.guardar_respuesta(db, clave, respuesta)
     await db.commit()
-    return {"mensaje": "Receta creada correctamente", "id_receta": receta.id_receta}
+    return respuesta
+
+
+# ----------------------
+# Emisión de recetas en lote
+#
+# Un único INSERT ... SELECT emite una receta pendiente por cada
+# prescripción seleccionada que no tenga ya una receta pendiente emitida
+# en el período (mes calendario, UTC). Repetir la emisión en el mismo
+# período no duplica recetas. Un advisory lock serializa las emisiones
+# para que dos simultáneas no emitan la misma receta dos veces.
+# ----------------------
+
+LOCK_EMISION_RECETAS = 727002
+
+# Tarea periódica: emite para las prescripciones recurrentes
+EMISION_AUTOMATICA = os.getenv("EMISION_RECETAS_AUTOMATICA", "0") == "1"
+EMISION_INTERVALO_SEGUNDOS = float(os.getenv("EMISION_RECETAS_INTERVALO_HORAS", "24")) * 3600
+
+def inicio_periodo(fecha: dt.datetime) -> dt.datetime:
+    return fecha.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+async def emitir_recetas(db: AsyncSession, filtro: EmisionRecetas, ahora: dt.datetime) -> List:
+    # No hace commit; el llamador debe tener tomado LOCK_EMISION_RECETAS
+    periodo = inicio_periodo(ahora)
+    periodo_anterior = inicio_periodo(periodo - dt.timedelta(days=1))
+
+    pendiente_en_periodo = exists().where(
+        Receta.id_prescripcion == Prescripcion.id_prescripcion,
+        Receta.estado == "pendiente",
+        Receta.fecha_emision >= periodo
+    )
+    seleccion = (
+        select(
+            Prescripcion.id_prescripcion,
+            Prescripcion.id_paciente,
+            Prescripcion.id_medico,
+            literal(ahora, Receta.fecha_emision.type),
+            literal("pendiente", Receta.estado.type)
+        )
+        .where(~pendiente_en_periodo)
+    )
+    if filtro.ids_prescripcion is not None:
+        seleccion = seleccion.where(Prescripcion.id_prescripcion.in_(filtro.ids_prescripcion))
+    if filtro.id_paciente is not None:
+        seleccion = seleccion.where(Prescripcion.id_paciente == filtro.id_paciente)
+    if filtro.id_medico is not None:
+        seleccion = seleccion.where(Prescripcion.id_medico == filtro.id_medico)
+    if filtro.recurrentes:
+        seleccion = seleccion.where(
+            exists().where(
+                Receta.id_prescripcion == Prescripcion.id_prescripcion,
+                Receta.fecha_emision >= periodo_anterior,
+                Receta.fecha_emision < periodo
+            )
+        )
+
+    result = await db.execute(
+        insert(Receta)
+        .from_select(["id_prescripcion", "id_paciente", "id_medico", "fecha_emision", "estado"], seleccion)
+        .returning(Receta.id_receta, Receta.id_prescripcion)
+    )
+    return result.all()
+
+@app.post("/receta/emision")
+async def emitir_recetas_lote(data: EmisionRecetas, db: AsyncSession = Depends(get_session)):
+    if (
+        data.ids_prescripcion is None and data.id_paciente is None
+        and data.id_medico is None and not data.recurrentes
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail="Indique ids_prescripcion, id_paciente, id_medico o recurrentes"
+        )
+
+    ahora = dt.datetime.now(dt.timezone.utc)
+    await db.execute(select(func.pg_advisory_xact_lock(LOCK_EMISION_RECETAS)))
+    emitidas = await emitir_recetas(db, data, ahora)
+    await db.commit()
+    return respuesta_json({
+        "periodo": inicio_periodo(ahora),
+        "emitidas": len(emitidas),
+        "recetas": emitidas
+    })
+
+async def emision_periodica():
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                # Con varias réplicas, solo una emite; las demás siguen de largo
+                tomado = await db.scalar(select(func.pg_try_advisory_xact_lock(LOCK_EMISION_RECETAS)))
+                if tomado:
+                    emitidas = await emitir_recetas(
+                        db, EmisionRecetas(recurrentes=True), dt.datetime.now(dt.timezone.utc)
+                    )
+                    await db.commit()
+                    if emitidas:
+                        logger.info("Recetas emitidas automáticamente: %d", len(emitidas))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Error en la emisión automática de recetas")
+        await asyncio.sleep(EMISION_INTERVALO_SEGUNDOS)
 
 
 # Obtener todas las recetas
+# Paginadas por (fecha_emision, id_receta), con filtros por paciente, médico,
+# estado y rango de fecha de emisión [emitida_desde, emitida_hasta).
 @app.get("/receta")
-async def obtener_recetas(db: AsyncSession = Depends(get_session)):
-    result = await db.execute(
-        select(Receta)
-        .options(
-          selectinload(Receta.medico),
-          selectinload(Receta.paciente)
+async def obtener_recetas(
+    id_paciente: Optional[uuid.UUID] = None,
+    id_medico: Optional[uuid.UUID] = None,
+    estado: Optional[str] = None,
+    emitida_desde: Optional[dt.datetime] = None,
+    emitida_hasta: Optional[dt.datetime] = None,
+    limite: Optional[int] = Query(None, gt=0, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_session)
+):
+    stmt = (
+        select(
+            Receta.id_receta,
+            Receta.id_prescripcion,
+            Receta.id_paciente,
+            Paciente.nombre.label("nombre_paciente"),
+            Receta.id_medico,
+            Usuario.nombre.label("nombre_medico"),
+            Receta.fecha_emision,
+            Receta.estado
         )
+        .outerjoin(Paciente, Paciente.id_paciente == Receta.id_paciente)
+        .outerjoin(Usuario, Usuario.id == Receta.id_medico)
     )
-    recetas = result.scalars().all()
+    if id_paciente is not None:
+        stmt = stmt.where(Receta.id_paciente == id_paciente)
+    if id_medico is not None:
+        stmt = stmt.where(Receta.id_medico == id_medico)
+    if estado is not None:
+        stmt = stmt.where(Receta.estado == estado)
+    if emitida_desde is not None:
+        stmt = stmt.where(Receta.fecha_emision >= emitida_desde)
+    if emitida_hasta is not None:
+        stmt = stmt.where(Receta.fecha_emision < emitida_hasta)
 
-    return [
-        {
-            "id_receta": r.id_receta,
-            "id_prescripcion": r.id_prescripcion,
-            "id_paciente": r.id_paciente,
-            "nombre_paciente": r.paciente.nombre,
-            "id_medico": r.id_medico,
-            "nombre_medico": r.medico.nombre,
-            "fecha_emision": r.fecha_emision,
-            "estado": r.estado
-        } for r in recetas
-    ]
+    orden = (Receta.fecha_emision, Receta.id_receta)
+    filas, siguiente = await paginar(db, stmt, orden, limite, cursor)
+
+    # Las columnas del SELECT ya tienen los nombres de la respuesta
+    return respuesta_json(filas, headers=encabezados_cursor(siguiente))
 
 # Obtener 1 receta
 @app.get("/receta/{id_receta}")
-async def obtener_receta(id_receta: uuid.UUID, db: AsyncSession = Depends(get_session)):
-    result = await db.execute(
-        select(Receta)
-        .where(Receta.id_receta == id_receta)
-        .options(
-          selectinload(Receta.medico),
-          selectinload(Receta.paciente)
-        )
-    )
+async def obtener_receta(id_receta: uuid.UUID, db: AsyncSession = Depends(get_read_session)):
+    result = await db.execute(RECETA_DETALLE, {"id_receta": id_receta})
     r = result.scalar_one_or_none()
 
     if not r:
@@ -243,3 +525,16 @@ async def obtener_receta(id_receta: uuid.UUID, db: AsyncSession = Depends(get_se
             "estado": r.estado
         }
 
+
+# Consultas frecuentes que se ejecutan una vez al arrancar
+arranque.registrar(app, VERSION_ESQUEMA, [
+    ("prescripciones", lambda db: obtener_todas_prescripciones(
+        id_paciente=arranque.ID_CALENTAMIENTO, id_medico=None, limite=1, cursor=None, db=db
+    )),
+    ("prescripción", lambda db: obtener_prescripcion(arranque.ID_CALENTAMIENTO, db=db)),
+    ("recetas", lambda db: obtener_recetas(
+        id_paciente=arranque.ID_CALENTAMIENTO, id_medico=None, estado=None,
+        emitida_desde=None, emitida_hasta=None, limite=1, cursor=None, db=db
+    )),
+    ("receta", lambda db: obtener_receta(arranque.ID_CALENTAMIENTO, db=db)),
+])
@@ -0,0 +1,125 @@
+# Mide la inserción masiva de prescripciones (main.insertar_prescripciones,
+# la de POST /prescripciones/masivo): sentencias SQL y tiempo para crear
+# 1000 prescripciones en grupos de TAMANO_GRUPO_MASIVO, contra la versión
+# anterior, que pedía los ids generados por la base con RETURNING en el
+# orden de entrada. Los datos se crean en una transacción que se revierte
+# al final, así que puede correrse contra una base real.
+#
+#   python medir_prescripciones.py
+#   python medir_prescripciones.py --prescripciones 5000 --principios 5 --repeticiones 10
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+import uuid
+
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import engine
+from dosificacion import dosificacion
+from models import Paciente, Prescripcion, PrescripcionPrincipio, PrincipioActivo, Usuario
+from main import TAMANO_GRUPO_MASIVO, PrescripcionCreate, insertar_prescripciones
+
+# Sentencias de control de la transacción de prueba, que no cuentan
+_CONTROL = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+
+contador = {"sentencias": 0}
+
+def _contar(conn, cursor, statement, parameters, context, executemany):
+    if not statement.lstrip().upper().startswith(_CONTROL):
+        contador["sentencias"] += 1
+
+async def _insertar_anterior(db: AsyncSession, grupo):
+    # insertar_prescripciones antes de generar los ids en el cliente
+    result = await db.execute(
+        insert(Prescripcion).returning(Prescripcion.id_prescripcion, sort_by_parameter_order=True),
+        [{"id_medico": p.id_medico, "id_paciente": p.id_paciente} for p in grupo]
+    )
+    ids = result.scalars().all()
+    principios = [
+        {
+            "id_prescripcion": id_prescripcion,
+            "id_principio": principio.id_principio,
+            "duracion": principio.duracion,
+            "frecuencia": principio.frecuencia,
+            **dosificacion(principio.duracion, principio.frecuencia)
+        }
+        for id_prescripcion, prescripcion in zip(ids, grupo)
+        for principio in prescripcion.principios
+    ]
+    if principios:
+        await db.execute(insert(PrescripcionPrincipio), principios)
+    return ids
+
+async def _crear_datos(session: AsyncSession, prescripciones: int, principios: int) -> list:
+    id_usuario, id_paciente = uuid.uuid4(), uuid.uuid4()
+    ids_principio = [uuid.uuid4() for _ in range(principios)]
+    await session.execute(insert(Usuario).values(id=id_usuario, rut="MEDICION", nombre="Medición", rol="medico"))
+    await session.execute(insert(Paciente).values(id_paciente=id_paciente, rut="MEDICION", nombre="Medición"))
+    await session.execute(insert(PrincipioActivo), [
+        {"id_principio": id_, "nombre": f"Principio {i}", "categoria": "medicion"}
+        for i, id_ in enumerate(ids_principio)
+    ])
+    return [
+        PrescripcionCreate(
+            id_medico=id_usuario,
+            id_paciente=id_paciente,
+            principios=[
+                {"id_principio": p, "duracion": "30 días", "frecuencia": "cada 8 horas"}
+                for p in ids_principio
+            ]
+        )
+        for _ in range(prescripciones)
+    ]
+
+async def _medir(session: AsyncSession, insertar, datos: list) -> tuple:
+    contador["sentencias"] = 0
+    inicio = time.perf_counter()
+    ids = []
+    for i in range(0, len(datos), TAMANO_GRUPO_MASIVO):
+        ids += await insertar(session, datos[i:i + TAMANO_GRUPO_MASIVO])
+    transcurrido = (time.perf_counter() - inicio) * 1000
+    if len(set(ids)) != len(datos):
+        raise RuntimeError(f"Se esperaban {len(datos)} ids distintos y hubo {len(set(ids))}")
+    return contador["sentencias"], transcurrido
+
+async def medir(prescripciones: int, principios: int, repeticiones: int):
+    async with engine.connect() as conn:
+        transaccion = await conn.begin()
+        session = AsyncSession(bind=conn, join_transaction_mode="create_savepoint", expire_on_commit=False)
+        try:
+            datos = await _crear_datos(session, prescripciones, principios)
+            print(f"{prescripciones} prescripciones de {principios} principios, "
+                  f"grupos de {TAMANO_GRUPO_MASIVO}, {repeticiones} repeticiones")
+            print(f"{'inserción':>22} {'sentencias':>10} {'p50 ms':>8} {'máx ms':>8}")
+            for nombre, insertar in (
+                ("RETURNING anterior", _insertar_anterior),
+                ("ids en el cliente", insertar_prescripciones),
+            ):
+                # La primera pasada calienta la caché de sentencias y no se mide
+                await _medir(session, insertar, datos)
+                resultados = [await _medir(session, insertar, datos) for _ in range(repeticiones)]
+                tiempos = [t for _, t in resultados]
+                print(f"{nombre:>22} {max(s for s, _ in resultados):>10} "
+                      f"{statistics.median(tiempos):>8.1f} {max(tiempos):>8.1f}")
+        finally:
+            await session.close()
+            await transaccion.rollback()
+
+async def main(prescripciones: int, principios: int, repeticiones: int) -> int:
+    event.listen(engine.sync_engine, "before_cursor_execute", _contar)
+    try:
+        await medir(prescripciones, principios, repeticiones)
+    finally:
+        await engine.dispose()
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Medición de la creación masiva de prescripciones")
+    parser.add_argument("--prescripciones", type=int, default=1000)
+    parser.add_argument("--principios", type=int, default=3, help="principios por prescripción")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.prescripciones, args.principios, args.repeticiones)))
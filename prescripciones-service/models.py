@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, ForeignKey, text, Integer, TIMESTAMP
+from sqlalchemy import Column, String, ForeignKey, text, Integer, TIMESTAMP, Numeric
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship, declarative_base
 import uuid
@@ -72,6 +72,9 @@ class Medicamento(Base):
 
     id_medicamento = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
     nombre = Column(String(100))
+    codigo_barras = Column(UUID(as_uuid=True), unique=True)
+    dosis_concentracion = Column(String(100))
+    via_administracion = Column(String(100))
 
     #reservas-service
     reservas_medicamentos = relationship("ReservaMedicamento", back_populates="medicamento")
@@ -87,17 +90,16 @@ class MedicamentoPrincipio(Base):
 class MedicamentoLote(Base):
     __tablename__ = "medicamento_lote"
 
-    codigo_barras = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
+    id_lote = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
     id_medicamento = Column(UUID(as_uuid=True), ForeignKey("medicamento.id_medicamento"))
     lote = Column(String(50))
     fecha_vencimiento = Column(TIMESTAMP)
     cantidad = Column(Integer)
+    cantidad_reservada = Column(Integer, nullable=False, server_default=text("0"))
     cantidad_defectuosa = Column(Integer)
     cantidad_en_idea = Column(Integer)
     cantidad_en_estado = Column(Integer)
     cantidad_envase_roto = Column(Integer)
-    dosis_concentracion = Column(String(100))
-    via_administracion = Column(String(100))
 
 
 class Prescripcion(Base):
@@ -120,6 +122,10 @@ class PrescripcionPrincipio(Base):
     id_principio = Column(UUID(as_uuid=True), ForeignKey("principio_activo.id_principio"), primary_key=True)
     duracion = Column(String(100))
     frecuencia = Column(String(100))
+    # Interpretados al crear la prescripción (prescripciones-service/dosificacion.py)
+    duracion_dias = Column(Integer)
+    tomas_por_dia = Column(Numeric(7, 3))
+    unidades_por_receta = Column(Integer)
 
     #prescripciones-service
     prescripcion = relationship("Prescripcion", back_populates="principios")
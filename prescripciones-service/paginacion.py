@@ -0,0 +1,121 @@
+from sqlalchemy import and_, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import HTTPException
+from datetime import datetime
+from typing import Optional, Sequence, Tuple
+from uuid import UUID
+import base64
+import json
+
+# ---------------------------------------------------------
+# Paginación por cursor (keyset)
+#
+# El cursor codifica los valores de las columnas de orden de la última
+# fila entregada; la página siguiente filtra "filas posteriores" en vez
+# de usar OFFSET, así cada página cuesta lo mismo sin importar cuántas
+# filas hay antes. El cursor siguiente viaja en el header
+# X-Siguiente-Cursor para no cambiar la forma de las respuestas.
+# ---------------------------------------------------------
+
+HEADER_SIGUIENTE_CURSOR = "X-Siguiente-Cursor"
+LIMITE_POR_DEFECTO = 100
+LIMITE_MAXIMO = 1000
+
+def _serializar(valor):
+    if isinstance(valor, UUID):
+        return str(valor)
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return valor
+
+def _deserializar(valor, columna):
+    if valor is None:
+        return None
+    tipo = columna.type.python_type
+    if tipo is UUID:
+        return UUID(valor)
+    if tipo is datetime:
+        return datetime.fromisoformat(valor)
+    return tipo(valor)
+
+def codificar_cursor(valores: Sequence) -> str:
+    crudo = json.dumps([_serializar(v) for v in valores], separators=(",", ":"))
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip("=")
+
+def decodificar_cursor(cursor: str, columnas: Sequence) -> list:
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        if not isinstance(valores, list) or len(valores) != len(columnas):
+            raise ValueError
+        return [_deserializar(v, c) for v, c in zip(valores, columnas)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+def despues_de(columnas: Sequence, valores: Sequence) -> list:
+    # Filas posteriores al cursor para un ORDER BY ascendente por estas columnas
+    # (en PostgreSQL los NULL van al final), como tramos consecutivos en el
+    # orden de la consulta. Cada tramo es un rango del índice (a, b, ...):
+    # las columnas con valor van en una comparación de filas
+    # (a, b) > (x, y), que PostgreSQL recorre como rango, y la cola de NULL
+    # de una columna nullable queda en su propio tramo. Un OR que juntara
+    # ambos casos obliga a leer y ordenar todas las filas que cumplen.
+    if not columnas:
+        return []
+    if valores[0] is None:
+        # El cursor ya está en la cola de NULL de la primera columna
+        return [and_(columnas[0].is_(None), t) for t in despues_de(columnas[1:], valores[1:])]
+
+    # Prefijo que cabe en una comparación de filas: valores conocidos y,
+    # después de la primera, columnas NOT NULL (un NULL en medio la anula)
+    n = 1
+    while n < len(columnas) and valores[n] is not None and not columnas[n].nullable:
+        n += 1
+
+    tramos = []
+    if n < len(columnas):
+        iguales = [c == v for c, v in zip(columnas[:n], valores[:n])]
+        tramos += [and_(*iguales, t) for t in despues_de(columnas[n:], valores[n:])]
+    if n == 1:
+        tramos.append(columnas[0] > valores[0])
+    else:
+        tramos.append(tuple_(*columnas[:n]) > tuple_(*valores[:n]))
+    if columnas[0].nullable:
+        tramos.append(columnas[0].is_(None))
+    return tramos
+
+def encabezados_cursor(siguiente: Optional[str]) -> Optional[dict]:
+    return {HEADER_SIGUIENTE_CURSOR: siguiente} if siguiente else None
+
+async def paginar(
+    session: AsyncSession,
+    stmt,
+    columnas_orden: Sequence,
+    limite: Optional[int] = None,
+    cursor: Optional[str] = None
+) -> Tuple[list, Optional[str]]:
+    # Sin límite ni cursor devuelve todas las filas, como antes de paginar
+    stmt = stmt.order_by(*columnas_orden)
+    if cursor is None:
+        consultas = [stmt]
+    else:
+        valores = decodificar_cursor(cursor, columnas_orden)
+        consultas = [stmt.where(tramo) for tramo in despues_de(columnas_orden, valores)]
+        limite = limite or LIMITE_POR_DEFECTO
+
+    # Los tramos se consultan en orden hasta completar la página; el de
+    # la cola de NULL solo se lee cuando el anterior se agota
+    filas = []
+    for consulta in consultas:
+        if limite is not None:
+            consulta = consulta.limit(limite + 1 - len(filas))
+        result = await session.execute(consulta)
+        filas += result.all()
+        if limite is not None and len(filas) > limite:
+            break
+
+    siguiente = None
+    if limite is not None and len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = codificar_cursor([getattr(filas[-1], c.key) for c in columnas_orden])
+    return filas, siguiente
@@ -1,11 +1,114 @@
+from fastapi import Request
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
+import time
+
+# Este archivo es igual en todos los servicios Python.
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Réplica de solo lectura opcional. Sin ella las lecturas van al primario.
+# Para probar el enrutamiento en local basta con apuntarla al mismo
+# primario (o a una segunda base): sus transacciones son READ ONLY, así
+# que un endpoint de escritura enrutado por error falla de inmediato.
+DATABASE_URL_LECTURA = os.getenv("DATABASE_URL_LECTURA")
+
+# Tras una escritura, las lecturas del mismo cliente van al primario
+# durante este tiempo (debe cubrir el retraso máximo de la réplica)
+VENTANA_LECTURA_PRIMARIO = int(os.getenv("REPLICA_RETRASO_MAXIMO_SEGUNDOS", "5"))
+COOKIE_ESCRITURA_RECIENTE = "escritura_reciente"
+HEADER_LEER_PRIMARIO = "X-Leer-Primario"
+
+# ---------------------------------------------------------
+# Engines configurados por variables de entorno
+#
+#   DB_POOL_SIZE         conexiones que el pool mantiene abiertas (10)
+#   DB_MAX_OVERFLOW      conexiones extra permitidas sobre el tamaño (10)
+#   DB_POOL_TIMEOUT      segundos que una petición espera una conexión (10)
+#   DB_POOL_RECYCLE      segundos tras los que se renueva una conexión (1800)
+#   DB_POOL_PRE_PING     1 para verificar la conexión al sacarla del pool (1)
+#   DB_QUERY_CACHE_SIZE  sentencias compiladas que guarda SQLAlchemy (500)
+#   DB_ECHO              1 para registrar cada sentencia SQL (0)
+#   DB_PREPARE_THRESHOLD ejecuciones de una misma sentencia tras las que
+#                        psycopg la prepara en el servidor (1); vacío las
+#                        desactiva (necesario detrás de pgbouncer en modo
+#                        transacción)
+# ---------------------------------------------------------
+
+class PoolInstrumentado(AsyncAdaptedQueuePool):
+    # Pool que además mide cuánto esperan las peticiones por una conexión
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.esperas = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+        self.agotamientos = 0
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.agotamientos += 1
+            raise
+        finally:
+            espera = time.perf_counter() - inicio
+            self.esperas += 1
+            self.espera_total += espera
+            self.espera_maxima = max(self.espera_maxima, espera)
+
+    def metricas(self) -> dict:
+        return {
+            "tamano": self.size(),
+            "en_uso": self.checkedout(),
+            "disponibles": self.checkedin(),
+            "desborde": self.overflow(),
+            "esperas": self.esperas,
+            "espera_promedio_ms": round(self.espera_total / self.esperas * 1000, 3) if self.esperas else 0.0,
+            "espera_maxima_ms": round(self.espera_maxima * 1000, 3),
+            "agotamientos": self.agotamientos,
+        }
+
+def _argumentos_conexion(url: str) -> dict:
+    # Las consultas frecuentes se arman una vez con bindparam, así su texto
+    # SQL no cambia entre peticiones y la sentencia preparada se reutiliza
+    if not url.startswith("postgresql+psycopg"):
+        return {}
+    umbral = os.getenv("DB_PREPARE_THRESHOLD", "1")
+    return {"prepare_threshold": int(umbral) if umbral else None}
+
+def crear_engine(url: str, **opciones):
+    return create_async_engine(
+        url,
+        connect_args=_argumentos_conexion(url),
+        poolclass=PoolInstrumentado,
+        pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        pool_pre_ping=os.getenv("DB_POOL_PRE_PING", "1") == "1",
+        query_cache_size=int(os.getenv("DB_QUERY_CACHE_SIZE", "500")),
+        echo=os.getenv("DB_ECHO", "0") == "1",
+        **opciones
+    )
+
 # Crea el engine asincrónico
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = crear_engine(DATABASE_URL)
+
+if DATABASE_URL_LECTURA:
+    engine_lectura = crear_engine(DATABASE_URL_LECTURA).execution_options(postgresql_readonly=True)
+else:
+    engine_lectura = engine
+
+def metricas_pool() -> dict:
+    metricas = {"principal": engine.pool.metricas()}
+    if engine_lectura is not engine:
+        metricas["lectura"] = engine_lectura.pool.metricas()
+    return metricas
 
 # Crea el session maker para sesiones asincrónicas
 AsyncSessionLocal = sessionmaker(
@@ -14,7 +117,41 @@ AsyncSessionLocal = sessionmaker(
     class_=AsyncSession
 )
 
+AsyncSessionLectura = sessionmaker(
+    engine_lectura,
+    expire_on_commit=False,
+    class_=AsyncSession
+)
+
 # Dependencia para FastAPI o para uso manual
 async def get_session() -> AsyncSession:
     async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+def leer_del_primario(request: Request) -> bool:
+    # Lectura de lo propio: el cliente escribió hace poco o lo pide explícitamente
+    return (
+        COOKIE_ESCRITURA_RECIENTE in request.cookies
+        or request.headers.get(HEADER_LEER_PRIMARIO) == "1"
+    )
+
+# Dependencia para endpoints de solo lectura
+async def get_read_session(request: Request) -> AsyncSession:
+    fabrica = AsyncSessionLocal if leer_del_primario(request) else AsyncSessionLectura
+    async with fabrica() as session:
+        yield session
+
+# Middleware: marca con una cookie de vida corta a los clientes que acaban
+# de escribir, para que get_read_session los mande al primario
+async def marcar_escrituras(request: Request, call_next):
+    response = await call_next(request)
+    if (
+        engine_lectura is not engine
+        and request.method not in ("GET", "HEAD", "OPTIONS")
+        and response.status_code < 400
+    ):
+        response.set_cookie(
+            COOKIE_ESCRITURA_RECIENTE, "1",
+            max_age=VENTANA_LECTURA_PRIMARIO, httponly=True, samesite="lax"
+        )
+    return response
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+import os
+
+from sqlalchemy import TIMESTAMP, column, func, literal, literal_column, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from models import FranjaRetiro, Reserva
+
+# ---------------------------------------------------------
+# Franjas de retiro en farmacia
+#
+# El día se divide en franjas de FRANJA_MINUTOS, cada una con cupo para
+# FRANJA_CAPACIDAD reservas. FranjaRetiro guarda por franja cuántas
+# reservas tiene (ocupadas) y cuántas están confirmadas; los contadores
+# se actualizan con un upsert/UPDATE atómico al crear y confirmar
+# reservas, así la disponibilidad nunca cuenta filas de reserva.
+#
+# Las franjas se alinean con date_bin desde ORIGEN. Si se cambia
+# FRANJA_MINUTOS con reservas futuras ya tomadas, sus contadores quedan
+# en las franjas anteriores: hay que recalcularlos (ver la migración 0010).
+# ---------------------------------------------------------
+
+DURACION = timedelta(minutes=int(os.getenv("FRANJA_MINUTOS", "15")))
+CAPACIDAD = int(os.getenv("FRANJA_CAPACIDAD", "20"))
+ORIGEN = datetime(2000, 1, 1)
+
+# Rango máximo de una consulta de disponibilidad
+DIAS_MAXIMOS_CONSULTA = int(os.getenv("FRANJA_DIAS_MAXIMOS", "31"))
+
+def inicio_franja(fecha):
+    # Expresión SQL del inicio de la franja de una fecha (valor o columna).
+    # Se calcula en la base para convertir la zona horaria igual que al guardar.
+    return func.date_bin(DURACION, fecha, ORIGEN)
+
+async def ocupar(session: AsyncSession, fecha: datetime) -> bool:
+    # Toma un cupo de la franja de `fecha` para una reserva sin confirmar
+    # (confirmar() la cuenta después); devuelve False si está llena.
+    # No hace commit.
+    stmt = pg_insert(FranjaRetiro).values(
+        inicio=inicio_franja(fecha),
+        ocupadas=1,
+        confirmadas=0
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[FranjaRetiro.inicio],
+        set_={"ocupadas": FranjaRetiro.ocupadas + 1},
+        where=FranjaRetiro.ocupadas < CAPACIDAD
+    ).returning(FranjaRetiro.ocupadas)
+    result = await session.execute(stmt)
+    return result.first() is not None
+
+async def confirmar(session: AsyncSession, ids_reserva: list):
+    # Suma las reservas confirmadas a sus franjas, un UPDATE para todas.
+    # No hace commit.
+    por_franja = (
+        select(inicio_franja(Reserva.fecha).label("inicio"), func.count().label("reservas"))
+        .where(Reserva.id_reserva.in_(ids_reserva), Reserva.fecha.is_not(None))
+        # Por la etiqueta: la expresión repetida llevaría otros parámetros
+        .group_by(literal_column("inicio"))
+        .subquery("por_franja")
+    )
+    await session.execute(
+        update(FranjaRetiro)
+        .where(FranjaRetiro.inicio == por_franja.c.inicio)
+        .values(confirmadas=FranjaRetiro.confirmadas + por_franja.c.reservas)
+        .execution_options(synchronize_session=False)
+    )
+
+async def disponibilidad(session: AsyncSession, desde: datetime, hasta: datetime, solo_disponibles: bool = False):
+    # Franjas que empiezan en [desde, hasta), con sus contadores; las que no
+    # tienen fila en FranjaRetiro están vacías
+    serie = (
+        func.generate_series(inicio_franja(desde), hasta, DURACION)
+        .table_valued(column("inicio", TIMESTAMP))
+        .alias("serie")
+    )
+    ocupadas = func.coalesce(FranjaRetiro.ocupadas, 0)
+    disponibles = func.greatest(literal(CAPACIDAD) - ocupadas, 0)
+
+    stmt = (
+        select(
+            serie.c.inicio,
+            (serie.c.inicio + DURACION).label("fin"),
+            literal(CAPACIDAD).label("capacidad"),
+            ocupadas.label("ocupadas"),
+            func.coalesce(FranjaRetiro.confirmadas, 0).label("confirmadas"),
+            disponibles.label("disponibles"),
+        )
+        .select_from(serie)
+        .outerjoin(FranjaRetiro, FranjaRetiro.inicio == serie.c.inicio)
+        .where(serie.c.inicio >= desde, serie.c.inicio < hasta)
+        .order_by(serie.c.inicio)
+    )
+    if solo_disponibles:
+        stmt = stmt.where(disponibles > 0)
+    result = await session.execute(stmt)
+    return result.all()
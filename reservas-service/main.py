@@ -1,21 +1,39 @@
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy import asc
+# arranque va primero: mide el tiempo desde que parte el proceso
+import arranque
+import idempotencia
+from fastapi import FastAPI, Depends, HTTPException, Query
+from sqlalchemy import and_, func, literal_column, update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
-from models import Base, Reserva, ReservaMedicamento
-from database import engine, get_session
-from pydantic import BaseModel
-from typing import List
-from datetime import datetime, timezone
+from models import MedicamentoLote, Reserva, ReservaMedicamento
+from database import get_session, get_read_session, marcar_escrituras
+from disponibilidad import consultar_disponibilidad, sumar_lineas
+from paginacion import paginar, encabezados_cursor, LIMITE_MAXIMO
+from serializacion import RespuestaJSON, respuesta_json
+from pydantic import BaseModel, Field, validator
+from typing import Dict, List, Optional, Tuple
+from datetime import date, datetime, time, timedelta, timezone
+import os
 import uuid
+import franjas
+import existencias
 
-app = FastAPI()
+app = FastAPI(default_response_class=RespuestaJSON)
+# Lecturas a la réplica (DATABASE_URL_LECTURA) salvo tras escrituras propias
+app.middleware("http")(marcar_escrituras)
+# Header Idempotency-Key en los POST de creación
+idempotencia.registrar(app)
 
-@app.on_event("startup")
-async def startup():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+# Última migración de migraciones/versiones que este servicio necesita
+VERSION_ESQUEMA = 10
+
+ESTADO_CONFIRMADO = "Confirmado"
+ESTADO_NO_CONFIRMADO = "No confirmado"
+
+# Horas después de la fecha de la reserva durante las que se mantiene el
+# stock retenido; luego el barrido de medicamentos-service lo libera
+PLAZO_RETIRO_HORAS = int(os.getenv("RESERVA_PLAZO_RETIRO_HORAS", "24"))
 
 # ----------------------
 # Pydantic Schemas
@@ -23,24 +41,58 @@ async def startup():
 
 class ReservaMedicamentoCreate(BaseModel):
     id_medicamento: uuid.UUID
-    cantidad: int
+    cantidad: int = Field(..., gt=0)
 
 class ReservaCreate(BaseModel):
     id_paciente: uuid.UUID
     fecha: datetime
-    estado: str
+    estado: str = ESTADO_NO_CONFIRMADO
     medicamentos: List[ReservaMedicamentoCreate]
 
+    # Una reserva se crea sin confirmar: confirmarla es lo que retiene el
+    # stock, y eso solo lo hace PUT /reservas/{id}
+    @validator("estado")
+    def validar_estado(cls, valor):
+        if valor == ESTADO_CONFIRMADO:
+            raise ValueError("La reserva se crea sin confirmar; se confirma con PUT /reservas/{id}")
+        return valor
+
 # ----------------------
 # Endpoints
 # ----------------------
 
-# Crear 1 reserva
+# Crear 1 reserva. Con ?verificar_stock=true antes se comprueba, en una
+# sola consulta, que haya stock vigente a la fecha de retiro para todas las
+# líneas; si falta, responde 409 con el detalle y no crea la reserva.
 @app.post("/reservas")
-async def crear_reserva(data: ReservaCreate, db: AsyncSession = Depends(get_session)):
+async def crear_reserva(
+    data: ReservaCreate,
+    verificar_stock: bool = False,
+    db: AsyncSession = Depends(get_session),
+    clave: Optional[idempotencia.ClaveIdempotencia] = Depends(idempotencia.clave_idempotencia)
+):
+    if verificar_stock:
+        disponibilidad = await consultar_disponibilidad(
+            db,
+            medicamentos=sumar_lineas((m.id_medicamento, m.cantidad) for m in data.medicamentos),
+            al=data.fecha
+        )
+        if not disponibilidad["suficiente"]:
+            await db.rollback()
+            return respuesta_json({
+                "detail": {
+                    "mensaje": "Stock insuficiente para la reserva",
+                    "medicamentos": disponibilidad["medicamentos"]
+                }
+            }, status_code=409)
+
     reserva = Reserva(id_paciente = data.id_paciente,
                       fecha = data.fecha,
-                      estado = data.estado) #Por defecto, al crear una reserva el estado debería ser "No confirmado"
+                      estado = data.estado)
+    # Toma un cupo de la franja de retiro; si está llena no se crea la reserva
+    if not await franjas.ocupar(db, data.fecha):
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="La franja de retiro está completa")
     db.add(reserva)
     await db.flush() #Esto genera id_reserva automáticamente
     for reserva_medicamento in data.medicamentos:
@@ -48,38 +100,316 @@ async def crear_reserva(data: ReservaCreate, db: AsyncSession = Depends(get_sess
                                   id_medicamento = reserva_medicamento.id_medicamento,
                                   cantidad = reserva_medicamento.cantidad)
         db.add(item)
+    respuesta = {"id_reserva": reserva.id_reserva}
+    await idempotencia.guardar_respuesta(db, clave, respuesta)
     await db.commit()
-    return {"id_reserva": reserva.id_reserva}
+    return respuesta
 
-# Obtener todas las reservas, ordenadas por fecha, de la más antigua a la más reciente
+# Obtener reservas, ordenadas por fecha, de la más antigua a la más reciente.
+# Filtros opcionales por estado, paciente y rango [fecha_desde, fecha_hasta).
+# Paginación por cursor (ver paginacion.py): sin limite ni cursor devuelve
+# todo. El cursor siguiente va en el header X-Siguiente-Cursor.
 @app.get("/reservas")
-async def obtener_reservas(db: AsyncSession = Depends(get_session)):
-    resultado = await db.execute(select(Reserva).options(selectinload(Reserva.medicamentos)).order_by(asc(Reserva.fecha)))
-    reservas = resultado.scalars().all()
-    return [
-        {
-            "id_reserva": r.id_reserva,
-            "id_paciente": r.id_paciente,
-            "fecha": r.fecha,
-            "estado": r.estado,
-            "medicamentos": [
-                {
-                    "id_medicamento": rm.id_medicamento,
-                    "cantidad": rm.cantidad
-                } for rm in r.medicamentos
-            ]
-        } for r in reservas
-    ]
-
-# Confirmar 1 reserva
+async def obtener_reservas(
+    estado: Optional[str] = None,
+    id_paciente: Optional[uuid.UUID] = None,
+    fecha_desde: Optional[datetime] = None,
+    fecha_hasta: Optional[datetime] = None,
+    limite: Optional[int] = Query(None, gt=0, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_session)
+):
+    stmt = select(Reserva.id_reserva, Reserva.id_paciente, Reserva.fecha, Reserva.estado)
+    if estado is not None:
+        stmt = stmt.where(Reserva.estado == estado)
+    if id_paciente is not None:
+        stmt = stmt.where(Reserva.id_paciente == id_paciente)
+    if fecha_desde is not None:
+        stmt = stmt.where(Reserva.fecha >= fecha_desde)
+    if fecha_hasta is not None:
+        stmt = stmt.where(Reserva.fecha < fecha_hasta)
+
+    orden = (Reserva.fecha, Reserva.id_reserva)
+    filas, siguiente = await paginar(db, stmt, orden, limite, cursor)
+
+    # Medicamentos solo de las reservas de la página, en una consulta
+    medicamentos = {fila.id_reserva: [] for fila in filas}
+    if medicamentos:
+        resultado = await db.execute(
+            select(ReservaMedicamento.id_reserva, ReservaMedicamento.id_medicamento, ReservaMedicamento.cantidad)
+            .where(ReservaMedicamento.id_reserva.in_(list(medicamentos)))
+        )
+        for rm in resultado.all():
+            medicamentos[rm.id_reserva].append({
+                "id_medicamento": rm.id_medicamento,
+                "cantidad": rm.cantidad
+            })
+
+    return respuesta_json(
+        [
+            {
+                "id_reserva": r.id_reserva,
+                "id_paciente": r.id_paciente,
+                "fecha": r.fecha,
+                "estado": r.estado,
+                "medicamentos": medicamentos[r.id_reserva]
+            } for r in filas
+        ],
+        headers=encabezados_cursor(siguiente)
+    )
+
+# Franjas de retiro que empiezan en [desde, hasta) con su cupo (ver
+# franjas.py); solo_disponibles omite las llenas
+@app.get("/reservas/franjas")
+async def obtener_franjas(
+    desde: datetime,
+    hasta: datetime,
+    solo_disponibles: bool = False,
+    db: AsyncSession = Depends(get_read_session)
+):
+    if hasta <= desde:
+        raise HTTPException(status_code=400, detail="hasta debe ser posterior a desde")
+    if hasta - desde > timedelta(days=franjas.DIAS_MAXIMOS_CONSULTA):
+        raise HTTPException(
+            status_code=400,
+            detail=f"El rango no puede superar {franjas.DIAS_MAXIMOS_CONSULTA} días"
+        )
+    filas = await franjas.disponibilidad(db, desde, hasta, solo_disponibles)
+    return respuesta_json(filas)
+
+# ----------------------
+# Confirmación con asignación de stock
+#
+# Confirmar una reserva retiene stock (ReservaLote) para todas sus líneas
+# en una sola transacción. Los lotes de cada medicamento se asignan en
+# orden FEFO con una sola consulta (lotes con stock, no vencidos antes del
+# retiro, con la cantidad acumulada de los que vencen antes) y se retienen
+# con un UPDATE condicional (existencias.reservar_lotes). Si alguna línea no
+# alcanza, no se retiene nada y la reserva sigue sin confirmar.
+# ----------------------
+
+def _plan_asignacion(id_reserva: uuid.UUID, retiro):
+    lineas = (
+        select(
+            ReservaMedicamento.id_medicamento,
+            func.coalesce(ReservaMedicamento.cantidad, 0).label("solicitado"),
+        )
+        .where(ReservaMedicamento.id_reserva == id_reserva)
+        .cte("lineas")
+    )
+
+    # cantidad > 0 va como literal para que coincida con el índice parcial
+    # idx_medicamento_lote_con_stock
+    disponibles = (
+        select(
+            MedicamentoLote.id_medicamento,
+            MedicamentoLote.id_lote,
+            MedicamentoLote.lote,
+            MedicamentoLote.fecha_vencimiento,
+            existencias.DISPONIBLE.label("cantidad"),
+            (
+                func.sum(existencias.DISPONIBLE).over(
+                    partition_by=MedicamentoLote.id_medicamento,
+                    order_by=(MedicamentoLote.fecha_vencimiento, MedicamentoLote.id_lote)
+                ) - existencias.DISPONIBLE
+            ).label("acumulado"),
+        )
+        .join(lineas, lineas.c.id_medicamento == MedicamentoLote.id_medicamento)
+        .where(
+            MedicamentoLote.cantidad > literal_column("0"),
+            existencias.DISPONIBLE > 0,
+            MedicamentoLote.fecha_vencimiento > retiro
+        )
+        .cte("disponibles")
+    )
+
+    # Solo los lotes necesarios para cubrir cada línea
+    return (
+        select(
+            lineas,
+            disponibles.c.id_lote,
+            disponibles.c.lote,
+            disponibles.c.fecha_vencimiento,
+            func.least(
+                disponibles.c.cantidad,
+                lineas.c.solicitado - disponibles.c.acumulado
+            ).label("asignado"),
+        )
+        .select_from(lineas)
+        .outerjoin(
+            disponibles,
+            and_(
+                disponibles.c.id_medicamento == lineas.c.id_medicamento,
+                disponibles.c.acumulado < lineas.c.solicitado
+            )
+        )
+        .order_by(lineas.c.id_medicamento, disponibles.c.acumulado)
+    )
+
+async def _asignar_stock(db: AsyncSession, id_reserva: uuid.UUID, fecha: Optional[datetime]) -> Tuple[bool, List[dict]]:
+    # Devuelve si todas las líneas quedaron cubiertas y el detalle por línea.
+    # No hace commit; si no se cubren todas, no retiene nada.
+    retiro = func.greatest(fecha, func.localtimestamp())
+
+    # Bloquea los lotes candidatos (en orden de id, para no cruzarse con
+    # otra confirmación) antes de calcular la asignación sobre ellos
+    await db.execute(
+        select(MedicamentoLote.id_lote)
+        .where(
+            MedicamentoLote.id_medicamento.in_(
+                select(ReservaMedicamento.id_medicamento)
+                .where(ReservaMedicamento.id_reserva == id_reserva)
+            ),
+            MedicamentoLote.cantidad > literal_column("0")
+        )
+        .order_by(MedicamentoLote.id_lote)
+        .with_for_update()
+    )
+
+    resultado = await db.execute(_plan_asignacion(id_reserva, retiro))
+    lineas: Dict[uuid.UUID, dict] = {}
+    asignaciones: Dict[uuid.UUID, int] = {}
+    for fila in resultado.all():
+        linea = lineas.setdefault(fila.id_medicamento, {
+            "id_medicamento": fila.id_medicamento,
+            "solicitado": fila.solicitado,
+            "asignado": 0,
+            "lotes": []
+        })
+        if fila.id_lote is None:
+            continue
+        linea["asignado"] += fila.asignado
+        linea["lotes"].append({
+            "id_lote": fila.id_lote,
+            "lote": fila.lote,
+            "fecha_vencimiento": fila.fecha_vencimiento,
+            "cantidad": fila.asignado
+        })
+        asignaciones[fila.id_lote] = fila.asignado
+
+    for linea in lineas.values():
+        linea["suficiente"] = linea["asignado"] >= linea["solicitado"]
+    completa = all(linea["suficiente"] for linea in lineas.values())
+
+    if completa and asignaciones:
+        expira_en = retiro + timedelta(hours=PLAZO_RETIRO_HORAS)
+        # Con los lotes bloqueados no debería fallar; si falla, no se confirma
+        retenidas = await existencias.reservar_lotes(db, asignaciones, expira_en, id_reserva)
+        completa = retenidas is not None
+        if completa:
+            # Con id_reserva_lote se entrega lo retenido al retirar
+            # (POST /medicamentos/reservas/{id_reserva_lote}/entrega)
+            for linea in lineas.values():
+                for lote in linea["lotes"]:
+                    lote["id_reserva_lote"] = retenidas[lote["id_lote"]]
+    return completa, list(lineas.values())
+
+# Confirmar 1 reserva: retiene el stock de todas sus líneas o ninguna.
+# Responde 409 con el detalle por línea si alguna no alcanza.
 @app.put("/reservas/{id_reserva}")
 async def confirmar_reserva(id_reserva: uuid.UUID,
                             db: AsyncSession = Depends(get_session)):
-    resultado = await db.execute(select(Reserva).where(Reserva.id_reserva == id_reserva))
+    resultado = await db.execute(
+        select(Reserva).where(Reserva.id_reserva == id_reserva).with_for_update()
+    )
     reserva = resultado.scalar_one_or_none()
     if not reserva:
         raise HTTPException(status_code=404, detail="Reserva no encontrada")
-    reserva.estado = "Confirmado"
+    if reserva.estado == ESTADO_CONFIRMADO:
+        raise HTTPException(status_code=409, detail="La reserva ya fue confirmada")
+
+    completa, lineas = await _asignar_stock(db, reserva.id_reserva, reserva.fecha)
+    if not completa:
+        await db.rollback()
+        return respuesta_json({
+            "detail": {
+                "mensaje": "Stock insuficiente para confirmar la reserva",
+                "lineas": lineas
+            }
+        }, status_code=409)
+
+    reserva.estado = ESTADO_CONFIRMADO
+    await franjas.confirmar(db, [reserva.id_reserva])
     await db.commit()
-    await db.refresh(reserva)
-    return reserva
\ No newline at end of file
+    return respuesta_json({
+        "id_reserva": reserva.id_reserva,
+        "id_paciente": reserva.id_paciente,
+        "fecha": reserva.fecha,
+        "estado": reserva.estado,
+        "lineas": lineas
+    })
+
+# Confirmar todas las reservas sin confirmar de un día, de la más antigua a
+# la más reciente. Cada reserva se confirma en su propia transacción, como
+# PUT /reservas/{id}: así bloquea lotes, resumen y LoteProximo en el mismo
+# orden que las entregas y las confirmaciones sueltas. Retener varias
+# reservas en una transacción volvería a pedir lotes con el resumen ya
+# bloqueado y podría cruzarse con ellas (deadlock). Las que no alcanzan
+# quedan sin confirmar; las que otra petición está confirmando en ese
+# momento se omiten.
+@app.post("/reservas/confirmacion")
+async def confirmar_reservas_del_dia(dia: date, db: AsyncSession = Depends(get_session)):
+    desde = datetime.combine(dia, time.min)
+    resultado = await db.execute(
+        select(Reserva.id_reserva)
+        .where(
+            Reserva.fecha >= desde,
+            Reserva.fecha < desde + timedelta(days=1),
+            Reserva.estado.is_distinct_from(ESTADO_CONFIRMADO)
+        )
+        .order_by(Reserva.fecha, Reserva.id_reserva)
+    )
+    ids_reserva = resultado.scalars().all()
+    await db.rollback()
+
+    confirmadas = 0
+    detalle = []
+    for id_reserva in ids_reserva:
+        resultado = await db.execute(
+            select(Reserva.id_reserva, Reserva.fecha)
+            .where(
+                Reserva.id_reserva == id_reserva,
+                Reserva.estado.is_distinct_from(ESTADO_CONFIRMADO)
+            )
+            .with_for_update(skip_locked=True)
+        )
+        reserva = resultado.first()
+        if reserva is None:
+            # Confirmada o en confirmación por otra petición
+            await db.rollback()
+            continue
+
+        completa, lineas = await _asignar_stock(db, reserva.id_reserva, reserva.fecha)
+        if completa:
+            await db.execute(
+                update(Reserva)
+                .where(Reserva.id_reserva == reserva.id_reserva)
+                .values(estado=ESTADO_CONFIRMADO)
+                .execution_options(synchronize_session=False)
+            )
+            await franjas.confirmar(db, [reserva.id_reserva])
+            await db.commit()
+            confirmadas += 1
+        else:
+            await db.rollback()
+        detalle.append({"id_reserva": reserva.id_reserva, "confirmada": completa, "lineas": lineas})
+
+    return respuesta_json({
+        "dia": dia,
+        "confirmadas": confirmadas,
+        "sin_stock": len(detalle) - confirmadas,
+        "reservas": detalle
+    })
+
+
+# Consultas frecuentes que se ejecutan una vez al arrancar
+arranque.registrar(app, VERSION_ESQUEMA, [
+    ("reserva", lambda db: db.execute(
+        select(Reserva)
+        .options(selectinload(Reserva.medicamentos))
+        .where(Reserva.id_reserva == arranque.ID_CALENTAMIENTO)
+    )),
+    ("plan de asignación", lambda db: db.execute(
+        _plan_asignacion(arranque.ID_CALENTAMIENTO, func.localtimestamp())
+    )),
+])
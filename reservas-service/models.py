@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, ForeignKey, text, Integer, TIMESTAMP
+from sqlalchemy import Column, String, ForeignKey, text, Integer, TIMESTAMP, Computed, Numeric
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship, declarative_base
 import uuid
@@ -72,6 +72,9 @@ class Medicamento(Base):
 
     id_medicamento = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
     nombre = Column(String(100))
+    codigo_barras = Column(UUID(as_uuid=True), unique=True)
+    dosis_concentracion = Column(String(100))
+    via_administracion = Column(String(100))
 
     #reservas-service
     reservas_medicamentos = relationship("ReservaMedicamento", back_populates="medicamento")
@@ -87,17 +90,46 @@ class MedicamentoPrincipio(Base):
 class MedicamentoLote(Base):
     __tablename__ = "medicamento_lote"
 
-    codigo_barras = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
+    id_lote = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
     id_medicamento = Column(UUID(as_uuid=True), ForeignKey("medicamento.id_medicamento"))
     lote = Column(String(50))
     fecha_vencimiento = Column(TIMESTAMP)
     cantidad = Column(Integer)
+    cantidad_reservada = Column(Integer, nullable=False, server_default=text("0"))
     cantidad_defectuosa = Column(Integer)
     cantidad_en_idea = Column(Integer)
     cantidad_en_estado = Column(Integer)
     cantidad_envase_roto = Column(Integer)
-    dosis_concentracion = Column(String(100))
-    via_administracion = Column(String(100))
+
+
+class ReservaLote(Base):
+    __tablename__ = "reserva_lote"
+
+    id_reserva_lote = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
+    id_lote = Column(UUID(as_uuid=True), ForeignKey("medicamento_lote.id_lote"), nullable=False)
+    cantidad = Column(Integer, nullable=False)
+    creada_en = Column(TIMESTAMP, nullable=False, server_default=text("localtimestamp"))
+    expira_en = Column(TIMESTAMP, nullable=False)
+    # Reserva de retiro (reservas-service) a la que pertenece, si la hay
+    id_reserva = Column(UUID(as_uuid=True), ForeignKey("reserva.id_reserva"))
+
+
+class StockMedicamento(Base):
+    __tablename__ = "stock_medicamento"
+
+    id_medicamento = Column(UUID(as_uuid=True), ForeignKey("medicamento.id_medicamento"), primary_key=True)
+    cantidad = Column(Integer, nullable=False, server_default=text("0"))
+    cantidad_reservada = Column(Integer, nullable=False, server_default=text("0"))
+    cantidad_defectuosa = Column(Integer, nullable=False, server_default=text("0"))
+    cantidad_disponible = Column(Integer, Computed("cantidad - cantidad_reservada"))
+    proximo_vencimiento = Column(TIMESTAMP)
+
+class LoteProximo(Base):
+    __tablename__ = "lote_proximo"
+
+    id_principio = Column(UUID(as_uuid=True), ForeignKey("principio_activo.id_principio"), primary_key=True)
+    id_lote = Column(UUID(as_uuid=True), ForeignKey("medicamento_lote.id_lote"), nullable=False)
+    fecha_vencimiento = Column(TIMESTAMP, nullable=False)
 
 
 class Prescripcion(Base):
@@ -120,6 +152,10 @@ class PrescripcionPrincipio(Base):
     id_principio = Column(UUID(as_uuid=True), ForeignKey("principio_activo.id_principio"), primary_key=True)
     duracion = Column(String(100))
     frecuencia = Column(String(100))
+    # Interpretados al crear la prescripción (prescripciones-service/dosificacion.py)
+    duracion_dias = Column(Integer)
+    tomas_por_dia = Column(Numeric(7, 3))
+    unidades_por_receta = Column(Integer)
 
     #prescripciones-service
     prescripcion = relationship("Prescripcion", back_populates="principios")
@@ -154,6 +190,14 @@ class Reserva(Base):
     paciente = relationship("Paciente", back_populates="reservas", foreign_keys=[id_paciente])
 
 
+class FranjaRetiro(Base):
+    __tablename__ = "franja_retiro"
+
+    inicio = Column(TIMESTAMP, primary_key=True)
+    ocupadas = Column(Integer, nullable=False, server_default=text("0"))
+    confirmadas = Column(Integer, nullable=False, server_default=text("0"))
+
+
 class ReservaMedicamento(Base):
     __tablename__ = "reserva_medicamento"
 